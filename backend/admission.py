@@ -0,0 +1,339 @@
+"""
+Admission control in front of the endpoints that spend paid upstream quota.
+
+Each limited route has two token buckets, one per client and one shared by
+all clients, and may draw on an upstream budget: a cap on how many requests
+can be using that upstream (Gemini, OpenRouter) at once. A request that
+finds the budget full waits in a short queue for a slot; if the queue is
+full or the wait exceeds its deadline, the request is shed. Every rejection
+is a 429 with Retry-After, so a burst degrades into fast, retryable
+refusals instead of upstream quota errors for everyone in flight.
+
+Limits are set per route from the environment, e.g.
+
+    ADMISSION_GENERATE_STORY_CLIENT_RATE=0.2    # requests/second per client
+    ADMISSION_GENERATE_STORY_CLIENT_BURST=5
+    ADMISSION_GENERATE_STORY_ROUTE_RATE=5       # requests/second for all clients
+    ADMISSION_GENERATE_STORY_ROUTE_BURST=20
+    UPSTREAM_GEMINI_CONCURRENCY=16
+
+Route paths may contain {parameters}, which match one path segment.
+
+Clients are identified by their socket address. Behind a reverse proxy set
+ADMISSION_CLIENT_HEADER (e.g. x-forwarded-for) and ADMISSION_TRUSTED_PROXIES
+to the number of proxies in front of the app: the client is then the address
+the outermost trusted proxy appended, never an entry the client could write.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from cache import TTLCache
+from observability import metrics
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Header that carries the real client address behind a proxy (empty: use the socket peer)
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "").lower()
+# Proxies that append to that header; the client is the hop the outermost one recorded
+ADMISSION_TRUSTED_PROXIES = int(os.getenv("ADMISSION_TRUSTED_PROXIES", "1"))
+ADMISSION_MAX_WAITERS = int(os.getenv("ADMISSION_MAX_WAITERS", "32"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+ADMISSION_TRACKED_CLIENTS = 10000
+
+ADMISSION_DECISIONS = metrics.counter(
+    "kala_admission_decisions_total", "Admission decisions by route and outcome", ("route", "outcome"))
+ADMISSION_WAIT = metrics.histogram(
+    "kala_admission_wait_seconds", "Time admitted requests waited for an upstream slot", ("upstream",))
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait(self) -> float:
+        """Seconds until a token is available, 0 if one is available now. Takes nothing."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self) -> float:
+        """Takes a token and returns 0, or returns how many seconds until one is available"""
+        wait = self.wait()
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class UpstreamBudget:
+    """
+    Caps concurrent requests to one upstream. Requests beyond the cap wait in
+    FIFO order, but only `max_waiters` of them, and each for at most `max_wait`.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiters: int = ADMISSION_MAX_WAITERS,
+                 max_wait: float = ADMISSION_MAX_WAIT):
+        self.name = name
+        self.limit = limit
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """Takes a slot; returns None on success or the reason the request was shed"""
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return None
+        if len(self._waiters) >= self.max_waiters:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                return "wait_timeout"
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()  # the slot was already handed to us
+            else:
+                self._waiters.remove(waiter)
+            raise
+        ADMISSION_WAIT.observe(time.monotonic() - start, upstream=self.name)
+        return None  # release() handed its slot over, in_use already counts it
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_use -= 1
+
+
+@dataclass
+class RouteLimit:
+    client_rate: float
+    client_burst: float
+    route_rate: float
+    route_burst: float
+    upstream: Optional[str] = None
+
+
+DEFAULT_ROUTE_LIMITS = {
+    "/generate-story": RouteLimit(0.2, 5, 5, 20, "gemini"),
+    "/complete-story": RouteLimit(0.2, 5, 5, 20, "gemini"),
+    "/complete-story-stream": RouteLimit(0.2, 5, 5, 20, "gemini"),
+    "/get-pricing": RouteLimit(0.5, 10, 10, 30, "gemini"),
+    "/translate": RouteLimit(1, 20, 20, 50, "gemini"),
+    "/translate-batch": RouteLimit(0.2, 5, 5, 20, "gemini"),
+    # A batch makes many Gemini calls itself, each capped by the model's concurrency limit
+    "/generate-story-batch": RouteLimit(0.01, 3, 0.2, 5),
+    "/generate-story-batch/{batch_id}/retry": RouteLimit(0.01, 3, 0.2, 5),
+    "/craft-pipeline": RouteLimit(0.1, 3, 2, 10, "gemini"),
+    "/generate-mockup": RouteLimit(0.05, 3, 0.5, 5, "openrouter"),
+    "/mockup-jobs": RouteLimit(0.1, 5, 2, 20),
+}
+
+DEFAULT_UPSTREAM_CONCURRENCY = {"gemini": 16, "openrouter": 4}
+
+
+def route_env_prefix(path: str) -> str:
+    """ADMISSION_GENERATE_STORY for /generate-story; {parameter} segments are left out"""
+    segments = [s for s in path.strip("/").split("/") if not s.startswith("{")]
+    return "ADMISSION_" + "_".join(segments).replace("-", "_").upper()
+
+
+def route_pattern(path: str) -> "re.Pattern":
+    """Regex matching a route path whose {parameters} stand for one segment each"""
+    return re.compile("^" + re.sub(r"\\\{[^/]+?\\\}", "[^/]+", re.escape(path)) + "$")
+
+
+def limits_from_env(defaults: Dict[str, RouteLimit] = None) -> Dict[str, RouteLimit]:
+    limits = {}
+    for path, default in (defaults or DEFAULT_ROUTE_LIMITS).items():
+        prefix = route_env_prefix(path)
+        limits[path] = RouteLimit(
+            float(os.getenv(f"{prefix}_CLIENT_RATE", default.client_rate)),
+            float(os.getenv(f"{prefix}_CLIENT_BURST", default.client_burst)),
+            float(os.getenv(f"{prefix}_ROUTE_RATE", default.route_rate)),
+            float(os.getenv(f"{prefix}_ROUTE_BURST", default.route_burst)),
+            default.upstream,
+        )
+    return limits
+
+
+def budgets_from_env(defaults: Dict[str, int] = None) -> Dict[str, UpstreamBudget]:
+    return {
+        name: UpstreamBudget(name, int(os.getenv(f"UPSTREAM_{name.upper()}_CONCURRENCY", limit)))
+        for name, limit in (defaults or DEFAULT_UPSTREAM_CONCURRENCY).items()
+    }
+
+
+class AdmissionController:
+    """Decides whether a request to a limited route may start"""
+
+    def __init__(self, limits: Dict[str, RouteLimit], budgets: Dict[str, UpstreamBudget]):
+        self.limits = limits
+        self.budgets = budgets
+        self._route_buckets = {path: TokenBucket(l.route_rate, l.route_burst) for path, l in limits.items()}
+        self._client_buckets = TTLCache(maxsize=ADMISSION_TRACKED_CLIENTS, ttl=3600)
+        self._patterns = [(route_pattern(path), path) for path in limits if "{" in path]
+
+    def route_for(self, path: str) -> Optional[str]:
+        """The limited route a request path falls under, or None"""
+        if path in self.limits:
+            return path
+        for pattern, route in self._patterns:
+            if pattern.match(path):
+                return route
+        return None
+
+    def _client_bucket(self, path: str, client: str) -> TokenBucket:
+        key = f"{path}|{client}"
+        bucket = self._client_buckets.get(key)
+        if bucket is None:
+            limit = self.limits[path]
+            bucket = TokenBucket(limit.client_rate, limit.client_burst)
+            self._client_buckets.set(key, bucket)
+        return bucket
+
+    async def admit(self, path: str, client: str) -> Tuple[Optional[str], float]:
+        """
+        Returns (None, 0) when the request is admitted - it then holds a slot
+        of its upstream budget until release() - or (reason, retry_after).
+        """
+        limit = self.limits[path]
+        client_bucket, route_bucket = self._client_bucket(path, client), self._route_buckets[path]
+        # Check both before taking from either, so a rejection costs the client nothing
+        wait = client_bucket.wait()
+        if wait:
+            return "rate_limited_client", wait
+        wait = route_bucket.wait()
+        if wait:
+            return "rate_limited_route", wait
+        client_bucket.take()
+        route_bucket.take()
+
+        budget = self.budgets.get(limit.upstream) if limit.upstream else None
+        if budget is not None:
+            reason = await budget.acquire()
+            if reason:
+                return f"shed_{reason}", budget.max_wait
+        return None, 0.0
+
+    def release(self, path: str):
+        upstream = self.limits[path].upstream
+        if upstream in self.budgets:
+            self.budgets[upstream].release()
+
+    def collect_metrics(self):
+        yield "kala_admission_limit", "gauge", "Configured token-bucket limits per route", {
+            (("route", path), ("limit", name)): getattr(limit, name)
+            for path, limit in self.limits.items()
+            for name in ("client_rate", "client_burst", "route_rate", "route_burst")
+        }
+        yield "kala_upstream_budget_limit", "gauge", "Concurrent requests allowed per upstream", {
+            (("upstream", name),): budget.limit for name, budget in self.budgets.items()
+        }
+        yield "kala_upstream_budget_in_use", "gauge", "Requests holding an upstream slot", {
+            (("upstream", name),): budget.in_use for name, budget in self.budgets.items()
+        }
+        yield "kala_upstream_budget_waiting", "gauge", "Requests queued for an upstream slot", {
+            (("upstream", name),): budget.waiting for name, budget in self.budgets.items()
+        }
+
+    def status(self) -> dict:
+        return {
+            "routes": {path: vars(limit) for path, limit in self.limits.items()},
+            "upstreams": {
+                name: {"limit": b.limit, "in_use": b.in_use, "waiting": b.waiting, "max_wait": b.max_wait}
+                for name, b in self.budgets.items()
+            },
+        }
+
+
+def create_admission_controller() -> AdmissionController:
+    return AdmissionController(limits_from_env(), budgets_from_env())
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware applying an AdmissionController to POST requests on
+    the limited routes. The upstream slot is held until the response has
+    been sent, so streamed responses count for as long as they run.
+    """
+
+    def __init__(self, app, controller: AdmissionController, enabled: bool = ADMISSION_ENABLED,
+                 client_header: str = ADMISSION_CLIENT_HEADER, trusted_proxies: int = ADMISSION_TRUSTED_PROXIES):
+        self.app = app
+        self.controller = controller
+        self.enabled = enabled
+        self.client_header = client_header.encode()
+        self.trusted_proxies = trusted_proxies
+
+    def client_id(self, scope) -> str:
+        """
+        The socket peer, or with a proxy header configured, the address the
+        outermost trusted proxy appended. Entries left of it are client-supplied
+        and ignored; a header with fewer hops than trusted proxies didn't come
+        through them, so the peer is used.
+        """
+        if self.client_header and self.trusted_proxies > 0:
+            hops = [hop.strip()
+                    for name, value in scope.get("headers") or [] if name == self.client_header
+                    for hop in value.decode("latin-1").split(",")]
+            if len(hops) >= self.trusted_proxies and hops[-self.trusted_proxies]:
+                return hops[-self.trusted_proxies]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        route = self.controller.route_for(scope.get("path", "")) if scope["type"] == "http" else None
+        if not self.enabled or route is None or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+
+        reason, retry_after = await self.controller.admit(route, self.client_id(scope))
+        ADMISSION_DECISIONS.inc(route=route, outcome=reason or "admitted")
+        if reason:
+            return await self._reject(send, reason, retry_after)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route)
+
+    async def _reject(self, send, reason: str, retry_after: float):
+        retry_after = max(1, math.ceil(min(retry_after, 3600)))
+        body = json.dumps({"error": "Too many requests - please try again shortly", "reason": reason,
+                           "retry_after": retry_after}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
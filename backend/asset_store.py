@@ -0,0 +1,252 @@
+"""
+Content-addressed storage for generated assets (mockups, QR codes).
+
+Files are named by the sha256 of their content, so identical outputs are
+stored once and two users can never overwrite each other's files. Because a
+name never changes meaning, assets are served with an ETag and an immutable
+Cache-Control header. LocalDiskBackend and GCSBackend share one interface.
+"""
+import asyncio
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Dict, Optional, Union
+
+from executors import run_cpu, run_io
+
+ASSET_URL_PREFIX = "/assets"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+THUMBNAIL_EDGE = int(os.getenv("ASSET_THUMBNAIL_EDGE", "320"))
+WEBP_QUALITY = int(os.getenv("ASSET_WEBP_QUALITY", "82"))
+# Decoded bytes buffered in memory before each write when spooling a stream to disk
+SPOOL_WRITE_BUFFER = int(os.getenv("ASSET_SPOOL_WRITE_BUFFER", str(1024 * 1024)))
+
+ASSET_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}(_[a-z0-9]+)?\.(png|jpg|gif|webp|svg)$")
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/svg+xml": "svg",
+}
+
+
+def content_type_for(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class LocalDiskBackend:
+    """Stores assets as files in a local directory"""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def write(self, name: str, data: bytes):
+        # Write to a temp file and rename so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def write_file(self, name: str, path: str):
+        """Moves a finished file (in the same directory tree) into place"""
+        os.replace(path, self.path(name))
+
+    def read(self, name: str) -> bytes:
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def url(self, name: str) -> str:
+        return f"{ASSET_URL_PREFIX}/{name}"
+
+
+class GCSBackend:
+    """Stores assets in a Google Cloud Storage bucket (same project as Firebase)"""
+
+    name = "gcs"
+
+    def __init__(self, bucket_name: str, prefix: str = "assets/", public_base_url: str = ""):
+        from google.cloud import storage
+
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def exists(self, name: str) -> bool:
+        return self.bucket.blob(self.prefix + name).exists()
+
+    def write(self, name: str, data: bytes):
+        blob = self.bucket.blob(self.prefix + name)
+        blob.cache_control = IMMUTABLE_CACHE_CONTROL
+        blob.upload_from_string(data, content_type=content_type_for(name))
+
+    def write_file(self, name: str, path: str):
+        blob = self.bucket.blob(self.prefix + name)
+        blob.cache_control = IMMUTABLE_CACHE_CONTROL
+        blob.upload_from_filename(path, content_type=content_type_for(name))
+
+    def read(self, name: str) -> bytes:
+        return self.bucket.blob(self.prefix + name).download_as_bytes()
+
+    def url(self, name: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{name}"
+        return f"{ASSET_URL_PREFIX}/{name}"
+
+
+@dataclass
+class StoredAsset:
+    name: str
+    url: str
+    size: int
+    deduplicated: bool
+    variants: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class SpooledFile:
+    """A temporary file written from a stream, with its sha256 and size"""
+    path: str
+    sha256: str
+    size: int
+
+
+def make_image_variants(data: Union[bytes, str], thumbnail_edge: int = THUMBNAIL_EDGE) -> Dict[str, bytes]:
+    """
+    Builds the responsive variants of an image (bytes or a file path): a
+    full-size WebP and a WebP thumbnail
+    """
+    from PIL import Image
+
+    variants = {}
+    with Image.open(io.BytesIO(data) if isinstance(data, bytes) else data) as image:
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=WEBP_QUALITY)
+        variants["webp"] = buffer.getvalue()
+
+        image.thumbnail((thumbnail_edge, thumbnail_edge))
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=WEBP_QUALITY)
+        variants["thumb"] = buffer.getvalue()
+    return variants
+
+
+class AssetStore:
+    """Content-addressed asset store with async writes and dedupe"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {"writes": 0, "deduplicated": 0, "bytes_written": 0}
+
+    async def put(self, data: bytes, mime_type: str, name: Optional[str] = None) -> StoredAsset:
+        """Stores `data` under its content hash (or `name`), skipping the write if it exists"""
+        name = name or f"{hashlib.sha256(data).hexdigest()}.{EXTENSIONS.get(mime_type, 'bin')}"
+        if await run_io(self.backend.exists, name):
+            self.stats["deduplicated"] += 1
+            return StoredAsset(name, self.backend.url(name), len(data), deduplicated=True)
+
+        await run_io(self.backend.write, name, data)
+        self.stats["writes"] += 1
+        self.stats["bytes_written"] += len(data)
+        return StoredAsset(name, self.backend.url(name), len(data), deduplicated=False)
+
+    async def put_image(self, data: bytes, mime_type: str) -> StoredAsset:
+        """Stores an image plus its thumbnail and WebP variants"""
+        digest = hashlib.sha256(data).hexdigest()
+        asset = await self.put(data, mime_type)
+        await self._put_variants(asset, digest, data, check_existing=asset.deduplicated)
+        return asset
+
+    async def _put_variants(self, asset: StoredAsset, digest: str, source: Union[bytes, str], check_existing: bool):
+        variant_names = {key: f"{digest}_{key}.webp" for key in ("thumb", "webp")}
+        if not check_existing or not all(
+            await asyncio.gather(*(run_io(self.backend.exists, n) for n in variant_names.values()))
+        ):
+            variants = await run_cpu(make_image_variants, source)
+            await asyncio.gather(*(self.put(variants[key], "image/webp", name=name)
+                                   for key, name in variant_names.items()))
+
+        asset.variants = {
+            "thumbnail": self.backend.url(variant_names["thumb"]),
+            "webp": self.backend.url(variant_names["webp"]),
+        }
+
+    async def spool(self, chunks: AsyncIterable[bytes]) -> SpooledFile:
+        """
+        Writes a stream of bytes to a temporary file next to the assets,
+        hashing as it goes, so large outputs never sit in memory whole
+        """
+        fd, path = tempfile.mkstemp(dir=getattr(self.backend, "root", None), prefix=".tmp_")
+        hasher = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    buffer += chunk
+                    if len(buffer) >= SPOOL_WRITE_BUFFER:
+                        await run_io(f.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await run_io(f.write, bytes(buffer))
+        except BaseException:
+            os.unlink(path)
+            raise
+        return SpooledFile(path, hasher.hexdigest(), size)
+
+    async def put_image_file(self, spooled: SpooledFile, mime_type: str) -> StoredAsset:
+        """Like put_image for an image spooled to disk. Consumes the file."""
+        name = f"{spooled.sha256}.{EXTENSIONS.get(mime_type, 'bin')}"
+        try:
+            deduplicated = await run_io(self.backend.exists, name)
+            asset = StoredAsset(name, self.backend.url(name), spooled.size, deduplicated)
+            # Variants are built from the spooled file before it is moved into place
+            await self._put_variants(asset, spooled.sha256, spooled.path, check_existing=deduplicated)
+            if deduplicated:
+                self.stats["deduplicated"] += 1
+            else:
+                await run_io(self.backend.write_file, name, spooled.path)
+                self.stats["writes"] += 1
+                self.stats["bytes_written"] += spooled.size
+            return asset
+        finally:
+            if os.path.exists(spooled.path):
+                os.unlink(spooled.path)
+
+    async def read(self, name: str) -> bytes:
+        return await run_io(self.backend.read, name)
+
+
+def create_asset_store() -> AssetStore:
+    """Build the asset store from environment variables"""
+    if os.getenv("ASSET_BACKEND", "local").lower() == "gcs":
+        backend = GCSBackend(
+            os.getenv("ASSET_BUCKET", ""),
+            prefix=os.getenv("ASSET_PREFIX", "assets/"),
+            public_base_url=os.getenv("ASSET_PUBLIC_URL", ""),
+        )
+    else:
+        backend = LocalDiskBackend(os.getenv("ASSET_DIR", os.path.join("static", "assets")))
+    return AssetStore(backend)
@@ -0,0 +1,624 @@
+"""
+Offline load test for the API.
+
+Runs the app in-process against local stand-ins for Gemini, OpenRouter and
+Firestore, each with a configurable latency and error profile, so no keys
+or network are needed. Every endpoint is driven at each concurrency level,
+and the run reports throughput, p50/p95/p99 latency, event-loop lag (how
+long the loop was blocked) and peak RSS of the server and its worker
+processes. Results are written to a JSON file per run; pass --compare to
+diff against an earlier one.
+
+Each scenario runs in two modes. "cached" repeats a small set of inputs, as
+a warm production cache would see them. "uncached" gives every request
+unique inputs and turns the in-memory caches off, so normalization,
+encoding and the upstream calls run every time; blocking and memory
+regressions show up there.
+
+    python benchmark.py
+    python benchmark.py --concurrency 1,16,64 --requests 400 --gemini-latency 0.5
+    python benchmark.py --endpoints complete-story,story --compare benchmark_results/<earlier>.json
+    python benchmark.py --modes uncached --endpoints generate-story,generate-mockup
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+ENDPOINTS = ["generate-story", "complete-story", "translate", "generate-mockup", "generate-qr", "story", "stories"]
+MODES = ["cached", "uncached"]
+UNCACHED_FIRST_INDEX = 1_000_000
+ART_FORMS = ["Madhubani", "Bidriware", "Chikankari", "Warli"]
+
+
+@dataclass
+class UpstreamProfile:
+    """How a fake upstream behaves: base latency, +/- jitter (seconds) and the share of calls that fail"""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+# --- Upstream stand-ins -----------------------------------------------------
+
+STORY_RESPONSE = json.dumps({
+    "instagram_post": "Hand-painted Madhubani on handmade paper. " * 8,
+    "product_description": "A vibrant Madhubani painting made with natural pigments. " * 10,
+    "product_features": ["Natural Pigments", "Handmade Paper", "Hand-Painted"],
+    "art_classification": {"art_form_name": "Madhubani", "region_of_origin": "Bihar, India"},
+})
+ANALYSIS_RESPONSE = json.dumps({
+    "description": "A Madhubani painting with fish and lotus motifs.",
+    "art_form_identification": "Madhubani",
+    "questions": ["Who taught you?", "What does it mean to you?", "How long did it take?"],
+})
+
+
+class FakeGemini:
+    """LLM provider with the FakeProvider interface and a latency/error profile"""
+
+    name = "gemini-fake"
+
+    def __init__(self, profile: UpstreamProfile, chunk_size: int = 64):
+        self.profile = profile
+        self.chunk_size = chunk_size
+
+    def _respond(self, contents) -> str:
+        if self.profile.fails():
+            raise RuntimeError("fake Gemini error")
+        if isinstance(contents, list):
+            return ANALYSIS_RESPONSE
+        if "Artisan's Own Words" in str(contents):
+            return STORY_RESPONSE
+        return "अनुवादित पाठ"
+
+    async def generate(self, model_name: str, contents, **kwargs) -> str:
+        await asyncio.sleep(self.profile.delay())
+        return self._respond(contents)
+
+    async def stream(self, model_name: str, contents, **kwargs):
+        text = self._respond(contents)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        delay = self.profile.delay()
+        for chunk in chunks:
+            await asyncio.sleep(delay / len(chunks))
+            yield chunk
+
+
+def openrouter_transport(profile: UpstreamProfile, image: bytes) -> httpx.MockTransport:
+    """OpenRouter chat completions stand-in that answers with a base64 image"""
+    payload = json.dumps({"choices": [{"message": {"images": [
+        {"image_url": {"url": "data:image/png;base64," + base64.b64encode(image).decode()}}
+    ]}}]}).encode()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(profile.delay())
+        if profile.fails():
+            return httpx.Response(503, json={"error": "fake OpenRouter error"})
+        return httpx.Response(200, content=payload, headers={"Content-Type": "application/json"})
+
+    return httpx.MockTransport(handler)
+
+
+class FakeDocument:
+    def __init__(self, data: Optional[dict]):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeQuery:
+    """The query calls /stories makes: where(==), order_by, select, start_after, limit and stream"""
+
+    def __init__(self, firestore: "FakeFirestore", docs: List[dict], fields: Optional[List[str]] = None,
+                 descending: bool = False):
+        self.firestore = firestore
+        self.docs = docs
+        self.fields = fields
+        self.descending = descending
+
+    def _derive(self, docs, **changes):
+        options = {"fields": self.fields, "descending": self.descending, **changes}
+        return FakeQuery(self.firestore, docs, **options)
+
+    def where(self, filter):
+        return self._derive([d for d in self.docs if d.get(filter.field_path) == filter.value])
+
+    def order_by(self, field, direction="ASCENDING"):
+        descending = direction == "DESCENDING"
+        return self._derive(sorted(self.docs, key=lambda d: d[field], reverse=descending), descending=descending)
+
+    def select(self, fields):
+        return self._derive(self.docs, fields=list(fields))
+
+    def start_after(self, values):
+        (field, value), = values.items()
+        return self._derive([d for d in self.docs if (d[field] < value if self.descending else d[field] > value)])
+
+    def limit(self, n):
+        return self._derive(self.docs[:n])
+
+    def stream(self):
+        self.firestore._call()
+        for doc in self.docs:
+            yield FakeDocument({k: v for k, v in doc.items() if self.fields is None or k in self.fields})
+
+
+class FakeFirestore:
+    """
+    Blocking Firestore stand-in (the real client is blocking too). Supports
+    the calls the app makes: collection().document().get(), batch writes and
+    the /stories summary query. `docs` is the stories collection. The tests
+    share it too; a commit writing a document ID in `rejected` fails the way
+    Firestore fails an invalid (e.g. oversized) document.
+    """
+
+    def __init__(self, profile: Optional[UpstreamProfile] = None):
+        self.profile = profile or UpstreamProfile()
+        self.collections: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        self.docs = self.collections["stories"]
+        self.rejected = set()
+        self.commits = 0
+
+    def _call(self):
+        time.sleep(self.profile.delay())
+        if self.profile.fails():
+            raise RuntimeError("fake Firestore error")
+
+    def collection(self, name):
+        firestore = self
+
+        class Collection(FakeQuery):
+            def document(self, doc_id):
+                class Ref:
+                    id = doc_id
+                    collection = name
+
+                    def get(self):
+                        firestore._call()
+                        return FakeDocument(firestore.collections[name].get(doc_id))
+
+                return Ref()
+
+        return Collection(self, list(self.collections[name].values()))
+
+    def batch(self):
+        firestore = self
+
+        class Batch:
+            def __init__(self):
+                self.writes = []
+
+            def set(self, ref, data):
+                self.writes.append((ref, data))
+
+            def commit(self):
+                firestore._call()
+                if any(ref.id in firestore.rejected for ref, _ in self.writes):
+                    raise ValueError("fake Firestore rejected a document")
+                firestore.commits += 1
+                for ref, data in self.writes:
+                    firestore.collections[ref.collection][ref.id] = data
+
+        return Batch()
+
+
+# --- Measurement --------------------------------------------------------------
+
+def process_rss_mb(pid="self") -> float:
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def child_pids() -> List[int]:
+    """This process's children: the CPU pool workers and multiprocessing's helper"""
+    parent, pids = str(os.getpid()), []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces; the fields after it don't
+                    if f.read().rsplit(")", 1)[1].split()[1] == parent:
+                        pids.append(int(entry))
+            except (OSError, IndexError):
+                continue
+    return pids
+
+
+def current_rss_mb() -> Tuple[float, float]:
+    """(server process, its worker processes) resident memory in MB"""
+    try:
+        workers = 0.0
+        for pid in child_pids():
+            try:
+                workers += process_rss_mb(pid)
+            except (OSError, ValueError):
+                pass  # exited between listing and reading
+        return process_rss_mb(), workers
+    except (OSError, ValueError):
+        return peak_rss_mb(), 0.0  # no /proc (macOS): the parent's peak is the best we have
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class RSSSampler:
+    """
+    Samples the RSS of the server plus its worker processes from a thread, so
+    the peak is caught even while the event loop is blocked. Image work runs
+    in CPU pool processes, which the parent's own RSS doesn't include.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_total = 0.0
+        self.peak_workers = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        parent, workers = current_rss_mb()
+        self.peak_total = max(self.peak_total, parent + workers)
+        self.peak_workers = max(self.peak_workers, workers)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class LoopLagProbe:
+    """Measures how late a periodic timer fires; a blocked event loop shows up as lag"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+# --- Scenarios --------------------------------------------------------------
+
+def make_images(count: int, size: int = 1600) -> List[bytes]:
+    """Distinct JPEGs of a phone-photo-like size, so normalization does real work"""
+    from PIL import Image
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (size, size * 3 // 4), ((i * 37) % 256, (i * 91) % 256, 120)).save(buffer, "JPEG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def unique_image(image: bytes, n: int) -> bytes:
+    """The same picture with a different content hash: decoders ignore bytes after the JPEG end marker"""
+    return image + b"bench" + n.to_bytes(8, "big")
+
+
+def build_requests(images: List[bytes], story_ids: List[str],
+                   unique: bool) -> Dict[str, Callable[[httpx.AsyncClient, int], object]]:
+    """
+    Request builders by endpoint. `i` numbers the request; with `unique` it
+    is never reused within a run, so no request repeats an earlier input.
+    """
+    def pick(items, i):
+        return items[i % len(items)]
+
+    def image(i):
+        return unique_image(pick(images, i), i) if unique else pick(images, i)
+
+    def generate_story(client, i):
+        return client.post("/generate-story", data={"category": "Painting"},
+                           files={"image": ("craft.jpg", image(i), "image/jpeg")})
+
+    def complete_story(client, i):
+        return client.post("/complete-story", json={
+            "initial_description": f"A Madhubani painting, piece {i}",
+            "artisan_answers": ["My grandmother taught me", "It is our family tradition", "Three weeks"],
+        })
+
+    def translate(client, i):
+        return client.post("/translate", json={
+            "text_to_translate": f"Hand-painted with natural pigments ({i if unique else i % 50})",
+            "target_language": "Hindi", "context": "Instagram post",
+        })
+
+    def generate_mockup(client, i):
+        return client.post("/generate-mockup", data={"context": "On a marble table in soft light"},
+                           files={"image": ("craft.jpg", image(i), "image/jpeg")})
+
+    def generate_qr(client, i):
+        return client.post("/generate-qr", json={"url": f"https://kala.example/story/{i if unique else i % 100}"})
+
+    def story(client, i):
+        return client.get(f"/story/{pick(story_ids, i)}")
+
+    def stories(client, i):
+        params = {"limit": 24}
+        if i % 2:
+            params["art_form"] = pick(ART_FORMS, i // 2)
+        return client.get("/stories", params=params)
+
+    return {
+        "generate-story": generate_story,
+        "complete-story": complete_story,
+        "translate": translate,
+        "generate-mockup": generate_mockup,
+        "generate-qr": generate_qr,
+        "story": story,
+        "stories": stories,
+    }
+
+
+def app_caches(main) -> list:
+    """The app's in-memory caches (TTLCache), whose sizes the uncached mode sets to 0"""
+    from cache import TieredCache
+    tiers = [value.memory for value in vars(main).values() if isinstance(value, TieredCache)]
+    return tiers + [main.qr_service.memory]
+
+
+async def run_scenario(client: httpx.AsyncClient, make_request, total: int, concurrency: int,
+                       first: int = 0) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(first, first + total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, i)
+                failed = response.status_code >= 400 or b'"error"' in response.content[:200]
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    rss_before = sum(current_rss_mb())
+    with LoopLagProbe() as probe, RSSSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "loop_lag_max_ms": round(max(probe.lags, default=0) * 1000, 1),
+        "loop_lag_p99_ms": round(percentile(probe.lags, 99) * 1000, 1),
+        "rss_growth_mb": round(sum(current_rss_mb()) - rss_before, 1),
+        # Server plus CPU pool workers, sampled during the run
+        "peak_rss_mb": round(rss.peak_total, 1),
+        "workers_peak_rss_mb": round(rss.peak_workers, 1),
+    }
+
+
+def load_app(workdir: str):
+    """Imports the app configured for offline use, with its state under `workdir`"""
+    os.environ.update({
+        "LLM_PROVIDER": "fake",
+        "PROMPT_CACHE_ENABLED": "false",
+        "OPENROUTER_API_KEY": "bench",
+        "ASSET_DIR": os.path.join(workdir, "assets"),
+        "STORY_SPOOL_DB": os.path.join(workdir, "story_spool.sqlite3"),
+        "MOCKUP_JOB_DB": os.path.join(workdir, "mockup_jobs.sqlite3"),
+        "STORY_BATCH_DB": os.path.join(workdir, "story_batches.sqlite3"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        # One load generator looks like one client; leave rate limiting off unless asked for
+        "ADMISSION_ENABLED": os.getenv("ADMISSION_ENABLED", "false"),
+        "STARTUP_WARMUP": "false",
+    })
+    import main
+    return main
+
+
+def seed_stories(fake_db: FakeFirestore, count: int) -> List[str]:
+    """Stories (all with the same content) and their gallery summaries"""
+    from story_index import STORY_SUMMARY_COLLECTION, story_summary
+    story = json.loads(STORY_RESPONSE)
+    story_ids = [f"bench{i:015d}" for i in range(count)]
+    for i, story_id in enumerate(story_ids):
+        fake_db.docs[story_id] = story
+        summary_source = {**story, "art_classification": {"art_form_name": ART_FORMS[i % len(ART_FORMS)]}}
+        fake_db.collections[STORY_SUMMARY_COLLECTION][story_id] = story_summary(story_id, summary_source,
+                                                                                 1.7e9 + i)
+    return story_ids
+
+
+async def run_benchmark(endpoints: List[str], concurrency_levels: List[int], total: int,
+                        gemini: UpstreamProfile, openrouter: UpstreamProfile, firestore: UpstreamProfile,
+                        image_count: int = 8, modes: List[str] = MODES) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        import http_client
+        from story_store import StorySpool, StoryWriter
+
+        images = make_images(image_count)
+        fake_db = FakeFirestore(firestore)
+        # Enough stories that no uncached /story request reads one twice
+        story_ids = seed_stories(fake_db, max(50, total * len(concurrency_levels)))
+
+        main.llm.provider = FakeGemini(gemini)
+        http_client._client = httpx.AsyncClient(transport=openrouter_transport(openrouter, images[0]))
+
+        results = []
+        transport = httpx.ASGITransport(app=main.app)
+        caches = app_caches(main)
+        cache_sizes = [cache.maxsize for cache in caches]
+        async with main.lifespan(main.app):
+            # Without credentials startup leaves Firestore off; swap in the fake
+            main.db, main.firebase_enabled = fake_db, True
+            main.story_writer = StoryWriter(fake_db, StorySpool(os.path.join(workdir, "story_spool.sqlite3")))
+            main.story_writer.start()
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                for mode in modes:
+                    unique = mode == "uncached"
+                    for cache, size in zip(caches, cache_sizes):
+                        cache.clear()
+                        cache.maxsize = 0 if unique else size
+                    requests = build_requests(images, story_ids if unique else story_ids[:50], unique)
+                    for endpoint in endpoints:
+                        # Uncached inputs are numbered apart from the cached ones, which are on disk by now
+                        first = UNCACHED_FIRST_INDEX if unique else 0
+                        for concurrency in concurrency_levels:
+                            result = await run_scenario(client, requests[endpoint], total, concurrency, first)
+                            if unique:
+                                first += total
+                            results.append({"endpoint": endpoint, "mode": mode, **result})
+                            print_row(results[-1])
+
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "profiles": {"gemini": asdict(gemini), "openrouter": asdict(openrouter), "firestore": asdict(firestore)},
+            "results": results,
+        }
+
+
+# --- Reporting --------------------------------------------------------------
+
+COLUMNS = ["endpoint", "mode", "concurrency", "requests", "errors", "throughput_rps",
+           "p50_ms", "p95_ms", "p99_ms", "loop_lag_max_ms", "peak_rss_mb", "workers_peak_rss_mb"]
+
+
+def print_row(row: dict):
+    print("  ".join(f"{str(row.get(c, '')):>{max(len(c), 8)}}" for c in COLUMNS), flush=True)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(current: dict, previous: dict):
+    """Prints p95, throughput and peak RSS changes against an earlier run"""
+    # Runs from before the modes existed were all effectively cached
+    before = {(r["endpoint"], r.get("mode", "cached"), r["concurrency"]): r for r in previous["results"]}
+    print(f"\nCompared with {previous.get('commit') or '?'} ({previous.get('timestamp')}):")
+    for row in current["results"]:
+        old = before.get((row["endpoint"], row["mode"], row["concurrency"]))
+        if old is None:
+            continue
+        changes = []
+        for key in ("p95_ms", "throughput_rps", "peak_rss_mb"):
+            if old[key]:
+                changes.append(f"{key} {(row[key] - old[key]) / old[key]:+.0%}")
+        print(f"  {row['endpoint']:>16} {row['mode']:>8} c={row['concurrency']:<4} " + ", ".join(changes))
+
+
+def save_results(report: dict, output_dir: str = RESULTS_DIR) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    name = f"{report['timestamp'].replace(':', '')}_{report['commit'] or 'local'}.json"
+    path = os.path.join(output_dir, name)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated: " + ",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and level")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help="cached (repeated inputs, warm caches), uncached (unique inputs, caches off) or both")
+    for upstream, latency in (("gemini", 0.2), ("openrouter", 0.5), ("firestore", 0.02)):
+        parser.add_argument(f"--{upstream}-latency", type=float, default=latency)
+        parser.add_argument(f"--{upstream}-jitter", type=float, default=latency / 4)
+        parser.add_argument(f"--{upstream}-error-rate", type=float, default=0.0)
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {sorted(unknown)}")
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    if set(modes) - set(MODES):
+        raise SystemExit(f"Unknown modes: {sorted(set(modes) - set(MODES))}")
+
+    def profile(upstream):
+        return UpstreamProfile(getattr(args, f"{upstream}_latency"), getattr(args, f"{upstream}_jitter"),
+                               getattr(args, f"{upstream}_error_rate"))
+
+    print("  ".join(f"{c:>{max(len(c), 8)}}" for c in COLUMNS))
+    report = asyncio.run(run_benchmark(
+        endpoints, [int(c) for c in args.concurrency.split(",")], args.requests,
+        profile("gemini"), profile("openrouter"), profile("firestore"), modes=modes,
+    ))
+    print(f"\nSaved results to {save_results(report, args.output_dir)}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Managed worker pools for work that must not run on the event loop.
+
+CPU-bound work (decoding and re-encoding images, base64 of multi-megabyte
+payloads, rendering QR codes) holds the GIL, so running it in a thread
+still stalls every other request. It goes to a process pool instead, which
+lets one server worker use every core. Blocking I/O (SQLite, local files,
+SDK calls without an async API) goes to a dedicated thread pool.
+
+    data = await run_cpu(render_qr, url, size, border, "png")
+    job = await run_io(store.get, job_id)
+
+Functions sent to the CPU pool must be module-level and their arguments and
+results picklable. Both pools are created on first use and shut down by the
+app's lifespan. Each reports its queue depth, wait time and task time.
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, TypeVar
+
+from observability import get_logger, metrics
+
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", "0")) or os.cpu_count() or 1
+IO_POOL_WORKERS = int(os.getenv("IO_POOL_WORKERS", "0")) or min(32, (os.cpu_count() or 1) + 4)
+# "process" runs CPU work in worker processes; "thread" keeps it in-process (e.g. where fork/spawn is unavailable)
+CPU_POOL_MODE = os.getenv("CPU_POOL_MODE", "process").lower()
+# "spawn" starts clean interpreters; "fork" starts faster but copies the parent's threads' locks
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "spawn")
+# Recycle a worker process after this many tasks (0 = never); bounds memory creep from image libraries
+CPU_POOL_MAX_TASKS_PER_CHILD = int(os.getenv("CPU_POOL_MAX_TASKS_PER_CHILD", "0")) or None
+
+EXECUTOR_TASK_TIME = metrics.histogram(
+    "kala_executor_task_seconds", "Time tasks spent running in a worker pool", ("pool", "task"))
+EXECUTOR_WAIT_TIME = metrics.histogram(
+    "kala_executor_wait_seconds", "Time tasks waited for a free worker", ("pool",))
+
+logger = get_logger("executors")
+
+T = TypeVar("T")
+
+
+def _timed(fn: Callable[..., T], *args, **kwargs):
+    """Runs in the worker and returns (result, seconds spent running)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _noop():
+    return None
+
+
+class ManagedExecutor:
+    """A lazily created thread or process pool that records queue depth and task timings"""
+
+    def __init__(self, name: str, kind: str, workers: int, start_method: str = CPU_POOL_START_METHOD,
+                 max_tasks_per_child: Optional[int] = CPU_POOL_MAX_TASKS_PER_CHILD):
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.start_method = start_method
+        self.max_tasks_per_child = max_tasks_per_child
+        self.stats = {"completed": 0, "failed": 0, "pool_restarts": 0}
+        self.in_flight = 0
+        self._pool: Optional[Executor] = None
+
+    @property
+    def queued(self) -> int:
+        """Tasks submitted but not yet picked up by a worker"""
+        return max(0, self.in_flight - self.workers)
+
+    def _create_pool(self) -> Executor:
+        if self.kind == "process":
+            try:
+                return ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            except (OSError, ValueError, NotImplementedError) as e:
+                # No process support here (e.g. a sandbox without semaphores); keep serving from threads
+                logger.warning("process_pool_unavailable", extra={"pool": self.name, "error": str(e)})
+                self.kind = "thread"
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"kala-{self.name}")
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            self._pool = self._create_pool()
+        return self._pool
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Runs fn(*args, **kwargs) in the pool and returns its result"""
+        loop = asyncio.get_running_loop()
+        task_name = getattr(fn, "__name__", type(fn).__name__)
+        pool = self.pool
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result, run_time = await loop.run_in_executor(pool, functools.partial(_timed, fn, *args, **kwargs))
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault in a codec); replace the pool so later tasks can run
+            self.stats["failed"] += 1
+            self._restart(pool)
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.stats["completed"] += 1
+        EXECUTOR_TASK_TIME.observe(run_time, pool=self.name, task=task_name)
+        EXECUTOR_WAIT_TIME.observe(max(0.0, time.perf_counter() - start - run_time), pool=self.name)
+        return result
+
+    def _restart(self, broken: Executor):
+        if self._pool is not broken:
+            return  # another task that failed with this pool already replaced it
+        self._pool = None
+        self.stats["pool_restarts"] += 1
+        logger.warning("pool_restarted", extra={"pool": self.name})
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def warm(self):
+        """Starts every worker now, so the first real task doesn't pay for process startup"""
+        await asyncio.gather(*(self.run(_noop) for _ in range(self.workers)))
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def status(self) -> dict:
+        return {
+            **self.stats,
+            "kind": self.kind,
+            "workers": self.workers,
+            "started": self._pool is not None,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+        }
+
+
+cpu_pool = ManagedExecutor("cpu", CPU_POOL_MODE, CPU_POOL_WORKERS)
+io_pool = ManagedExecutor("io", "thread", IO_POOL_WORKERS)
+
+
+async def run_cpu(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Runs CPU-bound work in the process pool. fn and its arguments must be picklable."""
+    return await cpu_pool.run(fn, *args, **kwargs)
+
+
+async def run_io(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Runs blocking I/O in the thread pool"""
+    return await io_pool.run(fn, *args, **kwargs)
+
+
+async def shutdown_executors():
+    await asyncio.to_thread(cpu_pool.shutdown)
+    io_pool.shutdown(wait=False)
+
+
+def collect_metrics():
+    pools = (cpu_pool, io_pool)
+    yield "kala_executor_workers", "gauge", "Workers per pool", {
+        (("pool", p.name),): p.workers for p in pools
+    }
+    yield "kala_executor_in_flight", "gauge", "Tasks submitted to a pool and not yet finished", {
+        (("pool", p.name),): p.in_flight for p in pools
+    }
+    yield "kala_executor_queue_depth", "gauge", "Tasks waiting for a free worker", {
+        (("pool", p.name),): p.queued for p in pools
+    }
+    yield "kala_executor_tasks_total", "counter", "Finished tasks by outcome", {
+        (("pool", p.name), ("outcome", outcome)): p.stats[outcome] for p in pools for outcome in ("completed", "failed")
+    }
+
+
+def status() -> dict:
+    return {"cpu": cpu_pool.status(), "io": io_pool.status()}
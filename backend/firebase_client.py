@@ -0,0 +1,50 @@
+"""
+Firestore client setup, shared by the app and offline scripts (e.g. the
+story_index backfill) that need a client without loading the whole app.
+"""
+import os
+
+from observability import get_logger
+
+logger = get_logger("firebase")
+
+
+def init_firebase():
+    """
+    Initializes Firebase if credentials are available and returns the
+    Firestore client, or None. Blocking - run it off the event loop.
+    """
+    try:
+        firebase_credentials = {
+            "type": os.getenv("FIREBASE_TYPE", "service_account"),
+            "project_id": os.getenv("FIREBASE_PROJECT_ID"),
+            "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
+            "private_key": os.getenv("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n'),
+            "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
+            "client_id": os.getenv("FIREBASE_CLIENT_ID"),
+            "auth_uri": os.getenv("FIREBASE_AUTH_URI", "https://accounts.google.com/o/oauth2/auth"),
+            "token_uri": os.getenv("FIREBASE_TOKEN_URI", "https://oauth2.googleapis.com/token"),
+            "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_X509_CERT_URL", "https://www.googleapis.com/oauth2/v1/certs"),
+            "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_X509_CERT_URL")
+        }
+
+        # Check if all required env vars are present
+        required_vars = ["project_id", "private_key", "client_email"]
+        missing_vars = [var for var in required_vars if not firebase_credentials[var]]
+
+        if missing_vars:
+            # QR code story features are unavailable, but core functionality works fine
+            logger.warning("firebase_disabled", extra={"missing_vars": missing_vars})
+            return None
+
+        # Imported only once credentials are known to exist; the SDK is slow to load
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(firebase_credentials))
+        client = firestore.client()
+        logger.info("firebase_initialized")
+        return client
+    except Exception as e:
+        logger.warning("firebase_init_failed", extra={"error": str(e)})
+        return None
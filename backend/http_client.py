@@ -0,0 +1,123 @@
+"""
+App-lifetime async HTTP client for third-party APIs (OpenRouter).
+
+One pooled httpx.AsyncClient is shared by every request so keep-alive
+connections (HTTP/2 when the `h2` package is installed) are reused instead
+of paying a TLS handshake per call. `post_with_retry` retries 429/5xx and
+connection errors with jittered backoff inside a total time budget.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Optional
+
+import httpx
+
+from observability import get_logger
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "90"))
+RETRY_BUDGET = float(os.getenv("HTTP_RETRY_BUDGET", "120"))
+MAX_ATTEMPTS = int(os.getenv("HTTP_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = get_logger("http")
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client(**kwargs) -> httpx.AsyncClient:
+    """Build a pooled client with connect/read timeouts"""
+    kwargs.setdefault("http2", HTTP2_AVAILABLE)
+    kwargs.setdefault("timeout", httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT))
+    kwargs.setdefault("limits", httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60))
+    return httpx.AsyncClient(**kwargs)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it if the app hasn't started it yet"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def backoff_delay(attempt: int, response: Optional[httpx.Response] = None,
+                  base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Full-jitter exponential backoff, honouring a numeric Retry-After header"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def post_with_retry(
+    url: str,
+    client: Optional[httpx.AsyncClient] = None,
+    budget: float = RETRY_BUDGET,
+    max_attempts: int = MAX_ATTEMPTS,
+    backoff_base: float = BACKOFF_BASE,
+    stream: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """
+    POST with retries on 429/5xx and connection errors. Gives up when
+    `max_attempts` is reached or the next wait would exceed `budget` seconds,
+    returning the last response (or raising the last error).
+
+    With `stream`, the returned response's body hasn't been read yet: iterate
+    it with aiter_bytes() and close it with aclose().
+    """
+    client = client or get_http_client()
+    deadline = time.monotonic() + budget
+    attempt = 0
+
+    while True:
+        attempt += 1
+        remaining = max(deadline - time.monotonic(), 0.001)
+        response, error = None, None
+        try:
+            request = client.build_request(
+                "POST",
+                url,
+                timeout=httpx.Timeout(min(READ_TIMEOUT, remaining), connect=min(CONNECT_TIMEOUT, remaining)),
+                **kwargs,
+            )
+            response = await client.send(request, stream=stream)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            error = e
+
+        if response is not None and response.status_code not in RETRY_STATUS_CODES:
+            return response
+
+        delay = backoff_delay(attempt, response, base=backoff_base)
+        if attempt >= max_attempts or time.monotonic() + delay >= deadline:
+            if response is not None:
+                return response
+            raise error
+        if response is not None:
+            await response.aclose()
+
+        logger.warning("upstream_retry", extra={
+            "url": url, "attempt": attempt, "delay_s": round(delay, 2),
+            "failure": response.status_code if response is not None else repr(error),
+        })
+        await asyncio.sleep(delay)
@@ -0,0 +1,116 @@
+"""
+Upload normalization before images are sent to a model.
+
+Phone photos arrive as multi-megabyte JPEGs with EXIF rotation. Before they
+go to Gemini or OpenRouter we apply the EXIF orientation, downsample to a
+maximum edge and re-encode at a set quality, which shrinks the upstream
+payload several-fold without hurting analysis quality.
+"""
+import base64
+import io
+import os
+from dataclasses import dataclass
+from typing import Union
+
+from executors import run_cpu
+from observability import get_logger
+
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+STORY_IMAGE_MAX_EDGE = int(os.getenv("STORY_IMAGE_MAX_EDGE", "1024"))
+MOCKUP_IMAGE_MAX_EDGE = int(os.getenv("MOCKUP_IMAGE_MAX_EDGE", "1536"))
+# Below this size base64 runs inline; shipping the bytes to a worker process would cost more
+BASE64_INLINE_LIMIT = int(os.getenv("BASE64_INLINE_LIMIT", str(256 * 1024)))
+
+# Running totals reported on /status
+stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+logger = get_logger("images")
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_size: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - len(self.data)
+
+    def as_data_url(self) -> str:
+        return encode_data_url(self.data, self.mime_type)
+
+    def as_gemini_part(self) -> dict:
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+def normalize_image(content: Union[bytes, str], max_edge: int, image_format: str = IMAGE_FORMAT,
+                    quality: int = IMAGE_QUALITY) -> NormalizedImage:
+    """
+    Applies EXIF orientation, downsamples so the longest edge is at most
+    `max_edge` and re-encodes. The original bytes are kept when they are
+    already small enough and re-encoding wouldn't make them smaller.
+    `content` is either the image bytes or the path of a spooled upload.
+    """
+    from PIL import Image, ImageOps
+
+    original_size = len(content) if isinstance(content, bytes) else os.path.getsize(content)
+    with Image.open(io.BytesIO(content) if isinstance(content, bytes) else content) as original:
+        original_mime = Image.MIME.get(original.format or "", "")
+        # Animated GIFs are analysed from their first frame
+        original.seek(0)
+        rotated = original.getexif().get(0x0112, 1) != 1
+        image = ImageOps.exif_transpose(original)
+        resized = max(image.size) > max_edge
+        if resized:
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        if image_format == "JPEG" and image.mode != "RGB":
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or image.mode == "P" else "RGB")
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality, optimize=True)
+        width, height = image.size
+
+    data = buffer.getvalue()
+    if not rotated and not resized and original_mime and original_size <= len(data):
+        if not isinstance(content, bytes):
+            with open(content, "rb") as f:
+                content = f.read()
+        return NormalizedImage(content, original_mime, width, height, original_size)
+    return NormalizedImage(data, Image.MIME[image_format], width, height, original_size)
+
+
+async def normalize_upload(content: Union[bytes, str], max_edge: int) -> NormalizedImage:
+    """Runs normalize_image off the event loop and records the bytes saved"""
+    normalized = await run_cpu(normalize_image, content, max_edge)
+    stats["images"] += 1
+    stats["bytes_in"] += normalized.original_size
+    stats["bytes_out"] += len(normalized.data)
+    logger.debug("upload_normalized", extra={
+        "bytes_in": normalized.original_size, "bytes_out": len(normalized.data),
+        "width": normalized.width, "height": normalized.height, "mime_type": normalized.mime_type,
+    })
+    return normalized
+
+
+def encode_data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+async def to_data_url(image: NormalizedImage) -> str:
+    """as_data_url, in the CPU pool for large images"""
+    if len(image.data) < BASE64_INLINE_LIMIT:
+        return image.as_data_url()
+    return await run_cpu(encode_data_url, image.data, image.mime_type)
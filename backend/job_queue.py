@@ -0,0 +1,291 @@
+"""
+Durable background jobs for slow generations (mockups).
+
+Holding an HTTP request open for a minute-long OpenRouter call gets it cut
+by proxies and mobile networks, and the client's retry starts a second,
+equally expensive generation. Instead a submission is stored in SQLite and
+answered with a job ID straight away; a fixed pool of workers processes
+jobs, and clients poll or subscribe for the result.
+
+Jobs survive restarts: anything still queued or running when the process
+stops is picked up again on the next start. A submission identical to a job
+that is queued, running or already done returns that job instead of
+starting a new one. Finished jobs are kept for MOCKUP_JOB_RETENTION seconds.
+"""
+import asyncio
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from executors import run_io
+from observability import get_logger
+
+MOCKUP_JOB_DB = os.getenv("MOCKUP_JOB_DB", os.path.join("cache", "mockup_jobs.sqlite3"))
+MOCKUP_JOB_WORKERS = int(os.getenv("MOCKUP_JOB_WORKERS", "2"))
+MOCKUP_JOB_MAX_QUEUED = int(os.getenv("MOCKUP_JOB_MAX_QUEUED", "100"))
+# A job interrupted this many times (e.g. by crashes mid-generation) is failed
+MAX_JOB_ATTEMPTS = 3
+# How long finished jobs (and their results, for deduplication) are kept
+MOCKUP_JOB_RETENTION = float(os.getenv("MOCKUP_JOB_RETENTION", str(7 * 86400)))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+TERMINAL_STATUSES = {SUCCEEDED, FAILED}
+
+logger = get_logger("jobs")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """SQLite table of jobs: their status, inputs (until done) and results"""
+
+    def __init__(self, path: str, retention: float = MOCKUP_JOB_RETENTION):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, dedupe_key TEXT NOT NULL, status TEXT NOT NULL, "
+                "payload TEXT NOT NULL, input BLOB, result TEXT, error TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key)")
+
+    @staticmethod
+    def _row_to_job(row) -> dict:
+        job_id, status, result, error, attempts, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    _JOB_COLUMNS = "job_id, status, result, error, attempts, created_at, updated_at"
+
+    def add(self, job_id: str, dedupe_key: str, payload: dict, data: bytes):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, dedupe_key, status, payload, input, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, dedupe_key, QUEUED, json.dumps(payload), data, now, now),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def find_reusable(self, dedupe_key: str) -> Optional[dict]:
+        """The newest job for this key that hasn't failed"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE dedupe_key = ? AND status != ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (dedupe_key, FAILED),
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def start(self, job_id: str) -> Tuple[dict, bytes, int]:
+        """Marks a job running and returns its (payload, input, attempts)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                (RUNNING, time.time(), job_id),
+            )
+            payload, data, attempts = self._conn.execute(
+                "SELECT payload, input, attempts FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(payload), data, attempts
+
+    def finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        """Records the outcome and drops the stored input, which is no longer needed"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, input = NULL, updated_at = ? WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def unfinished(self) -> List[str]:
+        """IDs of jobs that were queued or running, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge_expired(self) -> int:
+        """Deletes finished jobs last updated before the retention period; queued and running jobs stay"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at <= ?",
+                (SUCCEEDED, FAILED, time.time() - self.retention),
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+JobHandler = Callable[[dict, bytes], Awaitable[dict]]
+
+
+class JobQueue:
+    """Runs stored jobs with a fixed number of workers and notifies watchers of changes"""
+
+    def __init__(self, store: JobStore, handler: JobHandler, workers: int = MOCKUP_JOB_WORKERS,
+                 max_queued: int = MOCKUP_JOB_MAX_QUEUED):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.stats = {"submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._submit_lock: Optional[asyncio.Lock] = None
+        self._changed: Optional[asyncio.Condition] = None
+        self._active = 0
+        self._stopping = False
+
+    def _ensure_loop_state(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._submit_lock = asyncio.Lock()
+            self._changed = asyncio.Condition()
+
+    async def submit(self, dedupe_key: str, payload: dict, data: bytes) -> Tuple[dict, bool]:
+        """
+        Stores a job and queues it, unless an identical one is queued, running
+        or done. Returns (job, deduplicated). Raises QueueFull when the backlog
+        is at its limit.
+        """
+        self._ensure_loop_state()
+        async with self._submit_lock:
+            await run_io(self.store.purge_expired)
+            existing = await run_io(self.store.find_reusable, dedupe_key)
+            if existing is not None:
+                self.stats["deduplicated"] += 1
+                return existing, True
+            if self._queue.qsize() >= self.max_queued:
+                raise QueueFull(f"{self._queue.qsize()} jobs are already waiting")
+
+            job_id = secrets.token_hex(16)
+            await run_io(self.store.add, job_id, dedupe_key, payload, data)
+            if self.running:
+                self._queue.put_nowait(job_id)
+            else:
+                await self.start()  # picks the new job up from the store
+        self.stats["submitted"] += 1
+        return await self.get(job_id), False
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await run_io(self.store.get, job_id)
+
+    async def watch(self, job_id: str, keepalive: float = 15.0) -> AsyncIterator[Optional[dict]]:
+        """
+        Yields the job whenever its status changes, ending after a terminal
+        status. Yields None every `keepalive` seconds without a change so
+        streaming responses can send a heartbeat.
+        """
+        self._ensure_loop_state()
+        changed = self._changed  # stop() replaces it; this watcher keeps polling on the old one
+        last_status = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield job
+                if last_status in TERMINAL_STATUSES:
+                    return
+            async with changed:
+                try:
+                    await asyncio.wait_for(changed.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self):
+        """Starts the workers and queues every job the store holds as unfinished"""
+        self._ensure_loop_state()
+        if self.running:
+            return
+        await run_io(self.store.purge_expired)
+        unfinished = await run_io(self.store.unfinished)
+        if self.running:  # started by someone else meanwhile, with the same jobs
+            return
+        self._stopping = False
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for job_id in unfinished:
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers. Jobs in progress stay 'running' and resume on the next start."""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Bound to this event loop; the next start() may run on another one
+        self._queue = self._submit_lock = self._changed = None
+
+    async def _worker(self):
+        while not self._stopping:
+            job_id = await self._queue.get()
+            self._active += 1
+            try:
+                await self._run(job_id)
+            finally:
+                self._active -= 1
+
+    async def _run(self, job_id: str):
+        payload, data, attempts = await run_io(self.store.start, job_id)
+        await self._notify()
+        if attempts > MAX_JOB_ATTEMPTS or data is None:
+            status, result, error = FAILED, None, "Job was interrupted too many times"
+        else:
+            try:
+                status, result, error = SUCCEEDED, await self.handler(payload, data), None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status, result, error = FAILED, None, str(e) or type(e).__name__
+                logger.warning("job_failed", extra={"job_id": job_id, "error": error})
+
+        await run_io(self.store.finish, job_id, status, result, error)
+        self.stats[status] += 1
+        await self._notify()
+
+    def status(self) -> dict:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "running": self._active,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "jobs_by_status": self.store.counts(),
+        }
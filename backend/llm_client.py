@@ -0,0 +1,292 @@
+"""
+Shared async client for all LLM calls made by the backend.
+
+Endpoints never call a model directly. They go through an LLMClient, which
+awaits the provider's native async API and caps how many calls may be in
+flight per model, so one slow vision request can't stall the event loop.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Union
+
+from model_registry import ModelRegistry
+from observability import get_logger, record_llm_usage, track_upstream
+from prompt_cache import PromptCache
+
+DEFAULT_MODEL_CONCURRENCY = 8
+
+logger = get_logger("llm")
+
+
+def parse_model_limits(raw: str) -> Dict[str, int]:
+    """Parse a "model=limit,model=limit" string into a dict"""
+    limits = {}
+    for item in (raw or "").split(","):
+        if "=" not in item:
+            continue
+        name, limit = item.split("=", 1)
+        if name.strip() and limit.strip().isdigit():
+            limits[name.strip()] = max(1, int(limit))
+    return limits
+
+
+class GeminiProvider:
+    """
+    Calls Gemini through the native async API of google-generativeai. Static
+    instructions passed as `system_instruction` are served from the context
+    cache instead of being resent with every request.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None, prompt_cache: Optional[PromptCache] = None):
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self._genai = None
+        self._models: Dict[str, object] = {}
+        self.prompt_cache = prompt_cache or PromptCache()
+
+    @property
+    def genai(self):
+        """google.generativeai, imported and configured on first use - the import alone takes ~0.5s"""
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    def get_model(self, model_name: str):
+        """Return the client for a model, creating it on first use"""
+        if model_name not in self._models:
+            self._models[model_name] = self.genai.GenerativeModel(model_name)
+        return self._models[model_name]
+
+    def warm(self, model_names: Iterable[str], connect: bool = False):
+        """
+        Create the clients for the given models up front. With `connect`,
+        also make one metadata call so the connection is open.
+        """
+        model_names = list(model_names)
+        for model_name in model_names:
+            self.get_model(model_name)
+        if connect and model_names and self.api_key:
+            self.genai.get_model(f"models/{model_names[0]}")
+
+    async def _model(self, model_name: str, system_instruction: Optional[str]):
+        if system_instruction:
+            self.genai  # configures the API key before the prompt cache uses it
+            return await self.prompt_cache.model(model_name, system_instruction)
+        return self.get_model(model_name)
+
+    async def generate(self, model_name: str, contents, system_instruction: Optional[str] = None, **kwargs) -> str:
+        model = await self._model(model_name, system_instruction)
+        response = await model.generate_content_async(contents, **kwargs)
+        self.prompt_cache.record_usage(response)
+        record_llm_usage(model_name, response)
+        return response.text
+
+    async def stream(self, model_name: str, contents, system_instruction: Optional[str] = None,
+                     **kwargs) -> AsyncIterator[str]:
+        model = await self._model(model_name, system_instruction)
+        response = await model.generate_content_async(contents, stream=True, **kwargs)
+        async for chunk in response:
+            yield chunk.text
+        self.prompt_cache.record_usage(response)
+        record_llm_usage(model_name, response)
+
+
+FakeResponse = Union[str, Exception, Callable[[str, object], str]]
+
+
+class FakeProvider:
+    """
+    Offline stand-in for Gemini. Sleeps for `latency` seconds and returns a
+    canned response per model, so concurrency can be tested without a key.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        responses: Optional[Dict[str, FakeResponse]] = None,
+        default_response: FakeResponse = "{}",
+        chunk_size: int = 64,
+    ):
+        self.latency = latency
+        self.responses = responses or {}
+        self.default_response = default_response
+        self.chunk_size = chunk_size
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _respond(self, model_name: str, contents) -> str:
+        response = self.responses.get(model_name, self.default_response)
+        if isinstance(response, Exception):
+            raise response
+        if callable(response):
+            return response(model_name, contents)
+        return response
+
+    def _enter(self, model_name: str, contents):
+        self.calls.append((model_name, contents))
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def generate(self, model_name: str, contents, **kwargs) -> str:
+        self._enter(model_name, contents)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return self._respond(model_name, contents)
+        finally:
+            self.in_flight -= 1
+
+    async def stream(self, model_name: str, contents, **kwargs) -> AsyncIterator[str]:
+        """Yields the canned response in `chunk_size` pieces, spreading `latency` over them"""
+        self._enter(model_name, contents)
+        try:
+            text = self._respond(model_name, contents)
+            chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+            for chunk in chunks:
+                if self.latency:
+                    await asyncio.sleep(self.latency / len(chunks))
+                yield chunk
+        finally:
+            self.in_flight -= 1
+
+
+class LLMClient:
+    """
+    Runs provider calls with a concurrency limit per model. With a model
+    registry, callers can ask for a task instead of a model and get the
+    route's timeout and ordered fallbacks.
+    """
+
+    def __init__(
+        self,
+        provider,
+        default_concurrency: int = DEFAULT_MODEL_CONCURRENCY,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        registry: Optional[ModelRegistry] = None,
+    ):
+        self.provider = provider
+        self.default_concurrency = default_concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.registry = registry or ModelRegistry({})
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self.fallbacks: Dict[str, int] = {}
+
+    def concurrency_limit(self, model_name: str) -> int:
+        return self.model_concurrency.get(model_name, self.default_concurrency)
+
+    def _semaphore(self, model_name: str) -> asyncio.Semaphore:
+        if model_name not in self._semaphores:
+            self._semaphores[model_name] = asyncio.Semaphore(self.concurrency_limit(model_name))
+        return self._semaphores[model_name]
+
+    @asynccontextmanager
+    async def limit(self, model_name: str):
+        """Holds one of `model_name`'s concurrency slots (also used for non-Gemini models)"""
+        async with self._semaphore(model_name):
+            self._in_flight[model_name] = self._in_flight.get(model_name, 0) + 1
+            try:
+                yield
+            finally:
+                self._in_flight[model_name] -= 1
+
+    async def generate(self, model_name: str, contents, **kwargs) -> str:
+        """Generate content with `model_name`, waiting for a free slot first"""
+        async with self.limit(model_name), track_upstream(self.provider.name, model_name):
+            return await self.provider.generate(model_name, contents, **kwargs)
+
+    async def stream(self, model_name: str, contents, **kwargs) -> AsyncIterator[str]:
+        """Stream text chunks from `model_name`; the slot is held until the stream ends"""
+        async with self.limit(model_name), track_upstream(self.provider.name, model_name):
+            async for chunk in self.provider.stream(model_name, contents, **kwargs):
+                yield chunk
+
+    def warm(self, connect: bool = False):
+        """Prepares the provider's clients for the models it serves (blocking - run it in a thread)"""
+        if hasattr(self.provider, "warm"):
+            self.provider.warm(self.registry.models_for_provider("gemini"), connect=connect)
+
+    def model_for(self, task: str) -> str:
+        return self.registry.route(task).model
+
+    def _fall_back(self, task: str, model_name: str, error: Exception):
+        self.fallbacks[task] = self.fallbacks.get(task, 0) + 1
+        logger.warning("model_fallback", extra={"task": task, "model": model_name, "error": repr(error)})
+
+    async def generate_for(self, task: str, contents, **kwargs) -> str:
+        """
+        Generate content for a task, trying the route's models in order.
+        A model that times out or errors falls through to the next one;
+        ValueError (e.g. a blocked response) is raised straight away.
+        """
+        route = self.registry.route(task)
+        error = None
+        for model_name in route.models:
+            try:
+                return await asyncio.wait_for(self.generate(model_name, contents, **kwargs), route.timeout)
+            except ValueError:
+                raise
+            except asyncio.TimeoutError:
+                error = TimeoutError(f"{model_name} timed out after {route.timeout}s")
+            except Exception as e:
+                error = e
+            self._fall_back(task, model_name, error)
+        raise error
+
+    async def stream_for(self, task: str, contents, **kwargs) -> AsyncIterator[str]:
+        """Stream for a task; falls back to the next model only if nothing was streamed yet"""
+        route = self.registry.route(task)
+        error = None
+        for model_name in route.models:
+            started = False
+            try:
+                chunks = self.stream(model_name, contents, **kwargs)
+                first = await asyncio.wait_for(chunks.__anext__(), route.timeout)
+                started = True
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+                return
+            except StopAsyncIteration:
+                return
+            except ValueError:
+                raise
+            except Exception as e:
+                if started:
+                    raise
+                error = TimeoutError(f"{model_name} timed out after {route.timeout}s") \
+                    if isinstance(e, asyncio.TimeoutError) else e
+            self._fall_back(task, model_name, error)
+        raise error
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"limit": self.concurrency_limit(name), "in_flight": self._in_flight.get(name, 0)}
+            for name in self._semaphores
+        }
+
+
+def create_llm_client() -> LLMClient:
+    """Build the app's LLM client from environment variables"""
+    if os.getenv("LLM_PROVIDER", "gemini").lower() == "fake":
+        provider = FakeProvider(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+    else:
+        provider = GeminiProvider()
+
+    registry = ModelRegistry.from_env()
+    return LLMClient(
+        provider,
+        default_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MODEL_CONCURRENCY)),
+        model_concurrency={
+            **registry.model_concurrency(),
+            **parse_model_limits(os.getenv("LLM_MODEL_CONCURRENCY", "")),
+        },
+        registry=registry,
+    )
@@ -1,23 +1,51 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from observability import startup  # first, so the startup clock covers the imports below
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, PlainTextResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import io
+import asyncio
 from dotenv import load_dotenv
-import google.generativeai as genai
-from PIL import Image
-from pydantic import BaseModel
-from typing import List
-import requests
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 import json
-import base64
-import firebase_admin
-from firebase_admin import credentials, firestore
-from pathlib import Path
-import qrcode
-import qrcode
-from prompts import MASTER_STORYTELLER_PROMPT
+import hashlib
+import secrets
+import importlib
+import httpx
+from contextlib import asynccontextmanager
+from prompts import STORYTELLER_INSTRUCTIONS, STORYTELLER_INPUT_TEMPLATE
 from prompts import MASTER_MOCKUP_PROMPT
+from prompts import VISION_INSTRUCTIONS, VISION_INPUT_TEMPLATE, VISION_PROMPT_VERSION
+from prompts import TRANSLATION_PROMPT, TRANSLATION_PROMPT_VERSION
+from llm_client import create_llm_client
+from cache import create_tiered_cache, make_key
+from singleflight import SingleFlight
+from story_store import STORY_SPOOL_DB, StorySpool, StoryWriter
+from story_index import decode_cursor, list_summaries, listing_item
+from firebase_client import init_firebase
+from streaming import DataURLStreamDecoder, IncrementalJSONObjectParser, SSEResponse, format_sse
+from image_pipeline import MOCKUP_IMAGE_MAX_EDGE, STORY_IMAGE_MAX_EDGE, NormalizedImage, normalize_upload, to_data_url
+from image_pipeline import stats as image_stats
+from upload_intake import BodySizeLimitMiddleware, IntakeUpload, MULTIPART_OVERHEAD, read_upload, upload_from_bytes
+from upload_intake import stats as upload_stats
+from asset_store import ASSET_NAME_PATTERN, IMMUTABLE_CACHE_CONTROL, LocalDiskBackend, content_type_for, create_asset_store
+from qr_service import QR_BATCH_MAX_ITEMS, QR_FORMATS, QR_MAX_BORDER, QR_MAX_SIZE, QRService, qr_digest
+from pipeline import Stage, run_pipeline
+from http_client import close_http_client, get_http_client, post_with_retry
+from admission import AdmissionMiddleware, create_admission_controller
+from job_queue import MOCKUP_JOB_DB, JobQueue, JobStore, QueueFull
+from story_batch import STORY_BATCH_CONCURRENCY, STORY_BATCH_DB, STORY_BATCH_MAX_BODY, STORY_BATCH_MAX_ITEMS
+from story_batch import BatchItem, FailedItemStore, batch_events, error_result, list_archive_items, open_archive
+from story_batch import read_archive_member, spool_archive
+from executors import cpu_pool, run_io, shutdown_executors
+from executors import collect_metrics as collect_executor_metrics, status as executor_status
+from serialization import CompressionMiddleware, FastJSONResponse, parse_fields, project, select_top_level
+from serialization import collect_metrics as collect_compression_metrics, status as compression_status
+from observability import UPSTREAM_PAYLOAD_SIZE, MetricsMiddleware, configure_logging, get_logger, metrics, track_upstream
+
+startup.record("imports", startup.started)
 
 
 class StoryData(BaseModel):
@@ -29,85 +57,98 @@ class MockupRequest(BaseModel):
 
 # File upload configuration
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB limit
-ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
 
-def validate_file_size(content: bytes) -> bool:
-    """Validate if file size is within limits"""
-    return len(content) <= MAX_FILE_SIZE
-
-def validate_file_type(filename: str, content_type: str) -> bool:
-    """Validate if file type is allowed"""
-    if not filename:
-        return False
-    
-    ext = Path(filename).suffix.lower()
-    return ext in ALLOWED_EXTENSIONS and content_type in ALLOWED_MIME_TYPES
-
-async def process_uploaded_file(file: UploadFile) -> bytes:
-    """Process and validate uploaded file"""
-    # Read file content
-    content = await file.read()
-    
-    # Validate file size
-    if not validate_file_size(content):
-        raise HTTPException(
-            status_code=413, 
-            detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024*1024)}MB"
-        )
-    
-    # Validate file type
-    if not validate_file_type(file.filename or "", file.content_type or ""):
-        raise HTTPException(
-            status_code=400, 
-            detail="Invalid file type. Allowed: JPG, JPEG, PNG, GIF, WEBP"
-        )
-    
-    # Reset file pointer for further processing
-    await file.seek(0)
-    return content
+async def process_uploaded_file(file: UploadFile) -> IntakeUpload:
+    """
+    Reads and validates an uploaded image in chunks. The type comes from the
+    file's magic bytes, oversized files are rejected with 413 as soon as the
+    limit is crossed, and large uploads are spooled to disk. Close the
+    returned upload when done with it.
+    """
+    return await read_upload(file, MAX_FILE_SIZE, ALLOWED_MIME_TYPES)
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Firebase only if credentials are available
+# Structured (JSON) logs on stdout
+configure_logging()
+logger = get_logger("api")
+
+# Firebase, the story writer and the upstream clients are set up in lifespan()
 firebase_enabled = False
-try:
-    firebase_credentials = {
-        "type": os.getenv("FIREBASE_TYPE", "service_account"),
-        "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-        "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-        "private_key": os.getenv("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n'),
-        "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-        "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-        "auth_uri": os.getenv("FIREBASE_AUTH_URI", "https://accounts.google.com/o/oauth2/auth"),
-        "token_uri": os.getenv("FIREBASE_TOKEN_URI", "https://oauth2.googleapis.com/token"),
-        "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_X509_CERT_URL", "https://www.googleapis.com/oauth2/v1/certs"),
-        "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_X509_CERT_URL")
-    }
+db = None
+story_writer = None
 
-    # Check if all required env vars are present
-    required_vars = ["project_id", "private_key", "client_email"]
-    missing_vars = [var for var in required_vars if not firebase_credentials[var]]
+# Background warmup after startup: heavy imports, model clients, upstream connections
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+WARMUP_CONNECT = os.getenv("WARMUP_CONNECT", "true").lower() in ("1", "true", "yes")
+WARMUP_IMPORTS = ("PIL.Image", "qrcode", "qrcode.image.svg", "google.generativeai", "google.generativeai.caching")
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+warmup_state = "disabled"
+app_ready = False
 
-    if not missing_vars:
-        cred = credentials.Certificate(firebase_credentials)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        firebase_enabled = True
-        print("✅ Firebase initialized successfully")
-    else:
-        print(f"⚠️ Firebase disabled - missing environment variables: {missing_vars}")
-        print("ℹ️ QR code story features will be unavailable, but core functionality works fine!")
-        db = None
-except Exception as e:
-    print(f"⚠️ Firebase initialization failed: {e}")
-    print("ℹ️ QR code story features will be unavailable, but core functionality works fine!")
-    firebase_enabled = False
-    db = None
+def import_heavy_modules():
+    for name in WARMUP_IMPORTS:
+        importlib.import_module(name)
 
+async def warm_up():
+    """
+    Runs after startup so the first requests don't pay for heavy imports,
+    model clients or TLS handshakes. Failures only cost that head start.
+    """
+    global warmup_state
+    warmup_state = "running"
+    try:
+        with startup.phase("warmup_imports"):
+            await run_io(import_heavy_modules)
+        with startup.phase("warmup_cpu_pool"):
+            # Spawn the worker processes now rather than on the first upload
+            await cpu_pool.warm()
+        with startup.phase("warmup_llm"):
+            await run_io(llm.warm, WARMUP_CONNECT)
+        if WARMUP_CONNECT and os.getenv("OPENROUTER_API_KEY"):
+            with startup.phase("warmup_openrouter"):
+                await get_http_client().get(OPENROUTER_MODELS_URL, timeout=5)
+        warmup_state = "done"
+    except Exception as e:
+        warmup_state = "failed"
+        logger.warning("warmup_failed", extra={"error": str(e)})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db, firebase_enabled, story_writer, app_ready
+    with startup.phase("firebase"):
+        db = await run_io(init_firebase)
+        firebase_enabled = db is not None
+    # Write-behind persistence: stories are spooled locally and flushed to Firestore in batches
+    if db is not None:
+        story_writer = StoryWriter(db, StorySpool(STORY_SPOOL_DB))
+        story_writer.start()
+    with startup.phase("http_client"):
+        # Open the pooled HTTP client up front so the first mockup doesn't pay for it
+        get_http_client()
+    with startup.phase("mockup_jobs"):
+        # Resume mockup jobs a previous run left queued or unfinished
+        await mockup_jobs.start()
+
+    app_ready = True
+    startup.mark_ready()
+    logger.info("startup_complete", extra=startup.report())
+    warmup = asyncio.create_task(warm_up()) if STARTUP_WARMUP else None
+    yield
+    app_ready = False
+    if warmup is not None:
+        warmup.cancel()
+    await mockup_jobs.stop()
+    if story_writer:
+        await story_writer.stop()
+    await close_http_client()
+    await shutdown_executors()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Configure CORS origins based on environment
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -118,6 +159,12 @@ ALLOWED_ORIGINS = [
     FRONTEND_URL,  # Production frontend URL
 ]
 
+# Per-client and per-route rate limits plus upstream concurrency budgets.
+# Added before CORS so 429 responses still carry the CORS headers.
+admission = create_admission_controller()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+metrics.add_collector(admission.collect_metrics)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -127,9 +174,128 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure the Gemini API
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel('gemini-2.5-flash-lite')
+# Read-through cache for /story/{story_id}, which every QR scan hits
+story_cache = create_tiered_cache(
+    "stories",
+    maxsize=int(os.getenv("STORY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("STORY_CACHE_TTL", "300")),
+)
+story_loads = SingleFlight("stories")
+
+STORY_CACHE_MAX_AGE = int(os.getenv("STORY_CACHE_MAX_AGE", "60"))
+
+# Gallery pages from /stories; new stories show up once the short TTL lapses
+story_listings = create_tiered_cache(
+    "story_listings",
+    maxsize=int(os.getenv("STORY_LIST_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("STORY_LIST_CACHE_TTL", "30")),
+)
+story_listing_loads = SingleFlight("story_listings")
+
+STORY_LIST_DEFAULT_LIMIT = int(os.getenv("STORY_LIST_DEFAULT_LIMIT", "24"))
+STORY_LIST_MAX_LIMIT = int(os.getenv("STORY_LIST_MAX_LIMIT", "100"))
+
+# Content-addressed store for generated mockups and QR codes
+asset_store = create_asset_store()
+
+qr_service = QRService(asset_store)
+
+# Reject oversized request bodies before they are buffered
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_size=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    path_limits={"/generate-story-batch": STORY_BATCH_MAX_BODY},
+)
+
+# Configure the LLM client shared by every endpoint
+llm = create_llm_client()
+
+# Cache of vision analyses keyed on image hash + category + prompt version
+analysis_cache = create_tiered_cache(
+    "analysis",
+    maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "86400")),
+    disk_path=os.getenv("ANALYSIS_CACHE_DB", ""),
+)
+
+# Translation memory keyed on text hash + language + context
+translation_memory = create_tiered_cache(
+    "translations",
+    maxsize=int(os.getenv("TRANSLATION_MEMORY_SIZE", "1024")),
+    ttl=float(os.getenv("TRANSLATION_MEMORY_TTL", str(30 * 86400))),
+    disk_path=os.getenv("TRANSLATION_MEMORY_DB", ""),
+)
+
+# Identical requests arriving while one is in flight (double clicks, client
+# retries) await that one upstream call and share its result or error
+analysis_flights = SingleFlight("analysis")
+translation_flights = SingleFlight("translation")
+pricing_flights = SingleFlight("pricing")
+
+# Batch items that failed upstream, kept for /generate-story-batch/{batch_id}/retry
+failed_batch_items = FailedItemStore(STORY_BATCH_DB)
+
+# gzip/brotli for large JSON and text responses
+app.add_middleware(CompressionMiddleware)
+
+# Request latency, status and payload size per route, outermost so it sees everything (bytes as sent)
+app.add_middleware(MetricsMiddleware)
+
+def collect_component_metrics():
+    """Reports the counters each component already keeps (also on /status) as metrics"""
+    caches = {"analysis": analysis_cache, "translations": translation_memory, "stories": story_cache,
+              "story_listings": story_listings}
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    yield "kala_cache_lookups_total", "counter", "Cache lookups by result", {
+        (("cache", name), ("result", result)): stats[key]
+        for name, stats in cache_stats.items()
+        for result, key in (("hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))
+    }
+    yield "kala_cache_hit_ratio", "gauge", "Share of cache lookups that hit", {
+        (("cache", name),): stats["hit_ratio"] for name, stats in cache_stats.items()
+    }
+    yield "kala_cache_entries", "gauge", "Entries held in memory per cache", {
+        (("cache", name),): stats["memory_entries"] for name, stats in cache_stats.items()
+    }
+    llm_stats = llm.stats()
+    yield "kala_llm_in_flight", "gauge", "LLM calls holding a concurrency slot", {
+        (("model", model),): s["in_flight"] for model, s in llm_stats.items()
+    }
+    yield "kala_llm_concurrency_limit", "gauge", "Concurrency cap per model", {
+        (("model", model),): s["limit"] for model, s in llm_stats.items()
+    }
+    yield "kala_llm_fallbacks_total", "counter", "Calls that fell back to another model", {
+        (("task", task),): count for task, count in llm.fallbacks.items()
+    }
+    yield "kala_image_bytes_total", "counter", "Upload bytes before and after normalization", {
+        (("stage", "in"),): image_stats["bytes_in"], (("stage", "out"),): image_stats["bytes_out"]
+    }
+    yield "kala_qr_codes_total", "counter", "QR code requests by how they were served", {
+        (("result", result),): count for result, count in qr_service.stats.items()
+    }
+    yield "kala_coalesced_calls_total", "counter", "Calls that joined an identical one already in flight", {
+        (("flight", flight.name),): flight.stats["coalesced"]
+        for flight in (story_loads, story_listing_loads, analysis_flights, translation_flights, pricing_flights)
+    }
+    jobs = mockup_jobs.status()
+    yield "kala_mockup_jobs", "gauge", "Mockup jobs by status", {
+        (("status", status),): count for status, count in jobs["jobs_by_status"].items()
+    }
+    yield "kala_mockup_job_queue_depth", "gauge", "Mockup jobs waiting for a worker", {(): jobs["queued"]}
+    yield "kala_mockup_jobs_deduplicated_total", "counter", "Submissions answered with an existing job", {
+        (): jobs["deduplicated"]
+    }
+    if story_writer:
+        yield "kala_story_spool_pending", "gauge", "Stories waiting to be flushed to Firestore", {
+            (): story_writer.spool.count()
+        }
+        yield "kala_story_spool_rejected", "gauge", "Stories Firestore kept refusing, set aside", {
+            (): story_writer.spool.count_rejected()
+        }
+
+metrics.add_collector(collect_component_metrics)
+metrics.add_collector(collect_executor_metrics)
+metrics.add_collector(collect_compression_metrics)
 
 @app.get("/")
 def read_root():
@@ -145,22 +311,101 @@ def check_status():
         "status": "online",
         "google_api_key_set": bool(google_api_key and len(google_api_key) > 10),
         "openrouter_api_key_set": bool(openrouter_api_key and len(openrouter_api_key) > 10),
-        "static_directory_exists": os.path.exists("static")
+        "static_directory_exists": os.path.exists("static"),
+        "llm_provider": llm.provider.name,
+        "llm_concurrency": llm.stats(),
+        "model_routes": llm.registry.describe(),
+        "model_fallbacks": llm.fallbacks,
+        "prompt_cache": llm.provider.prompt_cache.status() if hasattr(llm.provider, "prompt_cache") else None,
+        "analysis_cache": analysis_cache.stats(),
+        "translation_memory": translation_memory.stats(),
+        "image_normalization": image_stats,
+        "upload_intake": upload_stats,
+        "asset_store": {"backend": asset_store.backend.name, **asset_store.stats},
+        "qr_codes": qr_service.stats,
+        "story_cache": {**story_cache.stats(), "coalesced_loads": story_loads.stats["coalesced"]},
+        "story_listings": {**story_listings.stats(), "coalesced_loads": story_listing_loads.stats["coalesced"]},
+        "coalesced_calls": {
+            flight.name: {**flight.stats, "in_flight": flight.in_flight}
+            for flight in (analysis_flights, translation_flights, pricing_flights)
+        },
+        "story_writer": story_writer.status() if story_writer else None,
+        "mockup_jobs": mockup_jobs.status(),
+        "admission": admission.status(),
+        "startup": {**startup.report(), "warmup": warmup_state},
+        "executors": executor_status(),
+        "compression": compression_status(),
+        "story_batches": {"retryable_items": failed_batch_items.count()}
     }
 
+@app.get("/live")
+def liveness():
+    """Liveness: the process is up and its event loop answers"""
+    return {"status": "alive"}
+
+@app.get("/ready")
+def readiness():
+    """
+    Readiness: startup has finished and requests can be served. Warmup
+    runs in the background and isn't required for readiness.
+    """
+    body = {"ready": app_ready, "warmup": warmup_state, "startup": startup.report()}
+    return FastJSONResponse(body, status_code=200 if app_ready else 503)
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/test-ai")
-def test_ai():
+async def test_ai():
     try:
         # This is a simple test call to the AI
-        response = model.generate_content("In one sentence, what makes handmade crafts special?")
-        return {"ai_response": response.text}
+        response_text = await llm.generate_for('general', "In one sentence, what makes handmade crafts special?")
+        return {"ai_response": response_text}
     except Exception as e:
         return {"error": str(e)}
     
+def analysis_cache_key(image_sha256: str, category: str) -> str:
+    return make_key(image_sha256, category, VISION_PROMPT_VERSION, llm.model_for('vision'), STORY_IMAGE_MAX_EDGE)
+
+async def cached_analysis(image_sha256: str, category: str) -> Optional[str]:
+    return await analysis_cache.get(analysis_cache_key(image_sha256, category))
+
+async def analyze_upload(upload: IntakeUpload, category: str, no_cache: bool = False) -> dict:
+    """Runs the vision analysis for an accepted upload, using the analysis cache"""
+    # Repeat uploads of the same photo are served from the analysis cache
+    if not no_cache:
+        cached = await cached_analysis(upload.sha256, category)
+        if cached is not None:
+            return {"ai_analysis": cached, "cached": True}
+
+    # Downsample and re-encode before sending the image to Gemini. Done
+    # outside the shared call, which may outlive this request's upload.
+    normalized = await normalize_upload(upload.source, STORY_IMAGE_MAX_EDGE)
+    return await analyze_normalized(upload.sha256, category, normalized)
+
+async def analyze_normalized(image_sha256: str, category: str, normalized: NormalizedImage) -> dict:
+    """Runs the vision analysis for a normalized image and caches the result"""
+    cache_key = analysis_cache_key(image_sha256, category)
+
+    async def analyze():
+        # Enhanced vision prompt for detailed art analysis; the static
+        # instructions are served from the prompt cache
+        vision_prompt = [VISION_INPUT_TEMPLATE.format(category=category), normalized.as_gemini_part()]
+
+        response_text = await llm.generate_for('vision', vision_prompt, system_instruction=VISION_INSTRUCTIONS)
+        await analysis_cache.set(cache_key, response_text)
+        return response_text
+
+    response_text = await analysis_flights.do(cache_key, analyze)
+    return {"ai_analysis": response_text, "cached": False}
+
 @app.post("/generate-story")
 async def generate_story_from_image(
     image: UploadFile = File(...),
-    category: str = Form(...) # <-- Accept the category here
+    category: str = Form(...), # <-- Accept the category here
+    no_cache: bool = Form(False) # Skip the analysis cache and force a fresh call
 ):
     """
     Receives an image and its category, sends to Gemini Vision,
@@ -168,146 +413,339 @@ async def generate_story_from_image(
     """
     try:
         # Validate and process uploaded file
-        contents = await process_uploaded_file(image)
-        pil_image = Image.open(io.BytesIO(contents))
-
-        # Enhanced vision prompt for detailed art analysis
-        vision_prompt = [
-            f"""
-            You are an expert in traditional crafts and cultural arts. Analyze this image of a handmade craft, which the artisan has identified as being in the '{category}' category.
-
-            Provide a comprehensive analysis including:
-            1. Detailed description of what you see (materials, techniques, patterns, colors, style)
-            2. Identify the specific traditional art form if recognizable (e.g., Madhubani painting, Bidriware, Chikankari embroidery, etc.)
-            3. Analyze regional characteristics and cultural elements visible
-            4. Assess the level of craftsmanship and traditional techniques used
-            5. Generate three thoughtful, warm questions that will help capture the artisan's personal story and connection to this craft
-
-            Format the output as JSON with these exact keys:
-            {{
-              "description": "Detailed description of the craft piece including materials, techniques, and visual elements",
-              "art_form_identification": "Specific traditional art form name if identifiable, or 'Unknown traditional craft' if not certain",
-              "regional_characteristics": "Observable cultural or regional elements in the style, patterns, or techniques",
-              "craftsmanship_analysis": "Assessment of skill level, traditional techniques, and unique features",
-              "questions": [
-                "Question 1 about the artisan's learning/training in this craft",
-                "Question 2 about cultural significance or family traditions",
-                "Question 3 about the creation process or personal connection to the work"
-              ]
-            }}
-            
-            Make your analysis culturally sensitive and respectful while being informative and detailed.
-            """,
-            pil_image
-        ]
-        
-        # ... (the rest of the function is the same)
-        response = model.generate_content(vision_prompt)
-        return {"ai_analysis": response.text}
+        with await process_uploaded_file(image) as upload:
+            return await analyze_upload(upload, category, no_cache)
 
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
-    
+
+async def analyze_batch_image(batch_id: str, index: int, name: str, category: str, image_sha256: str,
+                              normalized: NormalizedImage) -> dict:
+    """Analyzes one normalized batch image; on failure keeps it so the item can be retried alone"""
+    try:
+        result = await analyze_normalized(image_sha256, category, normalized)
+    except Exception as e:
+        await run_io(failed_batch_items.save, batch_id, index, name, category, image_sha256, normalized, str(e))
+        return error_result(index, name, category, str(e), retryable=True, sha256=image_sha256)
+    return {"index": index, "name": name, "category": category, "status": "ok", "sha256": image_sha256, **result}
+
+async def analyze_batch_item(batch_id: str, item: BatchItem, archive, no_cache: bool) -> dict:
+    if item.error:
+        return error_result(item.index, item.name, item.category, item.error, retryable=False)
+    upload = item.upload
+    if upload is None:
+        try:
+            data = await run_io(read_archive_member, archive, item.member, MAX_FILE_SIZE)
+            upload = await run_io(upload_from_bytes, item.name, data, MAX_FILE_SIZE, ALLOWED_MIME_TYPES)
+        except HTTPException as e:
+            return error_result(item.index, item.name, item.category, e.detail, retryable=False)
+
+    with upload:
+        if not no_cache:
+            cached = await cached_analysis(upload.sha256, item.category)
+            if cached is not None:
+                return {"index": item.index, "name": item.name, "category": item.category, "status": "ok",
+                        "sha256": upload.sha256, "ai_analysis": cached, "cached": True}
+        try:
+            normalized = await normalize_upload(upload.source, STORY_IMAGE_MAX_EDGE)
+        except Exception as e:
+            return error_result(item.index, item.name, item.category, f"Could not read image: {e}",
+                                retryable=False, sha256=upload.sha256)
+    return await analyze_batch_image(batch_id, item.index, item.name, item.category, upload.sha256, normalized)
+
+def batch_response(batch_id: str, items: list, process, cleanup=None) -> SSEResponse:
+    events = batch_events(batch_id, items, process, f"/generate-story-batch/{batch_id}/retry",
+                          STORY_BATCH_CONCURRENCY)
+    return SSEResponse(events, on_close=cleanup)
+
+@app.post("/generate-story-batch")
+async def generate_story_batch(
+    images: List[UploadFile] = File([]),
+    categories: List[str] = Form([]), # One for all images, or one per image
+    archive: Optional[UploadFile] = File(None), # A zip of images instead of `images`
+    category: str = Form(""), # Category for archive files that aren't in a category folder
+    no_cache: bool = Form(False)
+):
+    """
+    Analyzes a whole collection in one request: several `images`, or a zip
+    `archive` whose top-level folders name each file's category. Items are
+    analyzed a few at a time, reusing cached analyses, and streamed as
+    Server-Sent Events as they finish: "start", then "item" and "progress"
+    per item, then "done". Items that failed upstream can be retried with
+    POST /generate-story-batch/{batch_id}/retry.
+    """
+    if bool(images) == bool(archive):
+        return FastJSONResponse(status_code=400, content={"error": "Send either images or an archive"})
+
+    batch_id = secrets.token_hex(8)
+    await run_io(failed_batch_items.purge_expired)
+    archive_file, archive_path = None, None
+    if images:
+        if len(categories) not in (1, len(images)):
+            return FastJSONResponse(status_code=400, content={"error": "Give one category for all images or one per image"})
+        if len(images) > STORY_BATCH_MAX_ITEMS:
+            return FastJSONResponse(status_code=400, content={"error": f"Too many items. Maximum batch size: {STORY_BATCH_MAX_ITEMS}"})
+        items = []
+        for index, image in enumerate(images):
+            item = BatchItem(index, image.filename or f"image-{index + 1}", categories[index % len(categories)].strip())
+            try:
+                # Read now: the request's files may be closed before the stream ends
+                item.upload = await process_uploaded_file(image)
+            except HTTPException as e:
+                item.error = e.detail
+            items.append(item)
+    else:
+        archive_path = await run_io(spool_archive, archive.file)
+        try:
+            archive_file = await run_io(open_archive, archive_path)
+        except ValueError as e:
+            os.unlink(archive_path)
+            return FastJSONResponse(status_code=400, content={"error": str(e)})
+        items = list_archive_items(archive_file, category.strip())
+        if not items or len(items) > STORY_BATCH_MAX_ITEMS:
+            archive_file.close()
+            os.unlink(archive_path)
+            return FastJSONResponse(status_code=400, content={
+                "error": f"The archive must hold between 1 and {STORY_BATCH_MAX_ITEMS} images"
+            })
+
+    for item in items:
+        if not item.category and not item.error:
+            item.error = "No category: send one, or put the file in a folder named after its category"
+
+    def cleanup():
+        for item in items:
+            if item.upload is not None:
+                item.upload.close()
+        if archive_file is not None:
+            archive_file.close()
+            os.unlink(archive_path)
+
+    logger.info("batch_started", extra={"batch_id": batch_id, "items": len(items), "archive": archive is not None})
+    return batch_response(batch_id, items, lambda item: analyze_batch_item(batch_id, item, archive_file, no_cache),
+                          cleanup)
+
+@app.post("/generate-story-batch/{batch_id}/retry")
+async def retry_story_batch(batch_id: str):
+    """
+    Re-runs only the items of a batch that failed upstream, from the images
+    kept when they failed. Streams the same events as /generate-story-batch.
+    """
+    items = await run_io(failed_batch_items.load, batch_id)
+    if not items:
+        return FastJSONResponse(status_code=404, content={"error": "No failed items to retry for this batch"})
+
+    async def process(item: dict) -> dict:
+        result = await analyze_batch_image(batch_id, item["index"], item["name"], item["category"],
+                                           item["sha256"], item["image"])
+        if result["status"] == "ok":
+            await run_io(failed_batch_items.remove, batch_id, item["index"])
+        return result
+
+    return batch_response(batch_id, items, process)
+
+def build_story_prompt(data: StoryData) -> str:
+    """Formats the per-request part of the storyteller prompt; the instructions are cached"""
+    # Combine the answers into a single string for the prompt
+    answers_str = "\n- ".join(data.artisan_answers)
+    return STORYTELLER_INPUT_TEMPLATE.format(
+        description=data.initial_description,
+        answers=answers_str
+    )
+
+def parse_story_json(response_text: str) -> dict:
+    """Cleans markdown fences off a model response and parses the JSON"""
+    story_json_str = response_text.strip().replace("```json", "").replace("```", "")
+    return json.loads(story_json_str)
+
+async def save_story(story_data: dict):
+    """
+    Hands a story to the write-behind writer and returns its new ID right
+    away, or None when Firebase is unavailable. The story is readable from
+    /story/{story_id} immediately, before it reaches Firestore.
+    """
+    if story_writer is None:
+        return None
+    story_id = await story_writer.submit(story_data)
+    await story_cache.set(story_id, story_cache_entry(jsonable_encoder(story_data)))
+    return story_id
+
+async def generate_story(data: StoryData) -> dict:
+    """Generates the marketing package and saves it, returning the endpoint's payload"""
+    # Call the model
+    response_text = await llm.generate_for('storytelling', build_story_prompt(data),
+                                         system_instruction=STORYTELLER_INSTRUCTIONS)
+    story_data = parse_story_json(response_text)
+
+    # Save to Firebase if available, otherwise just return the story
+    story_id = await save_story(story_data)
+    if story_id:
+        return {"story_id": story_id, "final_content": story_data}
+
+    # Return content without story_id for MVP (no QR code functionality)
+    return {"final_content": story_data}
+
+def requested_fields(fields: Optional[str]):
+    """Parsed `fields=` query parameter, or 400 if it is malformed"""
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/complete-story")
-async def complete_story(data: StoryData):
+async def complete_story(data: StoryData, fields: Optional[str] = None):
     """
     Receives the initial analysis and the artisan's answers,
-    then generates the final marketing content.
+    then generates the final marketing content. `fields` (e.g.
+    "instagram_post,video_script.title") trims final_content to the
+    sections the client renders; the full story is still saved.
     """
+    paths = requested_fields(fields)
     try:
-        # Combine the answers into a single string for the prompt
-        answers_str = "\n- ".join(data.artisan_answers)
+        result = await generate_story(data)
+    except Exception as e:
+        return {"error": f"An error occurred: {str(e)}"}
+    result["final_content"] = project(result["final_content"], paths)
+    return result
 
-        # Format the master prompt with our data
-        final_prompt = MASTER_STORYTELLER_PROMPT.format(
-            description=data.initial_description,
-            answers=answers_str
-        )
+@app.post("/complete-story-stream")
+async def complete_story_stream(data: StoryData, fields: Optional[str] = None):
+    """
+    Streaming variant of /complete-story over Server-Sent Events.
+    Each top-level key of the story (instagram_post, product_description, ...)
+    is sent as its own event as soon as the model has finished writing it.
+    With `fields`, only the selected sections are sent.
+    A final "done" event carries the story_id once the story is saved.
+    """
+    paths = requested_fields(fields)
 
-        # Call the model
-        response = model.generate_content(final_prompt)
-        # Clean up the response to get a clean JSON object
-        story_json_str = response.text.strip().replace("```json", "").replace("```", "")
-        story_data = json.loads(story_json_str)
+    async def events():
+        parser = IncrementalJSONObjectParser()
+        story_data = {}
+        response_text = ""
+        try:
+            async for chunk in llm.stream_for('storytelling', build_story_prompt(data),
+                                              system_instruction=STORYTELLER_INSTRUCTIONS):
+                response_text += chunk
+                for key, value in parser.feed(chunk):
+                    story_data[key] = value
+                    selected = select_top_level(key, value, paths)
+                    if selected is not None:
+                        yield format_sse("section", {"key": key, "value": selected})
 
-        # Save to Firebase if available, otherwise just return the story
-        if firebase_enabled and db:
-            try:
-                doc_ref = db.collection(u'stories').add(story_data)
-                story_id = doc_ref[1].id
-                return {"story_id": story_id, "final_content": story_data}
-            except Exception as firebase_error:
-                print(f"Firebase save failed: {firebase_error}")
-                # Continue without saving
-                pass
-        
-        # Return content without story_id for MVP (no QR code functionality)
-        return {"final_content": story_data}
+            # Anything the incremental parser couldn't pick up comes from the full text
+            if not parser.done:
+                for key, value in parse_story_json(response_text).items():
+                    if key not in story_data:
+                        story_data[key] = value
+                        selected = select_top_level(key, value, paths)
+                        if selected is not None:
+                            yield format_sse("section", {"key": key, "value": selected})
 
-    except Exception as e:
-        return {"error": f"An error occurred: {str(e)}"}
+            story_id = await save_story(story_data)
+            yield format_sse("done", {"story_id": story_id})
+        except Exception as e:
+            yield format_sse("error", {"error": f"An error occurred: {str(e)}"})
+
+    return SSEResponse(events())
 
 class PricingRequest(BaseModel):
     description: str
     category: str
     time_taken_hours: int
 
+async def suggest_pricing(description: str, category: str, time_taken_hours: int) -> str:
+    """Asks the model for a fair INR/USD price range"""
+    prompt = f"""
+    Act as an expert appraiser for handmade artisanal goods.
+    Given the following item details:
+    - Category: {category}
+    - Description: {description}
+    - Hours to make: {time_taken_hours}
+
+    Provide a fair market price range in both INR and USD.
+    Your output MUST be a JSON object with two keys: "price_range_inr" and "price_range_usd".
+    Example: {{"price_range_inr": "₹2500 - ₹4000", "price_range_usd": "$30 - $50"}}
+    """
+    flight_key = make_key(description, category, time_taken_hours, llm.model_for('pricing'))
+    return await pricing_flights.do(flight_key, lambda: llm.generate_for('pricing', prompt))
+
 @app.post("/get-pricing")
 async def get_pricing(request: PricingRequest):
     """
     Suggests a price range based on the item's details.
     """
     try:
-        text_model = genai.GenerativeModel('gemini-pro')
-        prompt = f"""
-        Act as an expert appraiser for handmade artisanal goods.
-        Given the following item details:
-        - Category: {request.category}
-        - Description: {request.description}
-        - Hours to make: {request.time_taken_hours}
-
-        Provide a fair market price range in both INR and USD.
-        Your output MUST be a JSON object with two keys: "price_range_inr" and "price_range_usd".
-        Example: {{"price_range_inr": "₹2500 - ₹4000", "price_range_usd": "$30 - $50"}}
-        """
-        response = text_model.generate_content(prompt)
-        return {"pricing_suggestion": response.text}
+        pricing = await suggest_pricing(request.description, request.category, request.time_taken_hours)
+        return {"pricing_suggestion": pricing}
     except Exception as e:
         return {"error": str(e)}    
     
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# A missing static/ directory must not stop the app from starting
+if os.path.isdir("static"):
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+else:
+    logger.warning("static_directory_missing")
 
 
-@app.post("/generate-mockup")
-async def generate_mockup(
-    image: UploadFile = File(...),
-    context: str = Form(...)
-):
+@app.get("/assets/{name}")
+async def get_asset(name: str, request: Request):
     """
-    Tests the OpenRouter Chat Completions endpoint for image generation.
+    Serves a content-addressed asset. Names never change meaning, so the
+    response is cacheable forever and revalidation is answered with 304.
     """
+    if not ASSET_NAME_PATTERN.match(name):
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    headers = {"ETag": f'"{name}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if isinstance(asset_store.backend, LocalDiskBackend):
+        path = asset_store.backend.path(name)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Asset not found")
+        return FileResponse(path, media_type=content_type_for(name), headers=headers)
+
     try:
-        openrouter_key = os.getenv("OPENROUTER_API_KEY")
-        
-        # Validate and process uploaded file
-        contents = await process_uploaded_file(image)
-        
-        # 1. Encode the uploaded image
-        image_base64 = base64.b64encode(contents).decode("utf-8")
-        image_url = f"data:image/jpeg;base64,{image_base64}"
+        data = await asset_store.read(name)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return Response(data, media_type=content_type_for(name), headers=headers)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Checks an If-None-Match header (which may list several, weak, tags)"""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+async def create_mockup(normalized: NormalizedImage, context: str) -> dict:
+    """
+    Sends a normalized image to OpenRouter for a mockup and stores the result.
+    Raises on upstream errors; returns the /generate-mockup payload.
+    """
+    openrouter_key = os.getenv("OPENROUTER_API_KEY")
+    image_url = await to_data_url(normalized)
 
-        # 2. Craft the generation prompt using the professional prompt
-        prompt = MASTER_MOCKUP_PROMPT.format(context=context)
+    # 2. Craft the generation prompt using the professional prompt
+    prompt = MASTER_MOCKUP_PROMPT.format(context=context)
 
-        # 3. Make the API call exactly as requested
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
+    # 3. Make the API call through the pooled client (timeouts + retries),
+    # within the mockup route's time budget and concurrency cap
+    route = llm.registry.route('mockup')
+    UPSTREAM_PAYLOAD_SIZE.observe(len(image_url) + len(prompt), upstream="openrouter", direction="request")
+    async with llm.limit(route.model), track_upstream("openrouter", route.model):
+        response = await post_with_retry(
+            "https://openrouter.ai/api/v1/chat/completions",
+            budget=route.timeout,
+            stream=True,
             headers={
                 "Authorization": f"Bearer {openrouter_key}",
                 "Content-Type": "application/json",
             },
-            data=json.dumps({
-                "model": "google/gemini-2.5-flash-image-preview", # Using FLUX Pro model for high-quality image generation
+            json={
+                "model": route.model,
                 "messages": [
                     {
                         "role": "user",
@@ -317,61 +755,138 @@ async def generate_mockup(
                         ]
                     }
                 ]
-            })
+            }
         )
-        # 1. Print the status code and the raw response to your terminal for debugging
-        print(f"DEBUG: Status Code from OpenRouter: {response.status_code}")
-        
-        if response.status_code != 200:
-            error_text = response.text
-            print(f"DEBUG: Error response: {error_text}")
-            return {"error": f"OpenRouter API error: {response.status_code} - {error_text}"}
-            
-        response_json = response.json()
-        print(f"DEBUG: Full response: {response_json}")
-        
-        message = response_json["choices"][0]["message"]
-        base64_url = None
-        
-        # Try different response formats
-        if "images" in message and message["images"]:
-            base64_url = message["images"][0]["image_url"]["url"]
-        elif "content" in message and isinstance(message["content"], list):
-            # Some models return content as a list
-            for content_item in message["content"]:
-                if content_item.get("type") == "image_url":
-                    base64_url = content_item["image_url"]["url"]
-                    break
-        elif "content" in message and isinstance(message["content"], str):
-            # Some models might return the base64 directly in content
-            if message["content"].startswith("data:image"):
-                base64_url = message["content"]
-
-        if not base64_url:
-            print(f"DEBUG: Could not find image in response: {message}")
-            return {"error": f"API response was successful, but no image data was found. Response structure: {message}"}
-
-        # 3. Decode and save the image
-        header, base64_string = base64_url.split(",", 1)
-        image_data = base64.b64decode(base64_string)
-        
-        output_filename = f"generated_or_{image.filename}"
-        output_filepath = os.path.join("static", output_filename)
-        os.makedirs("static", exist_ok=True)
-        
-        with open(output_filepath, "wb") as f:
-            f.write(image_data)
-        
-        return {
-            "status": "Mockup generated and saved successfully with OpenRouter!",
-            "filename": output_filename,
-            "url": f"/static/{output_filename}"
-        }
+        try:
+            if response.status_code != 200:
+                error_text = (await response.aread()).decode("utf-8", "replace")
+                UPSTREAM_PAYLOAD_SIZE.observe(len(error_text), upstream="openrouter", direction="response")
+                logger.warning("openrouter_error", extra={"status_code": response.status_code, "body": error_text[:500]})
+                raise RuntimeError(f"OpenRouter API error: {response.status_code} - {error_text}")
 
-        
+            # The reply is one JSON document holding a multi-megabyte base64 image in one of
+            # three message shapes; decode it as it arrives and write it straight to disk
+            decoder = DataURLStreamDecoder()
+
+            async def image_chunks():
+                async for raw in response.aiter_bytes():
+                    for chunk in decoder.feed(raw):
+                        yield chunk
+
+            spooled = await asset_store.spool(image_chunks())
+        finally:
+            await response.aclose()
+    UPSTREAM_PAYLOAD_SIZE.observe(decoder.bytes_read, upstream="openrouter", direction="response")
+
+    if not decoder.found or not decoder.done or not spooled.size:
+        os.unlink(spooled.path)
+        logger.warning("openrouter_no_image", extra={"message_keys": decoder.message_keys})
+        if decoder.error_message:
+            raise RuntimeError(f"OpenRouter API error: {decoder.error_message}")
+        raise RuntimeError(
+            f"API response was successful, but no image data was found. Message fields: {decoder.message_keys}"
+        )
+
+    # 3. Store the image under its content hash
+    asset = await asset_store.put_image_file(spooled, decoder.mime_type or "image/png")
+    
+    return {
+        "status": "Mockup generated and saved successfully with OpenRouter!",
+        "filename": asset.name,
+        "url": asset.url,
+        "variants": asset.variants
+    }
+
+@app.post("/generate-mockup")
+async def generate_mockup(
+    image: UploadFile = File(...),
+    context: str = Form(...)
+):
+    """
+    Tests the OpenRouter Chat Completions endpoint for image generation.
+    """
+    try:
+        # Validate and process uploaded file
+        with await process_uploaded_file(image) as upload:
+            # 1. Downsample and re-encode the uploaded image, keeping its real type
+            normalized = await normalize_upload(upload.source, MOCKUP_IMAGE_MAX_EDGE)
+
+        return await create_mockup(normalized, context)
+
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
+        return {"error": "OpenRouter API timed out - please try again"}
     except Exception as e:
            return {"error": str(e)}   
 
+async def run_mockup_job(payload: dict, data: bytes) -> dict:
+    """Job handler: generates a mockup from a stored, already normalized image"""
+    normalized = NormalizedImage(data, payload["mime_type"], payload["width"], payload["height"], payload["original_size"])
+    return await create_mockup(normalized, payload["context"])
+
+# Background mockup generation; jobs persist in SQLite across restarts
+mockup_jobs = JobQueue(JobStore(MOCKUP_JOB_DB), run_mockup_job)
+
+def job_payload(job: dict, deduplicated: bool = False) -> dict:
+    return {
+        **job,
+        "deduplicated": deduplicated,
+        "status_url": f"/mockup-jobs/{job['job_id']}",
+        "events_url": f"/mockup-jobs/{job['job_id']}/events",
+    }
+
+@app.post("/mockup-jobs", status_code=202)
+async def submit_mockup_job(
+    image: UploadFile = File(...),
+    context: str = Form(...)
+):
+    """
+    Queues a mockup generation and returns a job ID right away. Poll the
+    status_url or subscribe to events_url for the result. Submitting the
+    same image and context again returns the existing job.
+    """
+    with await process_uploaded_file(image) as upload:
+        dedupe_key = make_key("mockup", upload.sha256, context, MOCKUP_IMAGE_MAX_EDGE, llm.model_for('mockup'))
+        normalized = await normalize_upload(upload.source, MOCKUP_IMAGE_MAX_EDGE)
+
+    payload = {
+        "context": context,
+        "mime_type": normalized.mime_type,
+        "width": normalized.width,
+        "height": normalized.height,
+        "original_size": normalized.original_size,
+    }
+    try:
+        job, deduplicated = await mockup_jobs.submit(dedupe_key, payload, normalized.data)
+    except QueueFull:
+        return FastJSONResponse(status_code=503, headers={"Retry-After": "30"},
+                            content={"error": "Too many mockups are queued - please try again shortly"})
+    return job_payload(job, deduplicated)
+
+@app.get("/mockup-jobs/{job_id}")
+async def get_mockup_job(job_id: str):
+    """Current status of a mockup job, with its result once it has succeeded"""
+    job = await mockup_jobs.get(job_id)
+    if job is None:
+        return FastJSONResponse(status_code=404, content={"error": "Job not found"})
+    return job_payload(job)
+
+@app.get("/mockup-jobs/{job_id}/events")
+async def mockup_job_events(job_id: str):
+    """
+    Server-Sent Events for a mockup job: a "status" event on every status
+    change, ending after "succeeded" or "failed".
+    """
+    if await mockup_jobs.get(job_id) is None:
+        return FastJSONResponse(status_code=404, content={"error": "Job not found"})
+
+    async def events():
+        async for job in mockup_jobs.watch(job_id):
+            yield format_sse("status", job_payload(job)) if job else ": keepalive\n\n"
+
+    return SSEResponse(events())
+
  # In main.py
 
 class TranslateRequest(BaseModel):
@@ -379,10 +894,48 @@ class TranslateRequest(BaseModel):
     target_language: str
     context: str # e.g., "Instagram post", "Product description"
 
+class BatchTranslateRequest(BaseModel):
+    text_to_translate: str
+    target_languages: List[str]
+    context: str
+
 class QRCodeRequest(BaseModel):
     url: str
-    size: int = 10  # QR code size (1-40)
-    border: int = 4  # Border size
+    size: int = Field(10, ge=1, le=QR_MAX_SIZE)  # Pixels per module
+    border: int = Field(4, ge=0, le=QR_MAX_BORDER)  # Quiet zone, in modules
+    format: Literal["png", "svg"] = "png"
+    inline: bool = False  # Return the image bytes instead of a file URL
+
+class QRBatchRequest(BaseModel):
+    items: List[QRCodeRequest]
+
+def language_key(language: str) -> str:
+    """How target languages are compared: "Hindi", " hindi" and "HINDI" are one language"""
+    return language.strip().casefold()
+
+async def translate_with_memory(text: str, target_language: str, context: str) -> str:
+    """
+    Translates one text, reusing the translation memory when the same text,
+    language and context were translated before by the same model.
+    """
+    memory_key = make_key(
+        hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        language_key(target_language),
+        context,
+        TRANSLATION_PROMPT_VERSION,
+        llm.model_for('translation'),
+    )
+    remembered = await translation_memory.get(memory_key)
+    if remembered is not None:
+        return remembered
+
+    async def translate():
+        prompt = TRANSLATION_PROMPT.format(target_language=target_language, context=context, text=text)
+        translated_text = await llm.generate_for('translation', prompt)
+        await translation_memory.set(memory_key, translated_text)
+        return translated_text
+
+    return await translation_flights.do(memory_key, translate)
 
 @app.post("/translate")
 async def translate_text(request: TranslateRequest):
@@ -390,90 +943,270 @@ async def translate_text(request: TranslateRequest):
     Translates and culturally adapts text for a specific language and context.
     """
     try:
-        print(f"DEBUG: Translation request received:")
-        print(f"  - Target language: {request.target_language}")
-        print(f"  - Context: {request.context}")
-        print(f"  - Text to translate: {request.text_to_translate[:100]}...")
-        
-        text_model = genai.GenerativeModel('gemini-2.5-flash-lite')
-        prompt = f"""
-        You are an expert translator specializing in marketing copy for artisanal goods.
-        Translate the following text into {request.target_language}.
-        The context of the text is a "{request.context}".
-        Do not just translate literally. Culturally adapt the tone and phrasing to be compelling for an audience in that region.
-
-        Text to translate:
-        ---
-        {request.text_to_translate}
-        ---
-        
-        Your output should be ONLY the translated text.
-        """
-        
-        print(f"DEBUG: Sending request to Gemini...")
-        response = text_model.generate_content(prompt)
-        print(f"DEBUG: Gemini response received: {response.text[:100]}...")
-        
-        result = {"translated_text": response.text}
-        print(f"DEBUG: Returning result: {result}")
-        return result
+        translated_text = await translate_with_memory(
+            request.text_to_translate, request.target_language, request.context
+        )
+        logger.info("translation_ready", extra={
+            "target_language": request.target_language,
+            "context": request.context,
+            "chars_in": len(request.text_to_translate),
+            "chars_out": len(translated_text),
+        })
+        return {"translated_text": translated_text}
     except Exception as e:
-        print(f"DEBUG: Translation error: {str(e)}")
+        logger.warning("translation_failed", extra={"target_language": request.target_language, "error": str(e)})
         return {"error": str(e)}
 
+@app.post("/translate-batch")
+async def translate_batch(request: BatchTranslateRequest):
+    """
+    Translates one text into several languages in a single round trip.
+    Languages are translated concurrently; a failure in one language is
+    reported under "errors" without failing the others.
+    """
+    # Drop duplicate languages (compared as the translation memory does) but keep the order the client asked for
+    languages = {}
+    for lang in request.target_languages:
+        if lang.strip():
+            languages.setdefault(language_key(lang), lang.strip())
+    languages = list(languages.values())
+    if not languages:
+        return {"error": "No target languages given"}
+
+    results = await asyncio.gather(
+        *(translate_with_memory(request.text_to_translate, lang, request.context) for lang in languages),
+        return_exceptions=True
+    )
+
+    translations, errors = {}, {}
+    for lang, result in zip(languages, results):
+        if isinstance(result, Exception):
+            errors[lang] = str(result)
+        else:
+            translations[lang] = result
+
+    return {"translations": translations, "errors": errors}
+
 @app.post("/generate-qr")
 async def generate_qr_code(request: QRCodeRequest):
     """
     Generates a QR code for the given URL and returns the image file path.
+    With inline=true the PNG/SVG bytes are returned directly instead.
     """
     try:
-        # Create QR code instance
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=request.size,
-            border=request.border,
-        )
-        
-        # Add data to QR code
-        qr.add_data(request.url)
-        qr.make(fit=True)
-        
-        # Create QR code image
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save QR code image
-        qr_filename = f"qr_code_{hash(request.url) % 10000}.png"
-        qr_filepath = os.path.join("static", qr_filename)
-        os.makedirs("static", exist_ok=True)
-        
-        qr_image.save(qr_filepath)
-        
+        if request.inline:
+            qr_bytes = await qr_service.render(request.url, request.size, request.border, request.format)
+            name = f"{qr_digest(request.url, request.size, request.border, request.format)}.{request.format}"
+            return Response(
+                qr_bytes,
+                media_type=QR_FORMATS[request.format],
+                headers={"ETag": f'"{name}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+            )
+
+        asset = await qr_service.store(request.url, request.size, request.border, request.format)
         return {
             "status": "QR code generated successfully",
-            "filename": qr_filename,
-            "url": f"/static/{qr_filename}",
+            "filename": asset.name,
+            "url": asset.url,
             "qr_data": request.url
         }
         
     except Exception as e:
         return {"error": str(e)}
+
+@app.post("/generate-qr-batch")
+async def generate_qr_batch(request: QRBatchRequest):
+    """
+    Generates QR codes for a whole catalog in one request. Codes are
+    rendered in parallel and identical items are only rendered once.
+    """
+    if len(request.items) > QR_BATCH_MAX_ITEMS:
+        return FastJSONResponse(status_code=400, content={"error": f"Too many items. Maximum batch size: {QR_BATCH_MAX_ITEMS}"})
+
+    results = await qr_service.store_many(
+        (item.url, item.size, item.border, item.format) for item in request.items
+    )
+
+    items = []
+    for item, result in zip(request.items, results):
+        if isinstance(result, Exception):
+            items.append({"qr_data": item.url, "error": str(result)})
+        else:
+            items.append({"qr_data": item.url, "filename": result.name, "url": result.url})
+    return {"status": "QR codes generated", "count": len(items), "items": items}
     
+def analysis_description(ai_analysis: str) -> str:
+    """Pulls the description out of a vision analysis, as the frontend does"""
+    try:
+        return parse_story_json(ai_analysis).get("description") or ai_analysis
+    except (ValueError, AttributeError):
+        return ai_analysis
+
+@app.post("/craft-pipeline")
+async def craft_pipeline(
+    image: UploadFile = File(...),
+    category: str = Form(...),
+    artisan_answers: List[str] = Form(...),
+    time_taken_hours: Optional[int] = Form(None), # pricing runs when given
+    mockup_context: Optional[str] = Form(None), # mockup runs when given
+    target_languages: List[str] = Form([]) # product description is translated into these
+):
+    """
+    Runs the whole craft flow in one request: analysis, story, pricing,
+    translations and mockup. Independent stages run concurrently (the mockup
+    only needs the image, pricing only needs the analysis) and each stage's
+    result is streamed back as a Server-Sent Event as soon as it finishes.
+    """
+    upload = await process_uploaded_file(image)
+    try:
+        return SSEResponse(craft_events(upload, category, artisan_answers, time_taken_hours, mockup_context,
+                                        target_languages), on_close=upload.close)
+    except BaseException:
+        upload.close()
+        raise
+
+async def craft_events(upload: IntakeUpload, category: str, artisan_answers: List[str],
+                       time_taken_hours: Optional[int], mockup_context: Optional[str], target_languages: List[str]):
+    """The /craft-pipeline event stream. The upload is closed by the response."""
+    async def analysis(inputs):
+        return await analyze_upload(upload, category)
+
+    async def story(inputs):
+        description = analysis_description(inputs["analysis"]["ai_analysis"])
+        return await generate_story(StoryData(initial_description=description, artisan_answers=artisan_answers))
+
+    async def pricing(inputs):
+        description = analysis_description(inputs["analysis"]["ai_analysis"])
+        return {"pricing_suggestion": await suggest_pricing(description, category, time_taken_hours)}
+
+    async def translations(inputs):
+        text = inputs["story"]["final_content"].get("product_description", "")
+        return await translate_batch(BatchTranslateRequest(
+            text_to_translate=text, target_languages=target_languages, context="Product description"
+        ))
+
+    async def mockup(inputs):
+        normalized = await normalize_upload(upload.source, MOCKUP_IMAGE_MAX_EDGE)
+        return await create_mockup(normalized, mockup_context)
+
+    stages = [Stage("analysis", analysis), Stage("story", story, ("analysis",))]
+    if time_taken_hours is not None:
+        stages.append(Stage("pricing", pricing, ("analysis",)))
+    if target_languages:
+        stages.append(Stage("translations", translations, ("story",)))
+    if mockup_context:
+        stages.append(Stage("mockup", mockup))
+
+    async for event in run_pipeline(stages):
+        yield format_sse(event["stage"] if event["stage"] == "pipeline" else "stage", event)
+
+def fetch_story(story_id: str):
+    """Reads one story document from Firestore. Blocking - call it off the event loop."""
+    doc = db.collection(u'stories').document(story_id).get()
+    return jsonable_encoder(doc.to_dict()) if doc.exists else None
+
+def story_cache_entry(story: dict):
+    """(story, etag) pair as kept in the story cache"""
+    return story, f'"{make_key(json.dumps(story, sort_keys=True))[:32]}"'
+
+async def load_story(story_id: str):
+    """
+    Read-through cache in front of the stories collection. Returns
+    (story, etag) or None. A burst of cold scans for the same story is
+    coalesced into a single Firestore read.
+    """
+    entry = await story_cache.get(story_id)
+    if entry is not None:
+        return entry
+
+    async def load():
+        # Stories still waiting in the write-behind spool are served from there
+        story = await story_writer.get_pending(story_id) if story_writer else None
+        if story is None:
+            async with track_upstream("firestore", "get_story"):
+                story = await run_io(fetch_story, story_id)
+        if story is None:
+            return None
+        entry = story_cache_entry(story)
+        await story_cache.set(story_id, entry)
+        return entry
+
+    return await story_loads.do(story_id, load)
+
 @app.get("/story/{story_id}")
-def get_story(story_id: str):
+async def get_story(story_id: str, request: Request, fields: Optional[str] = None):
     """
     Fetches a specific story from Firestore. This is the endpoint the QR code will use.
-    Only available if Firebase is configured.
+    Only available if Firebase is configured. Supports If-None-Match revalidation,
+    and `fields` to return only some sections (e.g. "instagram_post,art_classification").
     """
+    paths = requested_fields(fields)
     if not firebase_enabled or not db:
-        return {"error": "QR code story feature not available - Firebase not configured"}, 404
+        return FastJSONResponse(status_code=404, content={"error": "QR code story feature not available - Firebase not configured"})
     
     try:
-        doc_ref = db.collection(u'stories').document(story_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            return doc.to_dict()
-        else:
-            return {"error": "Story not found"}, 404
+        entry = await load_story(story_id)
+    except Exception as e:
+        return FastJSONResponse(status_code=500, content={"error": f"An error occurred: {str(e)}"})
+
+    if entry is None:
+        return FastJSONResponse(status_code=404, content={"error": "Story not found"})
+
+    story, etag = entry
+    if paths is not None:
+        # Each selection is its own representation, so it gets its own validator
+        etag = f'"{etag[1:-1]}-{make_key(*paths)[:8]}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={STORY_CACHE_MAX_AGE}"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(project(story, paths), headers=headers)
+
+async def load_story_listing(limit: int, cursor: Optional[str], art_form: Optional[str]):
+    """
+    One gallery page as (payload, etag), read from the summary index through
+    a short-lived cache. Concurrent loads of the same page share one query.
+    """
+    key = make_key("stories", limit, cursor or "", (art_form or "").strip().casefold())
+    entry = await story_listings.get(key)
+    if entry is not None:
+        return entry
+
+    async def load():
+        async with track_upstream("firestore", "list_stories"):
+            summaries, next_cursor = await run_io(list_summaries, db, limit, cursor, art_form)
+        payload = {"stories": [listing_item(s) for s in summaries], "next_cursor": next_cursor}
+        entry = story_cache_entry(payload)
+        await story_listings.set(key, entry)
+        return entry
+
+    return await story_listing_loads.do(key, load)
+
+@app.get("/stories")
+async def list_stories(request: Request, limit: int = STORY_LIST_DEFAULT_LIMIT, cursor: Optional[str] = None,
+                       art_form: Optional[str] = None):
+    """
+    Lists stories newest first for the gallery: ID, title, art form,
+    thumbnail and price range only. Pass the returned `next_cursor` as
+    `cursor` for the next page, and `art_form` to filter by art form name.
+    Only available if Firebase is configured. Supports If-None-Match revalidation.
+    """
+    if not firebase_enabled or not db:
+        return FastJSONResponse(status_code=404, content={"error": "Story gallery not available - Firebase not configured"})
+    if not 1 <= limit <= STORY_LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {STORY_LIST_MAX_LIMIT}")
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        entry = await load_story_listing(limit, cursor, art_form)
     except Exception as e:
-        return {"error": f"An error occurred: {str(e)}"}, 500    
\ No newline at end of file
+        return FastJSONResponse(status_code=500, content={"error": f"An error occurred: {str(e)}"})
+
+    payload, etag = entry
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={STORY_CACHE_MAX_AGE}"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(payload, headers=headers)
@@ -0,0 +1,97 @@
+"""
+Maps each task to the model that serves it.
+
+Endpoints ask for a task ("vision", "pricing", ...) instead of hardcoding
+model names. Each route has a primary model, a timeout, a concurrency cap
+and an ordered list of fallbacks tried when the primary is slow or
+failing. A route also names the API that serves it: "gemini" routes go
+through the LLM client's provider, while the mockup route is called on
+OpenRouter directly. Routes can be overridden from the environment without code edits:
+
+    MODEL_PRICING=gemini-2.5-pro
+    MODEL_PRICING_TIMEOUT=20
+    MODEL_PRICING_CONCURRENCY=2
+    MODEL_PRICING_FALLBACKS=gemini-2.5-flash,gemini-2.5-flash-lite
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+
+@dataclass
+class ModelRoute:
+    task: str
+    model: str
+    timeout: float
+    concurrency: int
+    fallbacks: List[str] = field(default_factory=list)
+    provider: str = "gemini"
+
+    @property
+    def models(self) -> List[str]:
+        return [self.model] + [m for m in self.fallbacks if m != self.model]
+
+
+DEFAULT_ROUTES = {
+    "general": ModelRoute("general", "gemini-2.5-flash-lite", 30, 8),
+    "vision": ModelRoute("vision", "gemini-2.5-flash-lite", 60, 8),
+    "storytelling": ModelRoute("storytelling", "gemini-2.5-flash-lite", 90, 8),
+    "pricing": ModelRoute("pricing", "gemini-2.5-flash", 30, 4, ["gemini-2.5-flash-lite"]),
+    "translation": ModelRoute("translation", "gemini-2.5-flash-lite", 30, 8),
+    "mockup": ModelRoute("mockup", "google/gemini-2.5-flash-image-preview", 150, 4, provider="openrouter"),
+}
+
+
+class ModelRegistry:
+    def __init__(self, routes: Dict[str, ModelRoute]):
+        self.routes = routes
+
+    def route(self, task: str) -> ModelRoute:
+        if task not in self.routes:
+            raise KeyError(f"No model route configured for task '{task}'")
+        return self.routes[task]
+
+    def model_concurrency(self) -> Dict[str, int]:
+        """
+        Concurrency cap per model name: the largest cap of the routes it is
+        the primary for. Being some route's fallback never lowers it; a model
+        that is only ever a fallback gets the largest cap of those routes.
+        """
+        primary: Dict[str, int] = {}
+        fallback: Dict[str, int] = {}
+        for route in self.routes.values():
+            primary[route.model] = max(primary.get(route.model, 0), route.concurrency)
+            for model in route.models[1:]:
+                fallback[model] = max(fallback.get(model, 0), route.concurrency)
+        return {**fallback, **primary}
+
+    def models_for_provider(self, provider: str) -> List[str]:
+        """Every model (primaries and fallbacks) of the routes served by `provider`, in route order"""
+        models: List[str] = []
+        for route in self.routes.values():
+            if route.provider == provider:
+                models.extend(m for m in route.models if m not in models)
+        return models
+
+    def describe(self) -> Dict[str, dict]:
+        return {
+            task: {"model": r.model, "timeout": r.timeout, "concurrency": r.concurrency, "fallbacks": r.fallbacks,
+                   "provider": r.provider}
+            for task, r in self.routes.items()
+        }
+
+    @classmethod
+    def from_env(cls, defaults: Dict[str, ModelRoute] = None) -> "ModelRegistry":
+        routes = {}
+        for task, default in (defaults or DEFAULT_ROUTES).items():
+            prefix = f"MODEL_{task.upper()}"
+            fallbacks = os.getenv(f"{prefix}_FALLBACKS")
+            routes[task] = ModelRoute(
+                task,
+                os.getenv(prefix, default.model),
+                float(os.getenv(f"{prefix}_TIMEOUT", default.timeout)),
+                int(os.getenv(f"{prefix}_CONCURRENCY", default.concurrency)),
+                [m.strip() for m in fallbacks.split(",") if m.strip()] if fallbacks is not None else list(default.fallbacks),
+                default.provider,
+            )
+        return cls(routes)
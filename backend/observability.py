@@ -0,0 +1,309 @@
+"""
+Metrics and structured logging.
+
+A small in-process metrics registry (counters, gauges and histograms) that
+renders the Prometheus text format for /metrics, plus a JSON log formatter
+so every log line carries its fields as data instead of free text.
+
+Request latency is recorded by MetricsMiddleware. Calls to upstreams
+(Gemini, OpenRouter, Firestore) are wrapped in `track_upstream`, so a p99
+spike can be pinned on the upstream that caused it.
+"""
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # "json" or "text"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(8))  # 1KB .. 16MB
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.series: Dict[LabelValues, dict] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["counts"][i] += 1
+                break
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(series['sum'], 6))}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+# A collector returns (name, type, help, {label dict as tuple of pairs: value}) samples at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, Dict[Tuple[Tuple[str, str], ...], float]]]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Collector):
+        """Registers a callback that reports values owned by another component (cache stats, queues, ...)"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.header() + metric.render()
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+                for labels, value in samples.items():
+                    names, values = zip(*labels) if labels else ((), ())
+                    lines.append(f"{name}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REQUEST_LATENCY = metrics.histogram(
+    "kala_http_request_duration_seconds", "Time to serve a request", ("method", "route", "status"))
+REQUESTS_IN_FLIGHT = metrics.gauge("kala_http_requests_in_flight", "Requests being served")
+RESPONSE_SIZE = metrics.histogram(
+    "kala_http_response_size_bytes", "Response body size", ("route",), SIZE_BUCKETS)
+REQUEST_SIZE = metrics.histogram(
+    "kala_http_request_size_bytes", "Request body size from Content-Length", ("route",), SIZE_BUCKETS)
+UPSTREAM_LATENCY = metrics.histogram(
+    "kala_upstream_duration_seconds", "Time spent in calls to an upstream", ("upstream", "operation", "outcome"))
+UPSTREAM_IN_FLIGHT = metrics.gauge("kala_upstream_in_flight", "Calls in flight per upstream", ("upstream",))
+UPSTREAM_PAYLOAD_SIZE = metrics.histogram(
+    "kala_upstream_payload_size_bytes", "Size of payloads exchanged with an upstream",
+    ("upstream", "direction"), SIZE_BUCKETS)
+LLM_TOKENS = metrics.counter("kala_llm_tokens_total", "LLM tokens by model and kind", ("model", "kind"))
+
+
+@asynccontextmanager
+async def track_upstream(upstream: str, operation: str):
+    """Times a call to an upstream and counts it as in flight while it runs"""
+    UPSTREAM_IN_FLIGHT.inc(upstream=upstream)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_IN_FLIGHT.dec(upstream=upstream)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream=upstream, operation=operation, outcome=outcome)
+
+
+def record_llm_usage(model_name: str, response):
+    """Counts prompt, cached and output tokens from a Gemini response's usage metadata"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    LLM_TOKENS.inc(prompt_tokens - cached_tokens, model=model_name, kind="prompt_uncached")
+    LLM_TOKENS.inc(cached_tokens, model=model_name, kind="prompt_cached")
+    LLM_TOKENS.inc(output_tokens, model=model_name, kind="output")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency, status, in-flight count and
+    payload sizes per route. Routes are labelled by their path template
+    (/story/{story_id}), so IDs don't blow up the label cardinality.
+    """
+
+    def __init__(self, app, skip_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500, "bytes": 0}
+        REQUESTS_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                status["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.observe(time.perf_counter() - start, method=scope["method"],
+                                    route=route_label, status=status["code"])
+            RESPONSE_SIZE.observe(status["bytes"], route=route_label)
+            content_length = dict(scope.get("headers") or []).get(b"content-length")
+            if content_length and content_length.isdigit():
+                REQUEST_SIZE.observe(int(content_length), route=route_label)
+
+
+class StartupTimer:
+    """Records how long each startup phase took, reported on /ready and /status"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready_ms: Optional[float] = None
+
+    def record(self, name: str, since: float):
+        self.phases[name] = round((time.perf_counter() - since) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def mark_ready(self):
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def report(self) -> dict:
+        return {"phases_ms": dict(self.phases), "ready_after_ms": self.ready_ms}
+
+
+# Created when the app starts importing its modules, so ready_after_ms covers imports too
+startup = StartupTimer()
+
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Sends the app's loggers to stdout, one JSON object per line unless LOG_FORMAT=text"""
+    handler = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger = logging.getLogger("kala")
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"kala.{name}")
@@ -0,0 +1,91 @@
+"""
+Tiny dependency-graph runner for multi-stage requests.
+
+Every stage starts as soon as the stages it depends on have finished, so
+independent stages run concurrently and the whole graph takes about as long
+as its slowest path. Results are yielded as events in completion order, each
+with its own timing, so they can be streamed back to the client.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]  # receives the results of its dependencies
+    depends_on: Tuple[str, ...] = ()
+
+
+class StageSkipped(Exception):
+    pass
+
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+async def run_pipeline(stages: List[Stage]) -> AsyncIterator[dict]:
+    """
+    Runs the stages and yields one event per stage as it completes:
+    {"stage", "status": ok|error|skipped, "result" or "error", "started_ms", "elapsed_ms"}.
+    A stage whose dependency failed is skipped. The last event is a summary.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = set(stage.depends_on) - names
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {sorted(missing)}")
+
+    pipeline_start = time.perf_counter()
+    events: asyncio.Queue = asyncio.Queue()
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def execute(stage: Stage):
+        try:
+            inputs = {}
+            for dependency in stage.depends_on:
+                try:
+                    inputs[dependency] = await tasks[dependency]
+                except Exception:
+                    raise StageSkipped(f"dependency '{dependency}' did not complete")
+
+            started = time.perf_counter()
+            event = {"stage": stage.name, "started_ms": round((started - pipeline_start) * 1000, 1)}
+            try:
+                result = await stage.run(inputs)
+            except Exception as e:
+                event.update(status="error", error=str(e), elapsed_ms=elapsed_ms(started))
+                events.put_nowait(event)
+                raise
+            event.update(status="ok", result=result, elapsed_ms=elapsed_ms(started))
+            events.put_nowait(event)
+            return result
+        except StageSkipped as e:
+            events.put_nowait({"stage": stage.name, "status": "skipped", "error": str(e)})
+            raise
+
+    # Tasks must all exist before any of them looks up its dependencies
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(execute(stage))
+
+    try:
+        timings = {}
+        for _ in stages:
+            event = await events.get()
+            timings[event["stage"]] = event.get("elapsed_ms")
+            yield event
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        # Collect outcomes so failed stages don't log "exception never retrieved"
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    yield {
+        "stage": "pipeline",
+        "status": "done",
+        "elapsed_ms": elapsed_ms(pipeline_start),
+        "stage_timings_ms": timings,
+    }
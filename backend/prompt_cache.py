@@ -0,0 +1,115 @@
+"""
+Gemini context caching for the static part of our prompts.
+
+The storyteller and vision instructions are the same on every call. Instead
+of resending them, each (model, instructions) pair is registered once as
+Gemini cached content and requests only carry the variable part. A cache is
+recreated shortly before it expires, and a change to the instruction text or
+the TTL gives a new key and therefore a new cache.
+
+If a cache can't be created (caching disabled, an unsupported model, or
+instructions below the model's minimum cacheable size), calls fall back to
+sending the instructions as a plain system instruction.
+"""
+import datetime
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from cache import make_key
+from executors import run_io
+from observability import get_logger
+from singleflight import SingleFlight
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+# Don't retry a cache that failed to be created for this many seconds
+PROMPT_CACHE_RETRY_AFTER = 600
+
+logger = get_logger("prompt_cache")
+
+
+@dataclass
+class CachedPrompt:
+    model: object  # genai.GenerativeModel
+    name: Optional[str]  # None when the instructions are sent uncached
+    expires_at: float
+
+
+class PromptCache:
+    """Hands out model clients whose static instructions live in Gemini's context cache"""
+
+    def __init__(self, ttl: int = PROMPT_CACHE_TTL, enabled: bool = PROMPT_CACHE_ENABLED):
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: Dict[str, CachedPrompt] = {}
+        self._creating = SingleFlight("prompt_cache")
+        self.stats = {
+            "created": 0,
+            "create_failures": 0,
+            "cached_calls": 0,
+            "uncached_calls": 0,
+            "cached_input_tokens": 0,
+            "uncached_input_tokens": 0,
+        }
+
+    def _refresh_margin(self) -> float:
+        return min(60.0, self.ttl / 10)
+
+    async def model(self, model_name: str, system_instruction: str):
+        """Returns a client for `model_name` with `system_instruction` baked in"""
+        key = make_key(model_name, system_instruction, self.ttl)
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at - self._refresh_margin() <= time.time():
+            entry = await self._creating.do(key, lambda: self._create(key, model_name, system_instruction))
+        return entry.model
+
+    async def _create(self, key: str, model_name: str, system_instruction: str) -> CachedPrompt:
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        entry = None
+        if self.enabled:
+            try:
+                cached = await run_io(
+                    caching.CachedContent.create,
+                    model=f"models/{model_name}",
+                    display_name=f"kala-{key[:16]}",
+                    system_instruction=system_instruction,
+                    ttl=datetime.timedelta(seconds=self.ttl),
+                )
+                entry = CachedPrompt(genai.GenerativeModel.from_cached_content(cached), cached.name,
+                                     time.time() + self.ttl)
+                self.stats["created"] += 1
+            except Exception as e:
+                self.stats["create_failures"] += 1
+                logger.warning("prompt_cache_create_failed", extra={"model": model_name, "error": str(e)})
+
+        if entry is None:
+            retry_after = PROMPT_CACHE_RETRY_AFTER if self.enabled else float("inf")
+            entry = CachedPrompt(genai.GenerativeModel(model_name, system_instruction=system_instruction),
+                                 None, time.time() + retry_after)
+        self._entries[key] = entry
+        return entry
+
+    def record_usage(self, response):
+        """Counts cached and uncached input tokens from a response's usage metadata"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+        self.stats["cached_calls" if cached_tokens else "uncached_calls"] += 1
+        self.stats["cached_input_tokens"] += cached_tokens
+        self.stats["uncached_input_tokens"] += prompt_tokens - cached_tokens
+
+    def status(self) -> dict:
+        total = self.stats["cached_input_tokens"] + self.stats["uncached_input_tokens"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "active_caches": sum(1 for e in self._entries.values() if e.name),
+            "cached_token_ratio": round(self.stats["cached_input_tokens"] / total, 3) if total else 0.0,
+        }
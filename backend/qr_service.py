@@ -0,0 +1,99 @@
+"""
+Deterministic, cached QR code rendering.
+
+Each QR code is identified by a stable sha256 digest of (url, size, border,
+format), which doubles as its asset name. Rendered bytes are kept in an
+in-memory LRU and written once to the asset store, so repeat requests never
+re-render or rewrite the file.
+"""
+import asyncio
+import io
+import os
+
+from asset_store import AssetStore, StoredAsset
+from cache import TTLCache, make_key
+from executors import run_cpu, run_io
+
+QR_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+QR_BATCH_CONCURRENCY = int(os.getenv("QR_BATCH_CONCURRENCY", "8"))
+# Enough to tag a whole exhibition in one request
+QR_BATCH_MAX_ITEMS = int(os.getenv("QR_BATCH_MAX_ITEMS", "500"))
+# Pixels per module and quiet-zone width in modules; a 40px box already prints a poster-sized code
+QR_MAX_SIZE = 40
+QR_MAX_BORDER = 20
+
+
+def qr_digest(url: str, size: int, border: int, image_format: str) -> str:
+    return make_key("qr", url, size, border, image_format)
+
+
+def render_qr(url: str, size: int, border: int, image_format: str) -> bytes:
+    """Renders a QR code to PNG or SVG bytes. CPU-bound - run it off the event loop."""
+    import qrcode
+    import qrcode.image.svg
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=size,
+        border=border,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+
+    if image_format == "svg":
+        return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
+
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class QRService:
+    """Renders QR codes once per (url, size, border, format) and caches the result"""
+
+    def __init__(self, asset_store: AssetStore, memory: TTLCache = None):
+        self.asset_store = asset_store
+        self.memory = memory or TTLCache(maxsize=512, ttl=86400)
+        self.stats = {"rendered": 0, "memory_hits": 0, "disk_hits": 0}
+
+    async def render(self, url: str, size: int = 10, border: int = 4, image_format: str = "png") -> bytes:
+        """Returns the QR code bytes, rendering only on a cache miss"""
+        digest = qr_digest(url, size, border, image_format)
+        data = self.memory.get(digest)
+        if data is not None:
+            self.stats["memory_hits"] += 1
+            return data
+
+        data = await run_cpu(render_qr, url, size, border, image_format)
+        self.stats["rendered"] += 1
+        self.memory.set(digest, data)
+        return data
+
+    async def store(self, url: str, size: int = 10, border: int = 4, image_format: str = "png") -> StoredAsset:
+        """Returns the stored QR asset, writing it to the asset store the first time"""
+        name = f"{qr_digest(url, size, border, image_format)}.{image_format}"
+        if await run_io(self.asset_store.backend.exists, name):
+            self.stats["disk_hits"] += 1
+            return StoredAsset(name, self.asset_store.backend.url(name), 0, deduplicated=True)
+
+        data = await self.render(url, size, border, image_format)
+        return await self.asset_store.put(data, QR_FORMATS[image_format], name=name)
+
+    async def store_many(self, items) -> list:
+        """
+        Stores QR codes for many (url, size, border, format) tuples with bounded
+        concurrency, rendering duplicates once. Returns a StoredAsset or the
+        raised exception per item, in order.
+        """
+        items = list(items)
+        semaphore = asyncio.Semaphore(QR_BATCH_CONCURRENCY)
+
+        async def store_one(item):
+            async with semaphore:
+                return await self.store(*item)
+
+        unique = list(dict.fromkeys(items))
+        results = await asyncio.gather(*(store_one(item) for item in unique), return_exceptions=True)
+        by_item = dict(zip(unique, results))
+        return [by_item[item] for item in items]
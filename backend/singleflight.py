@@ -0,0 +1,40 @@
+"""
+Single-flight: concurrent calls with the same key share one execution.
+
+The first caller starts the work as its own task, and everyone who arrives
+while it's running awaits that same task, getting its result or its error.
+Cancelling one waiter (e.g. a client disconnect) doesn't cancel the work for
+the others.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs `fn()` unless a call for `key` is already in flight, then awaits it"""
+        task = self._tasks.get(key)
+        if task is None:
+            self.stats["calls"] += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
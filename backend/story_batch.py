@@ -0,0 +1,215 @@
+"""
+Bulk catalog analysis for /generate-story-batch.
+
+A shop being onboarded uploads dozens of pieces at once, as separate images
+or as one zip archive. Items are analyzed with bounded concurrency and each
+result is streamed as Server-Sent Events the moment it is ready, so the
+client shows progress instead of waiting for the slowest item.
+
+Items whose analysis failed upstream keep their normalized image in a small
+SQLite store for STORY_BATCH_RETENTION seconds, so they can be retried on
+their own without uploading or re-running the rest of the batch.
+Successful items land in the analysis cache as usual.
+"""
+import asyncio
+import os
+import posixpath
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, List, Optional, TypeVar
+
+from image_pipeline import NormalizedImage
+from observability import get_logger
+from streaming import format_sse
+from upload_intake import IntakeUpload, UPLOAD_SPOOL_DIR
+
+STORY_BATCH_DB = os.getenv("STORY_BATCH_DB", os.path.join("cache", "story_batches.sqlite3"))
+STORY_BATCH_CONCURRENCY = int(os.getenv("STORY_BATCH_CONCURRENCY", "4"))
+STORY_BATCH_MAX_ITEMS = int(os.getenv("STORY_BATCH_MAX_ITEMS", "100"))
+STORY_BATCH_MAX_BODY = int(os.getenv("STORY_BATCH_MAX_BODY", str(256 * 1024 * 1024)))
+# How long failed items stay retryable
+STORY_BATCH_RETENTION = float(os.getenv("STORY_BATCH_RETENTION", "86400"))
+
+logger = get_logger("batches")
+
+T = TypeVar("T")
+
+
+@dataclass
+class BatchItem:
+    """One piece of a batch: an upload read up front, or an archive member read when its turn comes"""
+    index: int
+    name: str
+    category: str
+    upload: Optional[IntakeUpload] = None
+    member: Optional[zipfile.ZipInfo] = None
+    error: Optional[str] = None  # rejected before analysis (bad type, too large, no category)
+
+
+def spool_archive(source: BinaryIO) -> str:
+    """Copies an uploaded archive to a temp file owned by the batch and returns its path"""
+    fd, path = tempfile.mkstemp(prefix="batch_", suffix=".zip", dir=UPLOAD_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as f:
+        source.seek(0)
+        shutil.copyfileobj(source, f, 1024 * 1024)
+    return path
+
+
+def open_archive(path: str) -> zipfile.ZipFile:
+    """Opens a zip archive, raising ValueError if it isn't one"""
+    try:
+        return zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError(f"Not a valid zip archive: {e}") from e
+
+
+def list_archive_items(archive: zipfile.ZipFile, default_category: str) -> List[BatchItem]:
+    """
+    The files in an archive that may be images, in archive order. A file's
+    top-level folder names its category ("Madhubani/peacock.jpg"); files at
+    the top level use `default_category`. Folders, hidden files and macOS
+    resource forks are skipped. Types are checked when each item is read.
+    """
+    items = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or posixpath.basename(name).startswith("."):
+            continue
+        folder = name.split("/", 1)[0] if "/" in name else ""
+        items.append(BatchItem(len(items), name, folder or default_category, member=info))
+    return items
+
+
+def read_archive_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_size: int) -> bytes:
+    """Reads one member, never decompressing more than max_size + 1 bytes"""
+    with archive.open(info) as member:
+        return member.read(max_size + 1)
+
+
+class FailedItemStore:
+    """SQLite table of batch items that failed upstream, kept with their normalized image for retries"""
+
+    def __init__(self, path: str, retention: float = STORY_BATCH_RETENTION):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS failed_items ("
+                "batch_id TEXT NOT NULL, item_index INTEGER NOT NULL, name TEXT NOT NULL, category TEXT NOT NULL, "
+                "sha256 TEXT NOT NULL, mime_type TEXT NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL, "
+                "original_size INTEGER NOT NULL, data BLOB NOT NULL, error TEXT, attempts INTEGER NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (batch_id, item_index))"
+            )
+
+    def save(self, batch_id: str, index: int, name: str, category: str, sha256: str,
+             image: NormalizedImage, error: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO failed_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (batch_id, item_index) DO UPDATE SET "
+                "error = excluded.error, attempts = attempts + 1, updated_at = excluded.updated_at",
+                (batch_id, index, name, category, sha256, image.mime_type, image.width, image.height,
+                 image.original_size, image.data, error, time.time()),
+            )
+
+    def load(self, batch_id: str) -> List[dict]:
+        """The batch's failed items that are still within the retention period, in item order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_index, name, category, sha256, mime_type, width, height, original_size, data, "
+                "error, attempts FROM failed_items WHERE batch_id = ? AND updated_at > ? ORDER BY item_index",
+                (batch_id, time.time() - self.retention),
+            ).fetchall()
+        return [
+            {
+                "index": index, "name": name, "category": category, "sha256": sha256,
+                "image": NormalizedImage(data, mime_type, width, height, original_size),
+                "error": error, "attempts": attempts,
+            }
+            for index, name, category, sha256, mime_type, width, height, original_size, data, error, attempts in rows
+        ]
+
+    def remove(self, batch_id: str, index: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM failed_items WHERE batch_id = ? AND item_index = ?", (batch_id, index))
+
+    def purge_expired(self) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM failed_items WHERE updated_at <= ?",
+                                        (time.time() - self.retention,))
+        return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM failed_items").fetchone()[0]
+
+
+async def run_bounded(items: List[T], process: Callable[[T], Awaitable[dict]],
+                      concurrency: int = STORY_BATCH_CONCURRENCY) -> AsyncIterator[dict]:
+    """
+    Runs process(item) for every item, at most `concurrency` at a time, and
+    yields the results in completion order. Closing the generator (e.g. when
+    the client disconnects) cancels the items still outstanding.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await process(item)
+
+    tasks = [asyncio.create_task(run(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def batch_events(batch_id: str, items: List[T], process: Callable[[T], Awaitable[dict]],
+                       retry_url: str, concurrency: int = STORY_BATCH_CONCURRENCY) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for a batch: "start", then an "item" and a "progress"
+    event per finished item, then "done" with the totals. process() returns
+    a result dict with "status" "ok" or "error" (and "retryable" on errors).
+    """
+    total = len(items)
+    succeeded = failed = retryable = 0
+    started = time.monotonic()
+    yield format_sse("start", {"batch_id": batch_id, "total": total})
+
+    async for result in run_bounded(items, process, concurrency):
+        if result["status"] == "ok":
+            succeeded += 1
+        else:
+            failed += 1
+            retryable += bool(result.get("retryable"))
+        yield format_sse("item", result)
+        yield format_sse("progress", {"done": succeeded + failed, "total": total, "failed": failed})
+
+    summary = {
+        "batch_id": batch_id,
+        "total": total,
+        "succeeded": succeeded,
+        "failed": failed,
+        "retryable": retryable,
+        "retry_url": retry_url if retryable else None,
+        "elapsed_s": round(time.monotonic() - started, 1),
+    }
+    logger.info("batch_finished", extra=summary)
+    yield format_sse("done", summary)
+
+
+def error_result(index: int, name: str, category: str, error: str, retryable: bool,
+                 sha256: Optional[str] = None) -> dict:
+    return {"index": index, "name": name, "category": category, "status": "error", "error": error,
+            "retryable": retryable, "sha256": sha256}
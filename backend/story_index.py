@@ -0,0 +1,162 @@
+"""
+Summary index behind the /stories gallery listing.
+
+A full story document carries the whole video script, marketplace list and
+translations, so listing stories by reading the `stories` collection means
+N large reads. Instead, every story written by the StoryWriter gets a small
+companion document in `story_summaries` in the same batch commit: title,
+art form, thumbnail, price range and a sort key. A gallery page is then one
+projected query over that collection.
+
+Summaries are ordered newest first by `sort_key` (creation time plus story
+ID, so ties still have a total order), and the page cursor is that key,
+encoded so clients treat it as opaque. Filtering by art form needs a
+composite Firestore index on (art_form_key ASC, sort_key DESC); the
+unfiltered listing uses the automatic single-field index.
+
+Stories saved before the index existed are added with `backfill_summaries`.
+"""
+import base64
+import binascii
+import time
+from typing import List, Optional, Tuple
+
+from observability import get_logger
+
+STORY_SUMMARY_COLLECTION = "story_summaries"
+TITLE_MAX_LENGTH = 80
+
+# The only fields a listing reads back from Firestore
+LISTING_FIELDS = ["story_id", "title", "art_form_name", "thumbnail_url", "price_range", "sort_key"]
+
+logger = get_logger("stories")
+
+
+def _short_title(text: str) -> str:
+    """First sentence or line of a longer text, cut at a word boundary"""
+    title = text.strip().split("\n", 1)[0].split(". ", 1)[0].strip()
+    if len(title) > TITLE_MAX_LENGTH:
+        title = title[:TITLE_MAX_LENGTH].rsplit(" ", 1)[0].rstrip(",;:-") + "…"
+    return title
+
+
+def art_form_key(name: str) -> str:
+    """Normalized art form name used for filtering, so "madhubani" matches "Madhubani " """
+    return " ".join(name.split()).casefold()
+
+
+def sort_key(created_at: float, story_id: str) -> str:
+    """Fixed-width creation time plus ID; sorts the same as (created_at, story_id)"""
+    return f"{created_at:017.6f}-{story_id}"
+
+
+def story_summary(story_id: str, story: dict, created_at: float) -> dict:
+    """The summary document for a story, as stored in the index"""
+    video_script = story.get("video_script") if isinstance(story.get("video_script"), dict) else {}
+    classification = story.get("art_classification") if isinstance(story.get("art_classification"), dict) else {}
+    pricing = story.get("pricing_guidance") if isinstance(story.get("pricing_guidance"), dict) else {}
+
+    title = video_script.get("title") or _short_title(
+        story.get("product_description") or story.get("instagram_post") or "")
+    art_form_name = (classification.get("art_form_name") or "").strip()
+    return {
+        "story_id": story_id,
+        "title": title or None,
+        "art_form_name": art_form_name or None,
+        "art_form_key": art_form_key(art_form_name) if art_form_name else None,
+        # Stories don't carry an image today; clients that attach a mockup URL get it listed
+        "thumbnail_url": story.get("thumbnail_url") or story.get("mockup_url"),
+        "price_range": pricing.get("suggested_price_range") or story.get("suggested_price_range"),
+        "created_at": created_at,
+        "sort_key": sort_key(created_at, story_id),
+    }
+
+
+def listing_item(summary: dict) -> dict:
+    """A summary as returned by /stories"""
+    return {
+        "id": summary["story_id"],
+        "title": summary.get("title"),
+        "art_form": summary.get("art_form_name"),
+        "thumbnail_url": summary.get("thumbnail_url"),
+        "price_range": summary.get("price_range"),
+    }
+
+
+def encode_cursor(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    """The sort key inside a cursor; raises ValueError for anything this module didn't produce"""
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    created_at, _, story_id = key.partition("-")
+    try:
+        float(created_at)
+    except ValueError:
+        raise ValueError("Invalid cursor") from None
+    if not story_id:
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def list_summaries(db, limit: int, cursor: Optional[str] = None,
+                   art_form: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of summaries, newest first, and the cursor for the next page
+    (None on the last page). Blocking - call it off the event loop.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    query = db.collection(STORY_SUMMARY_COLLECTION)
+    if art_form:
+        query = query.where(filter=FieldFilter("art_form_key", "==", art_form_key(art_form)))
+    query = query.order_by("sort_key", direction="DESCENDING").select(LISTING_FIELDS)
+    if cursor:
+        query = query.start_after({"sort_key": decode_cursor(cursor)})
+    # One extra document tells us whether there is a next page
+    summaries = [doc.to_dict() for doc in query.limit(limit + 1).stream()]
+    if len(summaries) <= limit:
+        return summaries, None
+    summaries = summaries[:limit]
+    return summaries, encode_cursor(summaries[-1]["sort_key"])
+
+
+def backfill_summaries(db, batch_size: int = 200) -> int:
+    """
+    Writes summaries for stories saved before the index existed, using each
+    document's Firestore creation time. Idempotent. Returns how many were written.
+    """
+    written = 0
+    batch, pending = db.batch(), 0
+    for doc in db.collection(u'stories').stream():
+        created_at = doc.create_time.timestamp() if doc.create_time else time.time()
+        summary = story_summary(doc.id, doc.to_dict() or {}, created_at)
+        batch.set(db.collection(STORY_SUMMARY_COLLECTION).document(doc.id), summary)
+        pending += 1
+        if pending == batch_size:
+            batch.commit()
+            written += pending
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+        written += pending
+    logger.info("story_summaries_backfilled", extra={"stories": written})
+    return written
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from firebase_client import init_firebase
+    from observability import configure_logging
+
+    load_dotenv()
+    configure_logging()
+    firestore_db = init_firebase()
+    if firestore_db is None:
+        raise SystemExit("Firebase is not configured")
+    print(f"Backfilled {backfill_summaries(firestore_db)} story summaries")
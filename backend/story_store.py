@@ -0,0 +1,237 @@
+"""
+Write-behind persistence for stories.
+
+complete_story used to block on a Firestore round trip and silently lost
+the story if that write failed. Now a story ID is allocated locally, the
+story goes into a durable SQLite spool, and the client gets the ID right
+away. A background worker flushes the spool to Firestore in batched
+commits, retrying with backoff while Firestore is slow or down. Each commit
+also writes the stories' entries in the gallery summary index (story_index).
+
+A failed commit is split in half and retried until the failing stories are
+isolated, so one document Firestore will never accept (e.g. one over the
+1 MiB limit) doesn't hold back the rest of its batch. A story rejected on
+its own STORY_MAX_ATTEMPTS times, while other commits in the same flush
+succeed, is moved to the `rejected_stories` table instead of being retried.
+"""
+import asyncio
+import json
+import os
+import secrets
+import sqlite3
+import string
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from executors import run_io
+from observability import get_logger, track_upstream
+from story_index import STORY_SUMMARY_COLLECTION, story_summary
+
+STORY_SPOOL_DB = os.getenv("STORY_SPOOL_DB", os.path.join("cache", "story_spool.sqlite3"))
+STORY_FLUSH_BATCH_SIZE = int(os.getenv("STORY_FLUSH_BATCH_SIZE", "50"))
+STORY_FLUSH_INTERVAL = float(os.getenv("STORY_FLUSH_INTERVAL", "0.5"))
+STORY_MAX_BACKOFF = 60.0
+STORY_MAX_ATTEMPTS = int(os.getenv("STORY_MAX_ATTEMPTS", "5"))
+
+ID_ALPHABET = string.ascii_letters + string.digits
+
+logger = get_logger("stories")
+
+
+def new_story_id() -> str:
+    """20-character random ID, the same shape as a Firestore auto-ID"""
+    return "".join(secrets.choice(ID_ALPHABET) for _ in range(20))
+
+
+class StorySpool:
+    """Durable local queue of stories that haven't reached Firestore yet"""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_stories ("
+                "story_id TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, last_error TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rejected_stories ("
+                "story_id TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL, last_error TEXT, rejected_at REAL NOT NULL)"
+            )
+
+    def add(self, story_id: str, story_data: dict):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO pending_stories (story_id, data, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (story_id, json.dumps(story_data), now, now),
+            )
+
+    def get(self, story_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM pending_stories WHERE story_id = ?", (story_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def due(self, limit: int) -> List[Tuple[str, dict, int, float]]:
+        """Stories whose next attempt is due, oldest first, as (id, data, attempts, created_at)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT story_id, data, attempts, created_at FROM pending_stories WHERE next_attempt_at <= ? "
+                "ORDER BY created_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [(story_id, json.loads(data), attempts, created_at) for story_id, data, attempts, created_at in rows]
+
+    def remove(self, story_ids: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pending_stories WHERE story_id = ?", [(i,) for i in story_ids])
+
+    def mark_failed(self, story_ids: List[str], error: str, delay: float):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE pending_stories SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? "
+                "WHERE story_id = ?",
+                [(time.time() + delay, error, i) for i in story_ids],
+            )
+
+    def reject(self, story_id: str, error: str):
+        """Moves a story Firestore keeps refusing out of the queue, keeping it for inspection"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rejected_stories "
+                "SELECT story_id, data, created_at, attempts + 1, ?, ? FROM pending_stories WHERE story_id = ?",
+                (error, time.time(), story_id),
+            )
+            self._conn.execute("DELETE FROM pending_stories WHERE story_id = ?", (story_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_stories").fetchone()[0]
+
+    def count_rejected(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rejected_stories").fetchone()[0]
+
+
+class StoryWriter:
+    """Spools stories locally and flushes them to Firestore in the background"""
+
+    def __init__(self, db, spool: StorySpool, batch_size: int = STORY_FLUSH_BATCH_SIZE,
+                 flush_interval: float = STORY_FLUSH_INTERVAL):
+        self.db = db
+        self.spool = spool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {"submitted": 0, "flushed": 0, "failed_attempts": 0}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    async def submit(self, story_data: dict) -> str:
+        """Spools a story and returns its ID without waiting for Firestore"""
+        story_id = new_story_id()
+        await run_io(self.spool.add, story_id, story_data)
+        self.stats["submitted"] += 1
+        self.start()
+        self._wake.set()
+        return story_id
+
+    async def get_pending(self, story_id: str) -> Optional[dict]:
+        return await run_io(self.spool.get, story_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Makes a last flush attempt, then stops the worker. Unflushed stories stay spooled."""
+        if self._task is None:
+            return
+        # The flag as well as the cancel: asyncio.wait_for can swallow a
+        # cancellation that lands just as the awaited call completes (< 3.12)
+        self._stopping = True
+        self._wake.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while not self._stopping and await self.flush():
+                pass
+
+    async def flush(self) -> int:
+        """Commits one batch of due stories. Returns how many were flushed."""
+        batch = await run_io(self.spool.due, self.batch_size)
+        if not batch:
+            return 0
+
+        failed = []
+        flushed = await self._commit_or_split(batch, failed)
+        self.stats["flushed"] += flushed
+        if failed:
+            logger.warning("story_flush_failed", extra={"stories": len(failed), "flushed": flushed,
+                                                        "error": failed[0][1]})
+        for (story_id, _, attempts, _), error in failed:
+            # Only count it against the story if Firestore accepted other writes meanwhile
+            if flushed and attempts + 1 >= STORY_MAX_ATTEMPTS:
+                logger.error("story_rejected", extra={"story_id": story_id, "attempts": attempts + 1, "error": error})
+                await run_io(self.spool.reject, story_id, error)
+            else:
+                await run_io(self.spool.mark_failed, [story_id], error, min(STORY_MAX_BACKOFF, 2 ** (attempts + 1)))
+        return flushed
+
+    async def _commit_or_split(self, group, failed: list) -> int:
+        """
+        Commits a group of stories, halving it on failure until the failing
+        stories are on their own. Failed (story, error) pairs are appended to
+        `failed`. Returns how many stories were committed.
+        """
+        try:
+            async with track_upstream("firestore", "batch_commit"):
+                await run_io(self._commit, group)
+        except Exception as e:
+            self.stats["failed_attempts"] += 1
+            if len(group) == 1:
+                failed.append((group[0], str(e) or type(e).__name__))
+                return 0
+            middle = len(group) // 2
+            committed = await self._commit_or_split(group[:middle], failed)
+            return committed + await self._commit_or_split(group[middle:], failed)
+
+        await run_io(self.spool.remove, [story_id for story_id, _, _, _ in group])
+        return len(group)
+
+    def _commit(self, batch):
+        # A story and its summary land in the same commit, so the index never lists a missing story
+        write_batch = self.db.batch()
+        for story_id, story_data, _, created_at in batch:
+            write_batch.set(self.db.collection(u'stories').document(story_id), story_data)
+            write_batch.set(self.db.collection(STORY_SUMMARY_COLLECTION).document(story_id),
+                            story_summary(story_id, story_data, created_at))
+        write_batch.commit()
+
+    def status(self) -> dict:
+        return {**self.stats, "pending": self.spool.count(), "rejected": self.spool.count_rejected(),
+                "running": bool(self._task and not self._task.done())}
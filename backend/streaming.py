@@ -0,0 +1,277 @@
+"""
+Helpers for streaming responses: an incremental parser that yields the
+top-level members of a JSON object as soon as each one is complete, a
+decoder that pulls a base64 image out of a chat completion as it arrives,
+and Server-Sent Events formatting and responses.
+"""
+import base64
+import binascii
+import json
+import re
+from typing import Any, Callable, List, Optional, Tuple
+
+from starlette.responses import StreamingResponse
+
+
+class IncrementalJSONObjectParser:
+    """
+    Feed text chunks of a single JSON object (optionally wrapped in ```json
+    fences) and get back each top-level (key, value) pair once its value has
+    been fully received.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._buffer += chunk
+        members = []
+
+        while self._pos < len(self._buffer) and not self.done:
+            char = self._buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = self._pos + 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    members.extend(self._complete_member())
+                    self.done = True
+            elif char == "," and self._depth == 1:
+                members.extend(self._complete_member())
+                self._member_start = self._pos + 1
+
+            self._pos += 1
+
+        # Drop text that has already been consumed so the buffer stays small
+        if self._member_start is not None and self._member_start > 0:
+            self._buffer = self._buffer[self._member_start:]
+            self._pos -= self._member_start
+            self._member_start = 0
+
+        return members
+
+    def _complete_member(self) -> List[Tuple[str, Any]]:
+        text = self._buffer[self._member_start:self._pos].strip()
+        if not text:
+            return []
+        member = json.loads("{" + text + "}")
+        return list(member.items())
+
+
+# The next byte inside a JSON string that needs handling: its closing quote or an escape
+_STRING_SPECIAL = re.compile(rb'["\\]')
+# Longest "data:<mime>;base64," prefix accepted before a string is treated as plain text
+_MAX_DATA_URL_HEADER = 128
+
+_MESSAGE_PATH = ("choices", 0, "message")
+
+
+def is_image_url_path(path: tuple) -> bool:
+    """
+    Where an OpenRouter message can carry a generated image: message.images[i].image_url.url,
+    message.content[i].image_url.url, or message.content itself as a data URL.
+    """
+    if path[:3] != _MESSAGE_PATH:
+        return False
+    rest = path[3:]
+    return rest == ("content",) or (len(rest) == 4 and rest[0] in ("images", "content")
+                                    and rest[2:] == ("image_url", "url"))
+
+
+class DataURLStreamDecoder:
+    """
+    Feed the raw bytes of a chat completion response and get back the
+    decoded bytes of the first image data URL in the message, chunk by
+    chunk, without holding the JSON document or the base64 text in memory.
+
+    The JSON is tokenized just enough to know the path of each string; only
+    strings at an image path are inspected, and the image's base64 text is
+    decoded in bulk slices rather than byte by byte.
+    """
+
+    def __init__(self):
+        self._stack: List[list] = []  # [key or index, expecting_key] per open object/array
+        self._in_string = False
+        self._string_is_key = False
+        self._text: Optional[bytearray] = None  # a key or error message being read
+        self._header: Optional[bytearray] = None
+        self._capturing = False
+        self._escape = False
+        self._pending = b""  # base64 characters short of a full 4-character group
+        self.mime_type: Optional[str] = None
+        self.found = False
+        self.done = False
+        self.bytes_read = 0
+        self.decoded_bytes = 0
+        self.message_keys: List[str] = []
+        self.error_message: Optional[str] = None
+
+    @property
+    def path(self) -> tuple:
+        return tuple(frame[0] for frame in self._stack)
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Consumes the next chunk of the response; returns any image bytes it completed"""
+        self.bytes_read += len(chunk)
+        out: List[bytes] = []
+        pos, end = 0, len(chunk)
+        while pos < end:
+            if self._in_string:
+                pos = self._string(chunk, pos, out)
+                continue
+            char = chunk[pos:pos + 1]
+            pos += 1
+            if char == b'"':
+                self._start_string()
+            elif char == b"{":
+                self._stack.append([None, True])
+            elif char == b"[":
+                self._stack.append([0, False])
+            elif char in (b"}", b"]"):
+                if self._stack:
+                    self._stack.pop()
+            elif char == b":":
+                if self._stack:
+                    self._stack[-1][1] = False
+            elif char == b"," and self._stack:
+                frame = self._stack[-1]
+                if isinstance(frame[0], int):
+                    frame[0] += 1
+                else:
+                    frame[0], frame[1] = None, True
+        return out
+
+    def _start_string(self):
+        self._in_string = True
+        frame = self._stack[-1] if self._stack else None
+        self._string_is_key = bool(frame and frame[1])
+        if self._string_is_key:
+            self._text = bytearray()
+        elif not self.found and is_image_url_path(self.path):
+            self._header = bytearray()
+        elif self.path == ("error", "message"):
+            self._text = bytearray()
+
+    def _string(self, chunk: bytes, pos: int, out: List[bytes]) -> int:
+        """Consumes string content from chunk[pos:]; returns the new position"""
+        if self._escape:
+            self._escape = False
+            char = chunk[pos:pos + 1]
+            if char == b"/":
+                self._consume(b"/", out)  # JSON may escape slashes, which base64 uses
+            elif not self._capturing:
+                self._consume(b"\\" + char, out)
+            # Inside base64, escaped \n and \r are line wrapping and are dropped
+            return pos + 1
+
+        match = _STRING_SPECIAL.search(chunk, pos)
+        stop = match.start() if match else len(chunk)
+        if stop > pos:
+            self._consume(chunk[pos:stop], out)
+        if match is None:
+            return stop
+        if chunk[stop:stop + 1] == b"\\":
+            self._escape = True
+        else:
+            self._end_string()
+        return stop + 1
+
+    def _consume(self, data: bytes, out: List[bytes]):
+        if self._capturing:
+            self._take_base64(data, out)
+        elif self._text is not None:
+            if len(self._text) < 4096:
+                self._text += data
+        elif self._header is not None:
+            self._take_header(data, out)
+
+    def _take_header(self, data: bytes, out: List[bytes]):
+        self._header += data
+        comma = self._header.find(b",")
+        if comma == -1:
+            if len(self._header) > _MAX_DATA_URL_HEADER:
+                self._header = None  # too long for a data URL header; skip the rest of the string
+            return
+        header, rest = bytes(self._header[:comma]), bytes(self._header[comma + 1:])
+        self._header = None
+        if header.startswith(b"data:image/") and header.endswith(b";base64"):
+            self.mime_type = header[len(b"data:"):-len(b";base64")].decode("ascii", "replace")
+            self.found = self._capturing = True
+            self._take_base64(rest, out)
+
+    def _take_base64(self, data: bytes, out: List[bytes]):
+        data = self._pending + data
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            try:
+                decoded = base64.b64decode(data[:usable], validate=True)
+            except binascii.Error as e:
+                raise ValueError(f"Image data URL is not valid base64: {e}") from e
+            self.decoded_bytes += len(decoded)
+            out.append(decoded)
+
+    def _end_string(self):
+        self._in_string = False
+        if self._capturing:
+            self._capturing = False
+            self.done = True
+            if self._pending:
+                raise ValueError("Image data URL ended mid base64 group")
+        elif self._text is not None:
+            try:
+                text = json.loads(b'"' + bytes(self._text) + b'"')  # undo the escapes kept while reading
+            except ValueError:
+                text = self._text.decode("utf-8", "replace")
+            if self._string_is_key:
+                self._stack[-1][0] = text
+                if self.path[:-1] == _MESSAGE_PATH:
+                    self.message_keys.append(text)
+            else:
+                self.error_message = text
+        self._text = None
+        self._header = None
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class SSEResponse(StreamingResponse):
+    """
+    A Server-Sent Events response. `on_close` runs however the response
+    ends: finished, failed, or abandoned before the first event because the
+    client went away. A generator's own `finally` doesn't run if iteration
+    never starts, so resources the stream owns are released here.
+    """
+
+    def __init__(self, content, on_close: Optional[Callable[[], None]] = None):
+        super().__init__(content, media_type="text/event-stream",
+                         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
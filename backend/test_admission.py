@@ -0,0 +1,106 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from admission import AdmissionController, AdmissionMiddleware, RouteLimit, TokenBucket, UpstreamBudget
+from admission import route_env_prefix
+
+
+def test_token_bucket_allows_a_burst_then_reports_the_wait():
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    wait = bucket.take()
+    assert 0.4 < wait <= 0.5
+
+
+def test_budget_queues_within_the_deadline_and_sheds_beyond_it():
+    async def run():
+        budget = UpstreamBudget("gemini", limit=1, max_waiters=1, max_wait=0.2)
+        assert await budget.acquire() is None
+        waiter = asyncio.ensure_future(budget.acquire())
+        await asyncio.sleep(0)
+        assert await budget.acquire() == "queue_full"
+        budget.release()  # hands the slot to the waiter
+        assert await waiter is None
+        assert budget.in_use == 1
+        assert await budget.acquire() == "wait_timeout"
+        budget.release()
+        return budget.in_use, budget.waiting
+
+    assert asyncio.run(run()) == (0, 0)
+
+
+def limited_app(controller, **middleware_options):
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, controller=controller, enabled=True, **middleware_options)
+
+    @app.post("/generate-story")
+    def generate_story():
+        return {"ok": True}
+
+    @app.post("/generate-story-batch/{batch_id}/retry")
+    def retry_batch(batch_id: str):
+        return {"ok": True}
+
+    @app.post("/translate")
+    def translate():
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_middleware_returns_429_with_retry_after_per_client():
+    controller = AdmissionController(
+        {"/generate-story": RouteLimit(client_rate=0.1, client_burst=2, route_rate=100, route_burst=100)},
+        {},
+    )
+    # One trusted proxy: the client is the last hop, whatever the caller put before it
+    client = limited_app(controller, client_header="x-forwarded-for", trusted_proxies=1)
+    alice = [{"X-Forwarded-For": f"{spoofed}, 203.0.113.7"} for spoofed in ("10.0.0.1", "10.0.0.2", "10.0.0.3")]
+    assert [client.post("/generate-story", headers=alice[i]).status_code for i in range(2)] == [200, 200]
+    rejected = client.post("/generate-story", headers=alice[2])
+    assert rejected.status_code == 429
+    assert rejected.json()["reason"] == "rate_limited_client"
+    assert 1 <= int(rejected.headers["Retry-After"]) <= 10
+
+    # Other clients and unlimited routes are unaffected
+    assert client.post("/generate-story", headers={"X-Forwarded-For": "198.51.100.2"}).status_code == 200
+    assert all(client.post("/translate", headers=alice[0]).status_code == 200 for _ in range(5))
+
+
+def test_forwarded_header_is_ignored_unless_configured():
+    controller = AdmissionController(
+        {"/generate-story": RouteLimit(client_rate=0.1, client_burst=1, route_rate=100, route_burst=100)},
+        {},
+    )
+    client = limited_app(controller, client_header="")
+    codes = [client.post("/generate-story", headers={"X-Forwarded-For": f"10.0.0.{i}"}).status_code
+             for i in range(3)]
+    assert codes == [200, 429, 429]
+
+
+def test_route_rejection_does_not_spend_the_clients_token():
+    controller = AdmissionController(
+        {"/generate-story": RouteLimit(client_rate=0.001, client_burst=1, route_rate=0.001, route_burst=1)},
+        {},
+    )
+
+    async def run():
+        assert await controller.admit("/generate-story", "bob") == (None, 0.0)
+        reason, _ = await controller.admit("/generate-story", "alice")
+        assert reason == "rate_limited_route"
+        return controller._client_bucket("/generate-story", "alice").tokens
+
+    assert asyncio.run(run()) == 1
+
+
+def test_parameterized_routes_are_limited():
+    controller = AdmissionController(
+        {"/generate-story-batch/{batch_id}/retry": RouteLimit(0.001, 1, 100, 100)},
+        {},
+    )
+    client = limited_app(controller)
+    codes = [client.post(f"/generate-story-batch/{batch_id}/retry").status_code for batch_id in ("a", "b")]
+    assert codes == [200, 429]
+    assert route_env_prefix("/generate-story-batch/{batch_id}/retry") == "ADMISSION_GENERATE_STORY_BATCH_RETRY"
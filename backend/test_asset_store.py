@@ -0,0 +1,58 @@
+import asyncio
+import io
+
+from PIL import Image
+
+from asset_store import ASSET_NAME_PATTERN, AssetStore, LocalDiskBackend
+
+
+def png_bytes(size=(640, 480)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (120, 60, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = AssetStore(LocalDiskBackend(str(tmp_path)))
+    first = asyncio.run(store.put(b"same bytes", "image/png"))
+    second = asyncio.run(store.put(b"same bytes", "image/png"))
+    assert first.name == second.name
+    assert ASSET_NAME_PATTERN.match(first.name)
+    assert not first.deduplicated and second.deduplicated
+    assert store.stats["writes"] == 1
+
+
+def test_put_image_writes_thumbnail_and_webp_variants(tmp_path):
+    store = AssetStore(LocalDiskBackend(str(tmp_path)))
+    asset = asyncio.run(store.put_image(png_bytes(), "image/png"))
+    assert asset.url == f"/assets/{asset.name}"
+    assert set(asset.variants) == {"thumbnail", "webp"}
+
+    thumb_name = asset.variants["thumbnail"].rsplit("/", 1)[1]
+    with Image.open(tmp_path / thumb_name) as thumb:
+        assert thumb.format == "WEBP"
+        assert max(thumb.size) == 320
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        [asset.name, thumb_name, asset.variants["webp"].rsplit("/", 1)[1]]
+    )
+
+
+def test_spooled_image_matches_put_image(tmp_path):
+    store = AssetStore(LocalDiskBackend(str(tmp_path)))
+    data = png_bytes()
+
+    async def chunks():
+        for i in range(0, len(data), 1000):
+            yield data[i:i + 1000]
+
+    async def run():
+        spooled = await store.spool(chunks())
+        from_file = await store.put_image_file(spooled, "image/png")
+        from_bytes = await store.put_image(data, "image/png")
+        return from_file, from_bytes
+
+    from_file, from_bytes = asyncio.run(run())
+    assert from_file.name == from_bytes.name and from_bytes.deduplicated
+    assert from_file.variants == from_bytes.variants
+    assert (tmp_path / from_file.name).read_bytes() == data
+    assert not any(p.name.startswith(".tmp_") for p in tmp_path.iterdir())
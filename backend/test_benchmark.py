@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import httpx
+
+from benchmark import FakeFirestore, LoopLagProbe, UpstreamProfile, make_images, openrouter_transport, percentile
+from benchmark import seed_stories, unique_image
+from image_pipeline import normalize_image
+from story_index import list_summaries
+from story_store import StorySpool, StoryWriter
+
+
+def test_percentile():
+    values = [i / 100 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.51
+    assert percentile(values, 99) == 0.99
+    assert percentile([], 95) == 0.0
+
+
+def test_loop_lag_probe_catches_blocking_calls():
+    async def run():
+        with LoopLagProbe(interval=0.005) as probe:
+            await asyncio.sleep(0.02)
+            time.sleep(0.1)  # blocks the event loop
+            await asyncio.sleep(0.02)
+        return max(probe.lags)
+
+    assert asyncio.run(run()) >= 0.08
+
+
+def test_fake_firestore_round_trips_through_the_story_writer(tmp_path):
+    db = FakeFirestore(UpstreamProfile())
+    writer = StoryWriter(db, StorySpool(str(tmp_path / "spool.sqlite3")))
+
+    async def run():
+        story_id = await writer.submit({"title": "Madhubani"})
+        await writer.stop()
+        return story_id
+
+    story_id = asyncio.run(run())
+    assert db.collection("stories").document(story_id).get().to_dict() == {"title": "Madhubani"}
+
+
+def test_fake_firestore_pages_the_story_summaries():
+    db = FakeFirestore(UpstreamProfile())
+    seed_stories(db, 10)
+    page, cursor = list_summaries(db, 4, art_form="madhubani")
+    assert [s["story_id"][-1] for s in page] == ["8", "4", "0"] and cursor is None
+    page, cursor = list_summaries(db, 4)
+    assert list_summaries(db, 4, cursor)[0][0]["story_id"].endswith("5")
+
+
+def test_uncached_images_differ_only_in_hash():
+    [image] = make_images(1, size=64)
+    first, second = unique_image(image, 1), unique_image(image, 2)
+    assert first != second
+    assert normalize_image(first, 32).data == normalize_image(image, 32).data
+
+
+def test_openrouter_stand_in_follows_its_error_profile():
+    async def run(profile):
+        async with httpx.AsyncClient(transport=openrouter_transport(profile, b"png")) as client:
+            return await client.post("https://openrouter.ai/api/v1/chat/completions", json={})
+
+    ok = asyncio.run(run(UpstreamProfile()))
+    assert ok.json()["choices"][0]["message"]["images"][0]["image_url"]["url"] == "data:image/png;base64,cG5n"
+    assert asyncio.run(run(UpstreamProfile(error_rate=1.0))).status_code == 503
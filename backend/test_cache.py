@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from cache import SQLiteCache, TTLCache, create_tiered_cache, make_key
+
+
+def test_make_key_is_stable_and_unambiguous():
+    assert make_key(b"img", "Pottery", "1") == make_key(b"img", "Pottery", "1")
+    assert make_key("ab", "c") != make_key("a", "bc")
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_sqlite_tier_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SQLiteCache(path, table="analysis").set("k", {"ai_analysis": "text"})
+    assert SQLiteCache(path, table="analysis").get("k") == {"ai_analysis": "text"}
+
+
+def test_tiered_cache_counts_hits_and_misses(tmp_path):
+    cache = create_tiered_cache("analysis", maxsize=4, ttl=60, disk_path=str(tmp_path / "c.sqlite3"))
+
+    async def run():
+        assert await cache.get("k") is None
+        await cache.set("k", "value")
+        assert await cache.get("k") == "value"
+        cache.memory.clear()
+        assert await cache.get("k") == "value"
+
+    asyncio.run(run())
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
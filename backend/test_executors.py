@@ -0,0 +1,65 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from executors import EXECUTOR_TASK_TIME, ManagedExecutor
+
+
+def square(x):
+    return x * x
+
+
+def crash():
+    os._exit(1)
+
+
+def test_process_pool_runs_work_in_other_processes():
+    pool = ManagedExecutor("test_cpu", "process", workers=2)
+
+    async def run():
+        pids = await asyncio.gather(*(pool.run(os.getpid) for _ in range(4)))
+        results = await asyncio.gather(*(pool.run(square, n) for n in range(5)))
+        return pids, results
+
+    try:
+        pids, results = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert os.getpid() not in pids
+    assert results == [0, 1, 4, 9, 16]
+    assert pool.status()["completed"] == 9 and pool.status()["in_flight"] == 0
+    assert EXECUTOR_TASK_TIME.series[("test_cpu", "square")]["count"] == 5
+
+
+def test_broken_process_pool_is_replaced():
+    pool = ManagedExecutor("test_crash", "process", workers=1)
+
+    async def run():
+        try:
+            await pool.run(crash)
+        except BrokenProcessPool:
+            pass
+        return await pool.run(square, 3)
+
+    try:
+        assert asyncio.run(run()) == 9
+    finally:
+        pool.shutdown()
+    assert pool.stats["pool_restarts"] == 1
+    assert pool.stats["failed"] == 1
+
+
+def test_thread_pool_reports_queue_depth():
+    pool = ManagedExecutor("test_io", "thread", workers=1)
+    observed = []
+
+    async def run():
+        tasks = [asyncio.create_task(pool.run(square, n)) for n in range(3)]
+        await asyncio.sleep(0)
+        observed.append(pool.queued)
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [0, 1, 4]
+    pool.shutdown()
+    assert observed == [2]
+    assert pool.queued == 0
@@ -0,0 +1,73 @@
+import asyncio
+
+import httpx
+
+from http_client import backoff_delay, post_with_retry
+
+
+def make_client(statuses, calls):
+    def handler(request):
+        calls.append(request)
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status, json={"attempt": len(calls)})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_retries_server_errors_until_success():
+    calls = []
+    client = make_client([503, 429, 200], calls)
+    response = asyncio.run(post_with_retry("https://example.test", client=client, json={}, backoff_base=0.001))
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+    client = make_client([400, 200], calls)
+    response = asyncio.run(post_with_retry("https://example.test", client=client, backoff_base=0.001))
+    assert response.status_code == 400
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_attempts_with_last_response():
+    calls = []
+    client = make_client([502], calls)
+    response = asyncio.run(post_with_retry("https://example.test", client=client, max_attempts=2, backoff_base=0.001))
+    assert response.status_code == 502
+    assert len(calls) == 2
+
+
+def test_connection_errors_raise_when_budget_is_spent():
+    calls = []
+    client = make_client([httpx.ConnectError("refused")], calls)
+    try:
+        asyncio.run(post_with_retry("https://example.test", client=client, max_attempts=5, budget=0.0))
+    except httpx.ConnectError:
+        pass
+    else:
+        raise AssertionError("expected the connection error to surface")
+    assert len(calls) == 1
+
+
+def test_backoff_honours_retry_after():
+    response = httpx.Response(429, headers={"Retry-After": "3"})
+    assert backoff_delay(1, response) == 3.0
+    assert 0 <= backoff_delay(4, base=0.5, cap=2.0) <= 2.0
+
+
+def test_streamed_responses_are_closed_before_retrying():
+    calls = []
+    client = make_client([503, 200], calls)
+
+    async def run():
+        response = await post_with_retry("https://example.test", client=client, stream=True, backoff_base=0.001)
+        body = b"".join([chunk async for chunk in response.aiter_bytes()])
+        await response.aclose()
+        return response, body
+
+    response, body = asyncio.run(run())
+    assert response.status_code == 200 and body == b'{"attempt":2}'
+    assert len(calls) == 2
@@ -0,0 +1,45 @@
+import io
+
+from PIL import Image
+
+from image_pipeline import normalize_image
+
+
+def encode(image, fmt, **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def test_large_photo_is_downsampled_and_reencoded():
+    content = encode(Image.new("RGB", (4000, 3000), (180, 90, 40)), "JPEG", quality=95)
+    normalized = normalize_image(content, max_edge=1024, image_format="WEBP")
+    assert (normalized.width, normalized.height) == (1024, 768)
+    assert normalized.mime_type == "image/webp"
+    assert normalized.bytes_saved > 0
+
+
+def test_exif_orientation_is_applied():
+    image = Image.new("RGB", (300, 100))
+    exif = image.getexif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    normalized = normalize_image(encode(image, "JPEG", exif=exif), max_edge=1024)
+    assert (normalized.width, normalized.height) == (100, 300)
+
+
+def test_small_image_keeps_original_bytes_when_reencoding_does_not_help():
+    # A tiny flat PNG is a few dozen bytes; a JPEG's headers and tables alone are hundreds
+    image = Image.new("RGB", (8, 8))
+    content = encode(image, "PNG")
+    assert len(encode(image, "JPEG", quality=100)) > len(content)
+    normalized = normalize_image(content, max_edge=1024, image_format="JPEG", quality=100)
+    assert normalized.data == content
+    assert normalized.mime_type == "image/png"
+    assert normalized.bytes_saved == 0
+
+
+def test_transparent_png_to_jpeg_gets_a_white_background():
+    content = encode(Image.new("RGBA", (2048, 64), (0, 0, 0, 0)), "PNG")
+    normalized = normalize_image(content, max_edge=1024, image_format="JPEG")
+    assert normalized.mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(normalized.data)).getpixel((10, 10))[0] > 240
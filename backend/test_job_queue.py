@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from job_queue import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobStore, QueueFull
+
+
+def test_identical_submissions_share_one_job(tmp_path):
+    calls = []
+
+    async def handler(payload, data):
+        calls.append(data)
+        await asyncio.sleep(0.01)
+        return {"url": "/assets/mockup.png", "context": payload["context"]}
+
+    async def run():
+        queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), handler, workers=2)
+        first, first_dedup = await queue.submit("key-1", {"context": "marble"}, b"image")
+        second, second_dedup = await queue.submit("key-1", {"context": "marble"}, b"image")
+        statuses = [job["status"] async for job in queue.watch(first["job_id"]) if job]
+        await queue.stop()
+        return first, first_dedup, second, second_dedup, statuses, await queue.get(first["job_id"])
+
+    first, first_dedup, second, second_dedup, statuses, done = asyncio.run(run())
+    assert (first_dedup, second_dedup) == (False, True)
+    assert second["job_id"] == first["job_id"]
+    assert statuses[-1] == SUCCEEDED
+    assert done["result"] == {"url": "/assets/mockup.png", "context": "marble"}
+    assert calls == [b"image"]
+
+
+def test_failed_jobs_are_not_reused(tmp_path):
+    async def handler(payload, data):
+        raise RuntimeError("OpenRouter API error: 503")
+
+    async def run():
+        queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), handler, workers=1)
+        job, _ = await queue.submit("key-1", {}, b"image")
+        [_ async for _ in queue.watch(job["job_id"])]
+        retry, deduplicated = await queue.submit("key-1", {}, b"image")
+        await queue.stop()
+        return await queue.get(job["job_id"]), retry, deduplicated
+
+    failed, retry, deduplicated = asyncio.run(run())
+    assert failed["status"] == FAILED and "503" in failed["error"]
+    assert retry["job_id"] != failed["job_id"] and not deduplicated
+
+
+def test_unfinished_jobs_resume_after_restart(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.add("interrupted", "key-1", {}, b"one")
+    store.start("interrupted")  # was running when the process died
+    store.add("waiting", "key-2", {}, b"two")
+    assert store.get("interrupted")["status"] == RUNNING
+    assert store.get("waiting")["status"] == QUEUED
+
+    async def handler(payload, data):
+        return {"size": len(data)}
+
+    async def run():
+        queue = JobQueue(store, handler, workers=1)
+        await queue.start()
+        for job_id in ("interrupted", "waiting"):
+            [_ async for _ in queue.watch(job_id)]
+        await queue.stop()
+
+    asyncio.run(run())
+    assert store.get("interrupted")["status"] == SUCCEEDED
+    assert store.get("interrupted")["attempts"] == 2
+    assert store.get("waiting")["result"] == {"size": 3}
+
+
+def test_backlog_limit(tmp_path):
+    release = None
+
+    async def handler(payload, data):
+        await release.wait()
+        return {}
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), handler, workers=1, max_queued=1)
+        await queue.submit("running", {}, b"")
+        await asyncio.sleep(0.01)  # the only worker picks it up
+        await queue.submit("waiting", {}, b"")
+        with pytest.raises(QueueFull):
+            await queue.submit("rejected", {}, b"")
+        release.set()
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_queue_restarts_on_a_new_event_loop(tmp_path):
+    async def handler(payload, data):
+        return {"size": len(data)}
+
+    queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), handler, workers=1)
+
+    async def run(key, data):
+        job, _ = await queue.submit(key, {}, data)
+        [_ async for _ in queue.watch(job["job_id"])]
+        await queue.stop()
+        return await queue.get(job["job_id"])
+
+    assert asyncio.run(run("key-1", b"one"))["result"] == {"size": 3}
+    assert asyncio.run(run("key-2", b"second"))["result"] == {"size": 6}
+
+
+def test_only_finished_jobs_are_purged(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), retention=0)
+    store.add("done", "key-1", {}, b"")
+    store.finish("done", SUCCEEDED, {})
+    store.add("failed", "key-2", {}, b"")
+    store.finish("failed", FAILED, error="503")
+    store.add("waiting", "key-3", {}, b"")
+    assert store.purge_expired() == 2
+    assert store.get("done") is None and store.get("failed") is None
+    assert store.get("waiting")["status"] == QUEUED
@@ -0,0 +1,123 @@
+import asyncio
+
+from llm_client import FakeProvider, LLMClient, parse_model_limits
+from model_registry import ModelRegistry, ModelRoute
+
+
+def test_parse_model_limits():
+    limits = parse_model_limits("gemini-pro=2, gemini-2.5-flash-lite=6,broken,bad=x")
+    assert limits == {"gemini-pro": 2, "gemini-2.5-flash-lite": 6}
+
+
+def test_concurrency_is_capped_per_model():
+    provider = FakeProvider(latency=0.05)
+    client = LLMClient(provider, default_concurrency=8, model_concurrency={"gemini-pro": 2})
+
+    async def run():
+        await asyncio.gather(*(client.generate("gemini-pro", f"prompt {i}") for i in range(6)))
+
+    asyncio.run(run())
+    assert len(provider.calls) == 6
+    assert provider.peak_in_flight == 2
+
+
+def test_models_do_not_share_a_limit():
+    provider = FakeProvider(latency=0.05)
+    client = LLMClient(provider, default_concurrency=1)
+
+    async def run():
+        await asyncio.gather(
+            client.generate("gemini-pro", "a"),
+            client.generate("gemini-2.5-flash-lite", "b"),
+        )
+
+    asyncio.run(run())
+    assert provider.peak_in_flight == 2
+
+
+def test_fake_provider_responses_and_errors():
+    provider = FakeProvider(responses={
+        "echo": lambda model_name, contents: contents.upper(),
+        "broken": RuntimeError("quota exceeded"),
+    })
+    client = LLMClient(provider)
+
+    assert asyncio.run(client.generate("echo", "hello")) == "HELLO"
+    assert asyncio.run(client.generate("other", "hello")) == "{}"
+    try:
+        asyncio.run(client.generate("broken", "hello"))
+    except RuntimeError as e:
+        assert "quota" in str(e)
+    else:
+        raise AssertionError("expected the fake error to propagate")
+
+
+def make_routed_client(provider, **route_kwargs):
+    route = ModelRoute("pricing", "gemini-pro", fallbacks=["gemini-2.5-flash-lite"], **route_kwargs)
+    registry = ModelRegistry({"pricing": route})
+    return LLMClient(provider, registry=registry)
+
+
+def test_task_falls_back_when_the_primary_model_fails():
+    provider = FakeProvider(responses={"gemini-pro": RuntimeError("404 model retired"), "gemini-2.5-flash-lite": "ok"})
+    client = make_routed_client(provider, timeout=1, concurrency=2)
+    assert asyncio.run(client.generate_for("pricing", "price this")) == "ok"
+    assert client.fallbacks == {"pricing": 1}
+
+
+def test_task_falls_back_when_the_primary_model_is_slow():
+    class SlowPrimary(FakeProvider):
+        async def generate(self, model_name, contents, **kwargs):
+            if model_name == "gemini-pro":
+                await asyncio.sleep(1)
+            return await super().generate(model_name, contents, **kwargs)
+
+    client = make_routed_client(SlowPrimary(default_response="fast"), timeout=0.05, concurrency=2)
+    assert asyncio.run(client.generate_for("pricing", "price this")) == "fast"
+
+
+def test_stream_falls_back_before_the_first_chunk():
+    provider = FakeProvider(responses={"gemini-pro": RuntimeError("quota"), "gemini-2.5-flash-lite": "abcdef"}, chunk_size=2)
+    client = make_routed_client(provider, timeout=1, concurrency=2)
+
+    async def run():
+        return [chunk async for chunk in client.stream_for("pricing", "price this")]
+
+    assert asyncio.run(run()) == ["ab", "cd", "ef"]
+
+
+def test_registry_reads_overrides_from_env(monkeypatch):
+    monkeypatch.setenv("MODEL_PRICING", "gemini-2.5-pro")
+    monkeypatch.setenv("MODEL_PRICING_CONCURRENCY", "2")
+    monkeypatch.setenv("MODEL_PRICING_FALLBACKS", "gemini-2.5-flash, gemini-2.5-flash-lite")
+    registry = ModelRegistry.from_env()
+    route = registry.route("pricing")
+    assert route.models == ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite"]
+    limits = registry.model_concurrency()
+    assert limits["gemini-2.5-pro"] == 2
+    assert limits["gemini-2.5-flash"] == 2  # only ever a fallback
+
+
+def test_fallback_entries_do_not_lower_a_primary_models_cap():
+    registry = ModelRegistry({
+        "vision": ModelRoute("vision", "gemini-2.5-flash-lite", 60, 8),
+        "pricing": ModelRoute("pricing", "gemini-2.5-flash", 30, 4, ["gemini-2.5-flash-lite"]),
+        "slow": ModelRoute("slow", "gemini-2.5-pro", 30, 2, ["gemini-2.5-flash"]),
+    })
+    assert registry.model_concurrency() == {"gemini-2.5-flash-lite": 8, "gemini-2.5-flash": 4, "gemini-2.5-pro": 2}
+
+
+def test_warmup_skips_models_other_providers_serve():
+    warmed = []
+
+    class WarmableProvider(FakeProvider):
+        def warm(self, model_names, connect=False):
+            warmed.extend(model_names)
+
+    registry = ModelRegistry({
+        "vision": ModelRoute("vision", "gemini-2.5-flash-lite", 60, 8),
+        "pricing": ModelRoute("pricing", "gemini-2.5-flash", 30, 4, ["gemini-2.5-flash-lite"]),
+        "mockup": ModelRoute("mockup", "gemini-2.5-flash-image-preview", 150, 4, provider="openrouter"),
+    })
+    LLMClient(WarmableProvider(), registry=registry).warm()
+    assert warmed == ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+from benchmark import STORY_RESPONSE, FakeFirestore, UpstreamProfile, load_app, make_images
+from llm_client import FakeProvider
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    return load_app(str(tmp_path_factory.mktemp("app")))
+
+
+@pytest.fixture(scope="module")
+def client(main):
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def provider(main, monkeypatch):
+    provider = FakeProvider(default_response="अनुवाद")
+    monkeypatch.setattr(main.llm, "provider", provider)
+    return provider
+
+
+@pytest.fixture
+def firestore(main, monkeypatch):
+    db = FakeFirestore(UpstreamProfile())
+    db.reads = 0
+
+    def count_read():
+        db.reads += 1
+
+    monkeypatch.setattr(db, "_call", count_read)
+    monkeypatch.setattr(main, "db", db)
+    monkeypatch.setattr(main, "firebase_enabled", True)
+    return db
+
+
+def translation_request(text, **fields):
+    return {"text_to_translate": text, "context": "Instagram post", **fields}
+
+
+def test_repeat_translations_come_from_the_translation_memory(client, main, provider):
+    hits = main.translation_memory.hits
+    for language in ("Hindi", " hindi"):
+        response = client.post("/translate", json=translation_request("Hand-woven silk", target_language=language))
+        assert response.json() == {"translated_text": "अनुवाद"}
+    assert len(provider.calls) == 1
+    assert main.translation_memory.hits == hits + 1
+
+
+def test_batch_reports_failed_languages_without_failing_the_rest(client, provider):
+    def respond(model_name, prompt):
+        if "Tamil" in prompt:
+            raise RuntimeError("quota exceeded")
+        return "translated"
+
+    provider.default_response = respond
+    response = client.post("/translate-batch", json=translation_request(
+        "Natural indigo dye", target_languages=["Hindi", "Tamil", "hindi", " ", "Bengali"]))
+    assert response.json() == {
+        "translations": {"Hindi": "translated", "Bengali": "translated"},
+        "errors": {"Tamil": "quota exceeded"},
+    }
+    assert len(provider.calls) == 3
+
+
+def test_batch_without_languages_is_an_error(client, provider):
+    response = client.post("/translate-batch", json=translation_request("Brass lamp", target_languages=[" "]))
+    assert response.json() == {"error": "No target languages given"}
+    assert provider.calls == []
+
+
+def test_story_reads_are_cached_and_revalidated(client, firestore):
+    firestore.docs["story-cached"] = json.loads(STORY_RESPONSE)
+    plain = {"Accept-Encoding": "identity"}
+
+    first = client.get("/story/story-cached", headers=plain)
+    second = client.get("/story/story-cached", headers=plain)
+    assert first.json() == second.json() == json.loads(STORY_RESPONSE)
+    assert firestore.reads == 1
+    assert first.headers["cache-control"].startswith("public, max-age=")
+
+    etag = first.headers["etag"]
+    assert not etag.startswith("W/")
+    revalidated = client.get("/story/story-cached", headers={**plain, "If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+
+
+def test_compressed_story_has_a_weak_etag_that_still_revalidates(client, firestore):
+    firestore.docs["story-gzip"] = json.loads(STORY_RESPONSE)
+    response = client.get("/story/story-gzip", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].startswith('W/"')
+    assert response.json() == json.loads(STORY_RESPONSE)
+
+    revalidated = client.get("/story/story-gzip", headers={"Accept-Encoding": "gzip",
+                                                           "If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+
+
+def test_missing_story_is_a_404(client, firestore):
+    response = client.get("/story/no-such-story")
+    assert response.status_code == 404
+    assert response.json() == {"error": "Story not found"}
+    assert "etag" not in response.headers
+
+
+def concurrently(n, request):
+    with ThreadPoolExecutor(n) as pool:
+        return list(pool.map(lambda _: request(), range(n)))
+
+
+def test_identical_concurrent_translations_share_one_call(client, main, provider):
+    provider.latency = 0.3
+    coalesced = main.translation_flights.stats["coalesced"]
+    responses = concurrently(5, lambda: client.post(
+        "/translate", json=translation_request("Terracotta horse", target_language="Marathi")))
+    assert {r.json()["translated_text"] for r in responses} == {"अनुवाद"}
+    assert len(provider.calls) == 1
+    assert main.translation_flights.stats["coalesced"] == coalesced + 4
+
+
+def test_identical_concurrent_uploads_share_one_analysis(client, main, provider):
+    provider.latency = 0.5
+    provider.default_response = "A Warli painting. What inspired it?"
+    [image] = make_images(1, size=64)
+    coalesced = main.analysis_flights.stats["coalesced"]
+    responses = concurrently(4, lambda: client.post(
+        "/generate-story", data={"category": "Painting"}, files={"image": ("warli.jpg", image, "image/jpeg")}))
+    assert {r.json()["ai_analysis"] for r in responses} == {"A Warli painting. What inspired it?"}
+    assert len(provider.calls) == 1
+    assert main.analysis_flights.stats["coalesced"] == coalesced + 3
+
+
+@pytest.mark.parametrize("fields", [{"size": 0}, {"size": 41}, {"border": -1}, {"border": 21}])
+def test_qr_dimensions_are_bounded(client, fields):
+    response = client.post("/generate-qr", json={"url": "https://kala.test/story/1", **fields})
+    assert response.status_code == 422
+
+
+def test_qr_batch_size_is_limited(client, main):
+    items = [{"url": f"https://kala.test/story/{i}"} for i in range(main.QR_BATCH_MAX_ITEMS + 1)]
+    response = client.post("/generate-qr-batch", json={"items": items})
+    assert response.status_code == 400
+    assert response.json() == {"error": f"Too many items. Maximum batch size: {main.QR_BATCH_MAX_ITEMS}"}
+
+
+def test_batch_cleanup_runs_when_the_client_leaves_before_the_first_event(main):
+    cleaned = []
+
+    async def never_called(item):
+        raise AssertionError("the batch should not start")
+
+    async def broken_send(message):
+        raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    response = main.batch_response("batch-1", [object()], never_called, lambda: cleaned.append(True))
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, broken_send))
+    assert cleaned == [True]
+
+
+def test_translation_memory_is_per_model(client, main, provider, monkeypatch):
+    request = translation_request("Blue pottery vase", target_language="Kannada")
+    client.post("/translate", json=request)
+    monkeypatch.setattr(main.llm.registry.route("translation"), "model", "gemini-2.5-flash")
+    client.post("/translate", json=request)
+    assert [model for model, _ in provider.calls] == ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from observability import (
+    REQUEST_LATENCY, UPSTREAM_IN_FLIGHT, UPSTREAM_LATENCY, JSONFormatter, MetricsMiddleware, MetricsRegistry,
+    StartupTimer, track_upstream,
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram("upstream_seconds", "Upstream latency", ("upstream",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        latency.observe(value, upstream="gemini")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE upstream_seconds histogram" in lines
+    assert 'upstream_seconds_bucket{upstream="gemini",le="0.1"} 1' in lines
+    assert 'upstream_seconds_bucket{upstream="gemini",le="1"} 3' in lines
+    assert 'upstream_seconds_bucket{upstream="gemini",le="+Inf"} 4' in lines
+    assert 'upstream_seconds_count{upstream="gemini"} 4' in lines
+
+
+def test_collectors_and_label_escaping():
+    registry = MetricsRegistry()
+    registry.add_collector(lambda: [("cache_hit_ratio", "gauge", "Hit ratio", {(("cache", 'say "hi"'),): 0.5})])
+    assert 'cache_hit_ratio{cache="say \\"hi\\""} 0.5' in registry.render()
+
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/story/{story_id}")
+    def story(story_id: str):
+        return {"id": story_id}
+
+    client = TestClient(app)
+    for story_id in ("a", "b", "c"):
+        client.get(f"/story/{story_id}")
+
+    series = REQUEST_LATENCY.series[("GET", "/story/{story_id}", "200")]
+    assert series["count"] >= 3
+    assert not any(key[1] == "/story/a" for key in REQUEST_LATENCY.series)
+
+
+def test_track_upstream_records_errors():
+    async def failing_call():
+        async with track_upstream("firestore", "get_story"):
+            raise RuntimeError("unavailable")
+
+    try:
+        asyncio.run(failing_call())
+    except RuntimeError:
+        pass
+    assert UPSTREAM_LATENCY.series[("firestore", "get_story", "error")]["count"] >= 1
+    assert UPSTREAM_IN_FLIGHT.values[("firestore",)] == 0
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("kala.api", logging.INFO, __file__, 1, "translation_ready", (), None)
+    record.target_language = "Hindi"
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["event"] == "translation_ready"
+    assert entry["level"] == "info"
+    assert entry["target_language"] == "Hindi"
+
+
+def test_startup_timer_reports_phases():
+    timer = StartupTimer()
+    with timer.phase("firebase"):
+        pass
+    assert timer.report()["ready_after_ms"] is None
+    timer.mark_ready()
+    report = timer.report()
+    assert set(report["phases_ms"]) == {"firebase"}
+    assert report["ready_after_ms"] >= report["phases_ms"]["firebase"]
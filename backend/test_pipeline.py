@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from pipeline import Stage, run_pipeline
+
+
+def collect(stages):
+    async def run():
+        return [event async for event in run_pipeline(stages)]
+    return asyncio.run(run())
+
+
+def sleeper(seconds, value=None, fail=False):
+    async def run(inputs):
+        await asyncio.sleep(seconds)
+        if fail:
+            raise RuntimeError("upstream failed")
+        return value if value is not None else sorted(inputs)
+    return run
+
+
+def test_independent_stages_run_concurrently():
+    started = time.perf_counter()
+    events = collect([
+        Stage("analysis", sleeper(0.05, "desc")),
+        Stage("mockup", sleeper(0.1, "url")),
+        Stage("pricing", sleeper(0.05), ("analysis",)),
+        Stage("story", sleeper(0.05), ("analysis",)),
+    ])
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.2  # the sum of all stages would be 0.25s
+    assert [e["stage"] for e in events][-1] == "pipeline"
+    by_stage = {e["stage"]: e for e in events}
+    assert by_stage["pricing"]["result"] == ["analysis"]
+    assert by_stage["mockup"]["status"] == "ok"
+    assert set(by_stage["pipeline"]["stage_timings_ms"]) == {"analysis", "mockup", "pricing", "story"}
+
+
+def test_failed_stage_skips_its_dependents_only():
+    events = collect([
+        Stage("analysis", sleeper(0.01, fail=True)),
+        Stage("story", sleeper(0.01), ("analysis",)),
+        Stage("translations", sleeper(0.01), ("story",)),
+        Stage("mockup", sleeper(0.01, "url")),
+    ])
+    statuses = {e["stage"]: e["status"] for e in events}
+    assert statuses == {
+        "analysis": "error",
+        "story": "skipped",
+        "translations": "skipped",
+        "mockup": "ok",
+        "pipeline": "done",
+    }
+
+
+def test_unknown_dependency_is_rejected():
+    try:
+        collect([Stage("story", sleeper(0), ("analysis",))])
+    except ValueError as e:
+        assert "analysis" in str(e)
+    else:
+        raise AssertionError("expected a ValueError")
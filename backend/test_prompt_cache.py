@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from prompt_cache import PromptCache
+
+
+class FakeCachedContent:
+    created = []
+
+    def __init__(self, name):
+        self.name = name
+
+    @classmethod
+    def create(cls, model, display_name=None, system_instruction=None, ttl=None):
+        cls.created.append((model, system_instruction, ttl.total_seconds()))
+        return cls(f"cachedContents/{len(cls.created)}")
+
+
+def patch_caching(monkeypatch):
+    FakeCachedContent.created = []
+    monkeypatch.setattr(caching, "CachedContent", FakeCachedContent)
+    monkeypatch.setattr(genai.GenerativeModel, "from_cached_content",
+                        classmethod(lambda cls, cached: SimpleNamespace(cached=cached.name)))
+
+
+def test_instructions_are_cached_once_per_text_and_ttl(monkeypatch):
+    patch_caching(monkeypatch)
+    cache = PromptCache(ttl=3600)
+
+    async def run():
+        first = await asyncio.gather(*(cache.model("gemini-2.5-flash-lite", "story rules") for _ in range(5)))
+        changed = await cache.model("gemini-2.5-flash-lite", "new story rules")
+        cache.ttl = 7200
+        longer = await cache.model("gemini-2.5-flash-lite", "new story rules")
+        return first, changed, longer
+
+    first, changed, longer = asyncio.run(run())
+    assert {m.cached for m in first} == {"cachedContents/1"}
+    assert changed.cached == "cachedContents/2"
+    assert longer.cached == "cachedContents/3"
+    assert FakeCachedContent.created[0] == ("models/gemini-2.5-flash-lite", "story rules", 3600)
+    assert cache.status()["active_caches"] == 3
+
+
+def test_expiring_cache_is_recreated(monkeypatch):
+    patch_caching(monkeypatch)
+    cache = PromptCache(ttl=100)
+
+    async def run():
+        await cache.model("m", "rules")
+        for entry in cache._entries.values():
+            entry.expires_at -= 95  # inside the refresh margin
+        return await cache.model("m", "rules")
+
+    assert asyncio.run(run()).cached == "cachedContents/2"
+
+
+def test_failed_creation_falls_back_to_system_instruction(monkeypatch):
+    def refuse(**kwargs):
+        raise RuntimeError("content is below the minimum token count")
+
+    monkeypatch.setattr(caching.CachedContent, "create", staticmethod(refuse))
+    cache = PromptCache(ttl=3600)
+
+    model = asyncio.run(cache.model("gemini-2.5-flash-lite", "vision rules"))
+    assert model._system_instruction is not None
+    assert cache.stats["create_failures"] == 1
+    assert cache.status()["active_caches"] == 0
+
+
+def test_usage_counters():
+    cache = PromptCache(enabled=False)
+    cache.record_usage(SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=1200,
+                                                                      cached_content_token_count=1000)))
+    cache.record_usage(SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=300,
+                                                                      cached_content_token_count=0)))
+    status = cache.status()
+    assert status["cached_calls"] == 1 and status["uncached_calls"] == 1
+    assert status["cached_input_tokens"] == 1000
+    assert status["uncached_input_tokens"] == 500
+    assert status["cached_token_ratio"] == 0.667
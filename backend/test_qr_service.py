@@ -0,0 +1,40 @@
+import asyncio
+
+from asset_store import AssetStore, LocalDiskBackend
+from qr_service import QRService, qr_digest
+
+
+def test_digest_is_stable_and_covers_every_parameter():
+    base = qr_digest("https://kala.test/story/1", 10, 4, "png")
+    assert base == qr_digest("https://kala.test/story/1", 10, 4, "png")
+    assert len({
+        base,
+        qr_digest("https://kala.test/story/2", 10, 4, "png"),
+        qr_digest("https://kala.test/story/1", 8, 4, "png"),
+        qr_digest("https://kala.test/story/1", 10, 2, "png"),
+        qr_digest("https://kala.test/story/1", 10, 4, "svg"),
+    }) == 5
+
+
+def test_render_is_cached_in_memory(tmp_path):
+    service = QRService(AssetStore(LocalDiskBackend(str(tmp_path))))
+    png = asyncio.run(service.render("https://kala.test/story/1"))
+    assert png.startswith(b"\x89PNG")
+    assert asyncio.run(service.render("https://kala.test/story/1")) == png
+    assert service.stats == {"rendered": 1, "memory_hits": 1, "disk_hits": 0}
+
+    svg = asyncio.run(service.render("https://kala.test/story/1", image_format="svg"))
+    assert b"<svg" in svg
+
+
+def test_store_many_renders_each_distinct_code_once(tmp_path):
+    service = QRService(AssetStore(LocalDiskBackend(str(tmp_path))))
+    items = [(f"https://kala.test/story/{i % 3}", 10, 4, "png") for i in range(9)]
+    results = asyncio.run(service.store_many(items))
+    assert len(results) == 9
+    assert results[0].name == results[3].name == f"{qr_digest(*items[0])}.png"
+    assert service.stats["rendered"] == 3
+    assert len(list(tmp_path.iterdir())) == 3
+
+    asyncio.run(service.store_many(items[:3]))
+    assert service.stats["disk_hits"] == 3
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from serialization import CompressionMiddleware, FastJSONResponse, negotiate_encoding, parse_fields, project
+
+STORY = {
+    "instagram_post": "Hand-painted Madhubani peacocks. " * 60,
+    "art_classification": {"art_form_name": "Madhubani", "region_of_origin": "Bihar, India"},
+    "video_script": {"title": "The Peacock", "timeline": [{"time": "0-5s"}]},
+}
+
+
+def build_app():
+    async def story(request):
+        return FastJSONResponse(STORY, headers={"ETag": '"abc"'})
+
+    async def small(request):
+        return FastJSONResponse({"ok": True})
+
+    async def image(request):
+        return Response(b"\x89PNG" * 1000, media_type="image/png")
+
+    async def stream(request):
+        async def chunks():
+            for i in range(3):
+                yield json.dumps({"chunk": i, "text": "x" * 500}).encode() + b"\n"
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    async def events(request):
+        async def chunks():
+            yield b"event: section\ndata: {}\n\n" * 200
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    routes = [Route(path, fn) for path, fn in
+              (("/story", story), ("/small", small), ("/image", image), ("/stream", stream), ("/events", events))]
+    return CompressionMiddleware(Starlette(routes=routes), minimum_size=1024)
+
+
+def fetch(path, accept_encoding="gzip"):
+    async def run():
+        transport = httpx.ASGITransport(app=build_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+    return asyncio.run(run())
+
+
+def test_large_json_is_gzipped_with_a_weak_etag():
+    response = fetch("/story")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"abc"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content) / 5
+    assert response.json() == STORY  # httpx decodes the body
+
+    plain = fetch("/story", accept_encoding="identity")
+    assert "content-encoding" not in plain.headers and plain.json() == STORY
+
+
+def test_small_binary_and_event_stream_responses_are_untouched():
+    for path in ("/small", "/image", "/events"):
+        assert "content-encoding" not in fetch(path).headers, path
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    response = fetch("/stream")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert [json.loads(line)["chunk"] for line in response.text.splitlines()] == [0, 1, 2]
+
+
+def test_encoding_negotiation_honours_q_values():
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("*") in ("br", "gzip")
+    assert negotiate_encoding("deflate") is None
+
+
+def test_fields_select_nested_sections():
+    paths = parse_fields("art_classification.art_form_name, video_script.title,missing,video_script.nope")
+    assert project(STORY, paths) == {"art_classification": {"art_form_name": "Madhubani"},
+                                     "video_script": {"title": "The Peacock"}}
+    assert project(STORY, None) is STORY
+    for bad in ("", " , ", "video_script..title"):
+        with pytest.raises(ValueError):
+            parse_fields(bad)
+    assert FastJSONResponse({"a": "ü", 1: None}).body == '{"a":"ü","1":null}'.encode()
@@ -0,0 +1,59 @@
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+
+    async def load():
+        executions.append(1)
+        await asyncio.sleep(0.02)
+        return {"title": "Madhubani"}
+
+    async def run():
+        return await asyncio.gather(*(flight.do("story-1", load) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert len(executions) == 1
+    assert all(result == {"title": "Madhubani"} for result in results)
+    assert flight.stats == {"calls": 1, "coalesced": 9}
+    assert flight.in_flight == 0
+
+
+def test_errors_are_shared_and_not_cached():
+    flight = SingleFlight()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("firestore unavailable")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(attempts) == 1
+
+    asyncio.run(run())
+    assert len(attempts) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", slow))
+        second = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
@@ -0,0 +1,66 @@
+import asyncio
+import io
+import zipfile
+
+from image_pipeline import NormalizedImage
+from story_batch import FailedItemStore, batch_events, list_archive_items, run_bounded
+
+
+def test_run_bounded_caps_concurrency_and_yields_as_completed():
+    active, peak = 0, 0
+
+    async def process(delay):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(delay)
+        active -= 1
+        return {"delay": delay}
+
+    async def run():
+        return [r["delay"] async for r in run_bounded([0.05, 0.01, 0.03, 0.02], process, concurrency=2)]
+
+    results = asyncio.run(run())
+    assert results[0] == 0.01 and sorted(results) == [0.01, 0.02, 0.03, 0.05]
+    assert peak == 2
+
+
+def test_batch_events_report_progress_and_retry_url():
+    async def process(n):
+        if n == 2:
+            return {"index": n, "status": "error", "error": "quota", "retryable": True}
+        return {"index": n, "status": "ok"}
+
+    async def run():
+        return [event async for event in batch_events("b1", [1, 2, 3], process, "/retry", concurrency=3)]
+
+    events = asyncio.run(run())
+    assert events[0].startswith("event: start")
+    assert sum(e.startswith("event: item") for e in events) == 3
+    assert '"succeeded": 2, "failed": 1, "retryable": 1, "retry_url": "/retry"' in events[-1]
+
+
+def test_failed_items_are_kept_until_retried(tmp_path):
+    store = FailedItemStore(str(tmp_path / "batches.sqlite3"))
+    image = NormalizedImage(b"webp", "image/webp", 10, 20, 999)
+    store.save("b1", 3, "vase.jpg", "Pottery", "abc", image, "quota")
+    store.save("b1", 3, "vase.jpg", "Pottery", "abc", image, "timeout")
+
+    [item] = store.load("b1")
+    assert item["image"] == image
+    assert item["error"] == "timeout" and item["attempts"] == 2
+    assert store.load("other") == []
+
+    store.remove("b1", 3)
+    assert store.count() == 0
+
+
+def test_archive_folders_name_categories():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in ("Madhubani/peacock.jpg", "Madhubani/", "loose.png", "__MACOSX/._peacock.jpg", ".DS_Store"):
+            archive.writestr(name, b"x")
+
+    items = list_archive_items(zipfile.ZipFile(buffer), "Pottery")
+    assert [(i.index, i.name, i.category) for i in items] == [(0, "Madhubani/peacock.jpg", "Madhubani"),
+                                                              (1, "loose.png", "Pottery")]
@@ -0,0 +1,52 @@
+import pytest
+
+from benchmark import FakeFirestore
+from story_index import decode_cursor, encode_cursor, list_summaries, listing_item, story_summary
+
+STORY = {
+    "instagram_post": "Bright peacocks in natural pigments #Madhubani",
+    "product_description": "A hand-painted Madhubani peacock on handmade paper. Made in Bihar.",
+    "art_classification": {"art_form_name": " Madhubani ", "region_of_origin": "Bihar, India"},
+    "pricing_guidance": {"suggested_price_range": "$80 - $120"},
+    "video_script": {"title": "The Madhubani Peacock", "timeline": [{"time": "0-5s"}] * 3},
+    "marketplace_suggestions": [{"name": "Etsy"}],
+}
+
+
+def test_summary_keeps_only_gallery_fields():
+    summary = story_summary("abc", STORY, 1700000000.5)
+    assert listing_item(summary) == {
+        "id": "abc", "title": "The Madhubani Peacock", "art_form": "Madhubani",
+        "thumbnail_url": None, "price_range": "$80 - $120",
+    }
+    assert summary["art_form_key"] == "madhubani"
+
+    untitled = story_summary("def", {"product_description": STORY["product_description"]}, 1700000000.5)
+    assert untitled["title"] == "A hand-painted Madhubani peacock on handmade paper"
+    assert untitled["art_form_name"] is None
+
+
+def test_cursor_pages_through_newest_first_with_filter():
+    docs = [story_summary(f"s{i}", {"art_classification": {"art_form_name": "Bidriware" if i % 2 else "Madhubani"}},
+                          1700000000 + i // 2) for i in range(7)]
+    db = FakeFirestore()
+    db.collections["story_summaries"].update((doc["story_id"], doc) for doc in docs)
+
+    page, cursor = list_summaries(db, 3)
+    assert [s["story_id"] for s in page] == ["s6", "s5", "s4"]
+    assert "art_form_key" not in page[0]
+    page, cursor = list_summaries(db, 3, cursor)
+    assert [s["story_id"] for s in page] == ["s3", "s2", "s1"]
+    page, cursor = list_summaries(db, 3, cursor)
+    assert [s["story_id"] for s in page] == ["s0"] and cursor is None
+
+    page, cursor = list_summaries(db, 10, art_form="bidriware")
+    assert [s["story_id"] for s in page] == ["s5", "s3", "s1"] and cursor is None
+
+
+def test_malformed_cursors_are_rejected():
+    key = story_summary("abc", STORY, 1700000000.5)["sort_key"]
+    assert decode_cursor(encode_cursor(key)) == key
+    for cursor in ("not base64!", encode_cursor("yesterday-abc"), encode_cursor("1700000000.5")):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
@@ -0,0 +1,107 @@
+import asyncio
+
+from benchmark import FakeFirestore
+from story_store import STORY_MAX_ATTEMPTS, StorySpool, StoryWriter, new_story_id
+
+
+def failing_firestore(failures):
+    """A FakeFirestore whose first `failures` calls fail"""
+    db = FakeFirestore()
+    remaining = failures
+
+    def call():
+        nonlocal remaining
+        if remaining:
+            remaining -= 1
+            raise RuntimeError("firestore unavailable")
+
+    db._call = call
+    return db
+
+
+def test_story_ids_look_like_firestore_auto_ids():
+    ids = {new_story_id() for _ in range(100)}
+    assert len(ids) == 100
+    assert all(len(i) == 20 and i.isalnum() for i in ids)
+
+
+def test_submitted_stories_reach_firestore(tmp_path):
+    db = FakeFirestore()
+    writer = StoryWriter(db, StorySpool(str(tmp_path / "spool.sqlite3")))
+
+    async def run():
+        ids = await asyncio.gather(*(writer.submit({"instagram_post": f"post {i}"}) for i in range(3)))
+        await writer.stop()
+        return ids
+
+    ids = asyncio.run(run())
+    assert db.docs[ids[2]] == {"instagram_post": "post 2"}
+    assert writer.status()["pending"] == 0
+
+
+def test_pending_stories_are_flushed_in_one_batch(tmp_path):
+    db = FakeFirestore()
+    writer = StoryWriter(db, StorySpool(str(tmp_path / "spool.sqlite3")), batch_size=10)
+    for i in range(5):
+        writer.spool.add(f"story{i}", {"instagram_post": f"post {i}"})
+
+    assert asyncio.run(writer.flush()) == 5
+    assert db.commits == 1
+    # Each story and its gallery summary
+    story_ids = [f"story{i}" for i in range(5)]
+    assert sorted(db.collections["stories"]) == sorted(db.collections["story_summaries"]) == story_ids
+    assert db.collections["story_summaries"]["story3"]["title"] == "post 3"
+
+
+def test_failed_commits_stay_spooled_for_retry(tmp_path):
+    db = failing_firestore(1)
+    spool_path = str(tmp_path / "spool.sqlite3")
+    writer = StoryWriter(db, StorySpool(spool_path))
+
+    async def run():
+        story_id = await writer.submit({"instagram_post": "post"})
+        await writer.stop()
+        # Not in Firestore yet, but still readable from the spool
+        assert await writer.get_pending(story_id) == {"instagram_post": "post"}
+        return story_id
+
+    story_id = asyncio.run(run())
+    assert db.docs == {}
+    assert writer.stats["failed_attempts"] >= 1
+
+    # A restarted process picks the story up from the spool once its retry is due
+    restarted = StoryWriter(db, StorySpool(spool_path))
+    restarted.spool._conn.execute("UPDATE pending_stories SET next_attempt_at = 0")
+    assert asyncio.run(restarted.flush()) == 1
+    assert db.docs[story_id] == {"instagram_post": "post"}
+
+
+def test_a_rejected_story_does_not_hold_back_its_batch(tmp_path):
+    db = FakeFirestore()
+    db.rejected.add("story3")
+    writer = StoryWriter(db, StorySpool(str(tmp_path / "spool.sqlite3")), batch_size=10)
+    for i in range(8):
+        writer.spool.add(f"story{i}", {"instagram_post": f"post {i}"})
+
+    assert asyncio.run(writer.flush()) == 7
+    assert "story3" not in db.docs
+    assert all(f"story{i}" in db.docs for i in range(8) if i != 3)
+    assert writer.spool.count() == 1
+
+    # Retried on its own until it is set aside, never blocking newer stories
+    for attempt in range(1, STORY_MAX_ATTEMPTS):
+        writer.spool._conn.execute("UPDATE pending_stories SET next_attempt_at = 0")
+        writer.spool.add(f"new{attempt}", {"instagram_post": "new"})
+        assert asyncio.run(writer.flush()) == 1
+    assert writer.spool.get("story3") is None
+    assert writer.status()["pending"] == 0 and writer.status()["rejected"] == 1
+
+
+def test_stories_are_not_set_aside_while_firestore_is_down(tmp_path):
+    db = failing_firestore(1000)
+    writer = StoryWriter(db, StorySpool(str(tmp_path / "spool.sqlite3")))
+    writer.spool.add("story0", {"instagram_post": "post"})
+    for _ in range(STORY_MAX_ATTEMPTS + 1):
+        writer.spool._conn.execute("UPDATE pending_stories SET next_attempt_at = 0")
+        assert asyncio.run(writer.flush()) == 0
+    assert writer.status()["pending"] == 1 and writer.status()["rejected"] == 0
@@ -0,0 +1,102 @@
+import asyncio
+import base64
+import json
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from streaming import DataURLStreamDecoder, IncrementalJSONObjectParser, SSEResponse, format_sse
+
+STORY = {
+    "instagram_post": "Hand-painted {Madhubani} art, \"made with love\" #madhubani",
+    "product_features": ["Natural Pigments", "Handmade Paper"],
+    "art_classification": {"art_form_name": "Madhubani", "traditional_techniques": ["Line work"]},
+    "video_script": {"timeline": [{"time": "0-5s", "audio": {"sfx": "brush, paper"}}]},
+}
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalJSONObjectParser()
+    members = []
+    for i in range(0, len(text), size):
+        members.extend(parser.feed(text[i:i + size]))
+    return parser, members
+
+
+def test_emits_every_top_level_member_in_order():
+    text = "```json\n" + json.dumps(STORY, indent=2) + "\n```"
+    for size in (1, 7, 64, len(text)):
+        parser, members = feed_in_chunks(text, size)
+        assert parser.done
+        assert members == list(STORY.items())
+
+
+def test_members_are_emitted_before_the_object_closes():
+    text = json.dumps(STORY)
+    cut = text.index('"product_features"')
+    parser = IncrementalJSONObjectParser()
+    assert parser.feed(text[:cut]) == [("instagram_post", STORY["instagram_post"])]
+    assert not parser.done
+
+
+def decode_in_chunks(body: bytes, size: int):
+    decoder = DataURLStreamDecoder()
+    decoded = b"".join(b"".join(decoder.feed(body[i:i + size])) for i in range(0, len(body), size))
+    return decoder, decoded
+
+
+def test_image_is_decoded_from_every_message_shape():
+    image = bytes(range(256)) * 40 + b"tail"
+    url = "data:image/webp;base64," + base64.b64encode(image).decode()
+    shapes = [
+        {"images": [{"type": "image_url", "image_url": {"url": url}}]},
+        {"content": [{"type": "text", "text": "data:image/png;base64,AAAA"},
+                     {"type": "image_url", "image_url": {"url": url}}]},
+        {"content": url},
+    ]
+    for message in shapes:
+        body = json.dumps({"id": "gen-1", "choices": [{"message": {"role": "assistant", **message}}],
+                           "usage": {"total_tokens": 1290, "cost": None}})
+        for escaped in (False, True):
+            # Some encoders escape "/" as "\/", which also appears in base64
+            raw = (body.replace("/", "\\/") if escaped else body).encode()
+            for size in (1, 13, 4096, len(raw)):
+                decoder, decoded = decode_in_chunks(raw, size)
+                assert decoded == image
+                assert decoder.mime_type == "image/webp" and decoder.done
+
+
+def test_missing_image_reports_message_fields_and_errors():
+    decoder, decoded = decode_in_chunks(json.dumps({"choices": [{"message": {"content": "Sorry"}}]}).encode(), 5)
+    assert decoded == b"" and not decoder.found
+    assert decoder.message_keys == ["content"]
+
+    decoder, _ = decode_in_chunks(json.dumps({"error": {"message": "Quota \"exceeded\"", "code": 402}}).encode(), 3)
+    assert decoder.error_message == 'Quota "exceeded"'
+
+
+def test_format_sse():
+    assert format_sse("section", {"key": "a"}) == 'event: section\ndata: {"key": "a"}\n\n'
+
+
+def test_sse_response_closes_even_if_the_stream_never_starts():
+    closed = []
+
+    async def events():
+        try:
+            yield format_sse("stage", {})
+        finally:
+            closed.append("generator")
+
+    async def broken_send(message):
+        raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    response = SSEResponse(events(), on_close=lambda: closed.append("response"))
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response(scope, receive, broken_send))
+    assert closed == ["response"]
+    assert response.headers["content-type"].startswith("text/event-stream")
@@ -0,0 +1,88 @@
+import asyncio
+import io
+import os
+
+from fastapi import HTTPException, UploadFile
+
+import upload_intake
+from upload_intake import BodySizeLimitMiddleware, read_upload, sniff_image_type, upload_from_bytes
+
+JPEG_HEAD = b"\xff\xd8\xff\xe0"
+ALLOWED = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+
+def make_upload(content, filename="photo.jpg"):
+    return UploadFile(io.BytesIO(content), filename=filename)
+
+
+def test_sniff_image_type_uses_magic_bytes():
+    assert sniff_image_type(JPEG_HEAD) == "image/jpeg"
+    assert sniff_image_type(b"\x89PNG\r\n\x1a\n....") == "image/png"
+    assert sniff_image_type(b"GIF89a....") == "image/gif"
+    assert sniff_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_image_type(b"<html>") is None
+
+
+def test_rejects_non_images_whatever_the_filename():
+    upload = make_upload(b"<?php echo 1; ?>")
+    try:
+        asyncio.run(read_upload(upload, 1024, ALLOWED))
+    except HTTPException as e:
+        assert e.status_code == 400
+    else:
+        raise AssertionError("expected a 400")
+    assert upload.file.closed
+
+
+def test_rejects_oversized_uploads_with_413():
+    try:
+        asyncio.run(read_upload(make_upload(JPEG_HEAD + b"0" * 300_000), 200_000, ALLOWED))
+    except HTTPException as e:
+        assert e.status_code == 413
+    else:
+        raise AssertionError("expected a 413")
+
+
+def test_large_uploads_are_spooled_to_disk(monkeypatch):
+    monkeypatch.setattr(upload_intake, "SPOOL_THRESHOLD", 100_000)
+    content = JPEG_HEAD + b"0" * 250_000
+    upload = asyncio.run(read_upload(make_upload(content), 1_000_000, ALLOWED))
+    try:
+        assert upload.path and os.path.exists(upload.path)
+        assert upload.source == upload.path
+        assert upload.read_bytes() == content
+        assert upload.peak_buffered_bytes <= 100_000
+    finally:
+        upload.close()
+    assert not os.path.exists(upload.path)
+
+
+def test_middleware_rejects_streamed_body_past_the_limit():
+    async def app(scope, receive, send):
+        while (await receive()).get("more_body"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    chunks = [{"type": "http.request", "body": b"x" * 1000, "more_body": True} for _ in range(10)]
+    sent = []
+
+    async def receive():
+        return chunks.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = BodySizeLimitMiddleware(app, max_body_size=2500)
+    scope = {"type": "http", "method": "POST", "path": "/generate-story", "headers": []}
+    asyncio.run(middleware(scope, receive, send))
+    assert sent[0]["status"] == 413
+    assert len(chunks) == 7
+
+
+def test_archive_members_are_counted_in_the_stats():
+    uploads = upload_intake.stats["uploads"]
+    upload = upload_from_bytes("piece.jpg", JPEG_HEAD + b"0" * 1000, 1_000_000, ALLOWED)
+    upload.close()
+    assert upload_intake.stats["uploads"] == uploads + 1
+    assert upload_intake.stats["last_peak_buffered_bytes"] == 1004
@@ -0,0 +1,246 @@
+"""
+Upload intake: size limits, type sniffing and spooling.
+
+What bounds a request is BodySizeLimitMiddleware. It rejects an oversized
+body from its Content-Length, or as soon as the streamed body crosses the
+limit, before the multipart parser has buffered it. Whatever gets past it
+is parsed by Starlette, which spools each file itself (in memory up to
+1 MiB, then to disk) before the endpoint runs.
+
+read_upload then copies a file out of that spool in chunks: the image type
+is sniffed from the magic bytes of the first chunk, the per-file limit is
+checked, and anything above SPOOL_THRESHOLD goes to a temp file of our own,
+so this copy never holds more than that in memory. The buffered-bytes stats
+describe this copy only, not the request as a whole.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Running totals reported on /status
+stats = {
+    "uploads": 0,
+    "spooled_to_disk": 0,
+    "rejected_too_large": 0,  # a single file over its limit
+    "rejected_body_too_large": 0,  # whole requests, by BodySizeLimitMiddleware
+    "rejected_bad_type": 0,
+    # Largest in-memory copy read_upload/upload_from_bytes held of one file
+    "peak_buffered_bytes": 0,
+    "last_peak_buffered_bytes": 0,
+}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Identify an image from its magic bytes, ignoring what the client claims"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class IntakeUpload:
+    """An accepted upload, held in memory or spooled to a temp file"""
+
+    def __init__(self, filename: str, mime_type: str):
+        self.filename = filename
+        self.mime_type = mime_type
+        self.size = 0
+        self.sha256 = ""
+        self.path: Optional[str] = None
+        self._buffer: Optional[bytearray] = bytearray()
+        self._spool = None
+        self.peak_buffered_bytes = 0
+
+    def _write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._buffer is not None and self.size > SPOOL_THRESHOLD:
+            self._spool = tempfile.NamedTemporaryFile(prefix="upload_", dir=UPLOAD_SPOOL_DIR, delete=False)
+            self.path = self._spool.name
+            self._spool.write(self._buffer)
+            self._buffer = None
+        if self._buffer is not None:
+            self._buffer.extend(chunk)
+            self.peak_buffered_bytes = max(self.peak_buffered_bytes, len(self._buffer))
+        else:
+            self._spool.write(chunk)
+            self.peak_buffered_bytes = max(self.peak_buffered_bytes, len(chunk))
+
+    def _finish(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """The in-memory bytes, or the spool file path for large uploads"""
+        return bytes(self._buffer) if self._buffer is not None else self.path
+
+    def read_bytes(self) -> bytes:
+        if self._buffer is not None:
+            return bytes(self._buffer)
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        self._finish()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def read_upload(file: UploadFile, max_size: int, allowed_mime_types) -> IntakeUpload:
+    """
+    Copies an UploadFile out of Starlette's spool chunk by chunk. Raises 400
+    when the first chunk isn't an allowed image and 413 once the copy passes
+    `max_size` (the request body limit is BodySizeLimitMiddleware's job).
+    """
+    upload = None
+    try:
+        chunk = await file.read(CHUNK_SIZE)
+        mime_type = sniff_image_type(chunk)
+        if mime_type not in allowed_mime_types:
+            stats["rejected_bad_type"] += 1
+            raise HTTPException(status_code=400, detail="Invalid file type. Allowed: JPG, JPEG, PNG, GIF, WEBP")
+
+        upload = IntakeUpload(file.filename or "upload", mime_type)
+        hasher = hashlib.sha256()
+        while chunk:
+            if upload.size + len(chunk) > max_size:
+                stats["rejected_too_large"] += 1
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size: {max_size // (1024*1024)}MB"
+                )
+            hasher.update(chunk)
+            upload._write(chunk)
+            chunk = await file.read(CHUNK_SIZE)
+    except BaseException:
+        if upload is not None:
+            upload.close()
+        raise
+    finally:
+        await file.close()
+
+    upload._finish()
+    upload.sha256 = hasher.hexdigest()
+    _record(upload)
+    return upload
+
+
+def upload_from_bytes(filename: str, data: bytes, max_size: int, allowed_mime_types) -> IntakeUpload:
+    """
+    Accepts an image that is already in memory (e.g. a member of a zip
+    archive) with the same checks and bookkeeping as read_upload
+    """
+    mime_type = sniff_image_type(data[:CHUNK_SIZE])
+    if mime_type not in allowed_mime_types:
+        stats["rejected_bad_type"] += 1
+        raise HTTPException(status_code=400, detail="Invalid file type. Allowed: JPG, JPEG, PNG, GIF, WEBP")
+    if len(data) > max_size:
+        stats["rejected_too_large"] += 1
+        raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {max_size // (1024*1024)}MB")
+
+    upload = IntakeUpload(filename, mime_type)
+    upload._write(data)
+    upload._finish()
+    upload.sha256 = hashlib.sha256(data).hexdigest()
+    _record(upload)
+    return upload
+
+
+def _record(upload: IntakeUpload):
+    stats["uploads"] += 1
+    stats["spooled_to_disk"] += upload.path is not None
+    stats["last_peak_buffered_bytes"] = upload.peak_buffered_bytes
+    stats["peak_buffered_bytes"] = max(stats["peak_buffered_bytes"], upload.peak_buffered_bytes)
+
+
+class BodyTooLarge(HTTPException):
+    """Raised from receive() so FastAPI's body parsing surfaces it as a 413"""
+
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Request too large. Maximum size: {limit // (1024*1024)}MB")
+
+
+class BodySizeLimitMiddleware:
+    """
+    Rejects request bodies larger than `max_body_size` with 413 - up front
+    when Content-Length says so, otherwise as soon as the streamed body
+    crosses the limit. `path_limits` overrides the limit per path prefix.
+    """
+
+    def __init__(self, app, max_body_size: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_limits = path_limits or {}
+
+    def limit_for(self, path: str) -> int:
+        for prefix, limit in self.path_limits.items():
+            if path.startswith(prefix):
+                return limit
+        return self.max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        limit = self.limit_for(scope["path"])
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"").decode()
+        if content_length.isdigit() and int(content_length) > limit:
+            stats["rejected_body_too_large"] += 1
+            return await self._reject(send, limit)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    stats["rejected_body_too_large"] += 1
+                    raise BodyTooLarge(limit)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge:
+            if not response_started:
+                await self._reject(send, limit)
+
+    async def _reject(self, send, limit: int):
+        body = json.dumps({"detail": f"Request too large. Maximum size: {limit // (1024*1024)}MB"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})